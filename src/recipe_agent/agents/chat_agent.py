@@ -1,9 +1,13 @@
 import logging
 import os
+from contextlib import aclosing
+from typing import AsyncIterator, Optional
 
+from recipe_agent.agents.intent_router import INTENT_ROUTER, Intent
 from recipe_agent.chat_history import ChatHistory
-from recipe_agent.openrouter_chat import openrouter_chat_request
-from recipe_agent.recipe_config import LLM_PROVIDER, SAVE_RECIPE_TERM
+from recipe_agent.recipe import Recipe
+from recipe_agent.model_router import LLM_ROUTER, Task
+from recipe_agent.recipe_config import SAVE_RECIPE_TERM
 
 
 SYS_PROMPT_INSTRUCTIONS = """
@@ -27,6 +31,12 @@ Du bist ein RezeptBot und kannst aus Links zu Webseiten Rezepte extrahieren.
 SYS_PROMPT_LINK += (f"Der Benutzer kann das Kürzel {SAVE_RECIPE_TERM} senden um Rezepte permanent "
                     f"auf einer Nextcloud Instanz zu speichern.")
 
+SYS_PROMPT_HISTORY_SUMMARY = """
+Du fasst den bisherigen Verlauf eines Chats zwischen einem Benutzer und einem RezeptBot zusammen.
+Ergänze die bisherige Zusammenfassung um die neuen Nachrichten. Antworte nur mit der Zusammenfassung
+in höchstens drei kurzen Sätzen, nenne dabei Rezeptnamen und Links.
+"""
+
 ERROR_RESPONSE = "Ein Fehler ist aufgetreten. Bitte versuche es später noch einmal."
 
 
@@ -41,37 +51,139 @@ async def answer_message(username: str, message: str, history: ChatHistory, cust
                   f"hat diese Nachricht ohne Links geschickt: "
                   f"{message}\n") if not custom_prompt else custom_prompt
 
-        history.add_user_message(username, prompt, _create_sys_prompt(SYS_PROMPT_NO_LINK))
+        async with history.lock(username):
+            # -- Routine messages are answered from templates without the LLM
+            response = INTENT_ROUTER.answer(username, message, history, prompt) if not custom_prompt else None
+            if response:
+                return response
+
+            history.add_user_message(username, prompt, _create_sys_prompt(SYS_PROMPT_NO_LINK))
 
-        response = await openrouter_chat_request(
-            LLM_PROVIDER,
-            history.get_messages(username),
-            options={'stream': True}
-        )
+            response = await LLM_ROUTER.request(
+                Task.CHAT,
+                history.get_messages(username),
+                options={'stream': True}
+            )
 
-        history.add_assistant_response(username, response)
-        return response
+            history.add_assistant_response(username, response)
+            return response
     except Exception as e:
         logging.error(e)
         return ERROR_RESPONSE
 
 
-async def answer_message_with_link(username: str, message: str, history: ChatHistory) -> str:
+async def answer_message_stream(username: str, message: str, history: ChatHistory) -> AsyncIterator[str]:
+    """ Wie answer_message, liefert die Antwort aber schrittweise als wachsenden Text """
+    response = str()
     try:
         message = message[:2000]
-        prompt = (f'Der Benutzer {username} hat einen Link mit Nachricht: \"{message}\" geschickt. '
-                  f'Antworte sehr kurz das du dir den Link nun anschaust. Wenn die Nachricht "{SAVE_RECIPE_TERM}" enthält, '
-                  f'bestätige das du das Rezept im Nextcloud Kochbuch speicherst.')
-        history.add_user_message(username, prompt, _create_sys_prompt(SYS_PROMPT_LINK))
-
-        response = await openrouter_chat_request(
-            LLM_PROVIDER,
-            history.get_messages(username),
-            options={'stream': True}
-        )
-
-        history.add_assistant_response(username, response)
-        return response
+        prompt = (f"Der Benutzer {username} "
+                  f"hat diese Nachricht ohne Links geschickt: "
+                  f"{message}\n")
+
+        async with history.lock(username):
+            # -- Routine messages are answered from templates without the LLM
+            template_response = INTENT_ROUTER.answer(username, message, history, prompt)
+            if template_response:
+                yield template_response
+                return
+
+            history.add_user_message(username, prompt, _create_sys_prompt(SYS_PROMPT_NO_LINK))
+
+            async with aclosing(LLM_ROUTER.stream(Task.CHAT, history.get_messages(username))) as stream:
+                async for delta in stream:
+                    response += delta
+                    yield response
+
+            history.add_assistant_response(username, response)
+    except Exception as e:
+        logging.error(e)
+        yield ERROR_RESPONSE
+
+
+LINK_ACK_RESPONSE = "Ich schaue mir den Link gleich an!"
+LINK_ACK_SAVE_RESPONSE = "Ich schaue mir den Link an und speichere das Rezept im Nextcloud Kochbuch."
+
+
+def _link_prompt(username: str, message: str) -> str:
+    message = message[:2000]
+    return (f'Der Benutzer {username} hat einen Link mit Nachricht: \"{message}\" geschickt. '
+            f'Antworte sehr kurz das du dir den Link nun anschaust. Wenn die Nachricht "{SAVE_RECIPE_TERM}" enthält, '
+            f'bestätige das du das Rezept im Nextcloud Kochbuch speicherst.')
+
+
+def _link_ack_response(message: str) -> str:
+    return LINK_ACK_SAVE_RESPONSE if SAVE_RECIPE_TERM in message else LINK_ACK_RESPONSE
+
+
+async def answer_message_with_link(username: str, message: str, history: ChatHistory) -> str:
+    """ Bestätigt den Link mit dem LLM
+
+    Wird die Anfrage abgebrochen, weil das Rezept schneller war, oder schlägt sie fehl, wird die
+    Gesprächsrunde mit der Vorlage aus acknowledge_link abgeschlossen, damit keine Benutzernachricht
+    ohne Antwort im Verlauf bleibt.
+    """
+    try:
+        async with history.lock(username):
+            history.add_user_message(username, _link_prompt(username, message), _create_sys_prompt(SYS_PROMPT_LINK))
+
+            try:
+                response = await LLM_ROUTER.request(
+                    Task.CHAT,
+                    history.get_messages(username),
+                    options={'stream': True}
+                )
+            except BaseException:
+                history.add_assistant_response(username, _link_ack_response(message))
+                raise
+
+            history.add_assistant_response(username, response)
+            return response
     except Exception as e:
         logging.error(e)
         return ERROR_RESPONSE
+
+
+def acknowledge_link(username: str, message: str, history: ChatHistory) -> str:
+    """ Instant templated answer_message_with_link without a LLM round trip """
+    history.add_user_message(username, _link_prompt(username, message), _create_sys_prompt(SYS_PROMPT_LINK))
+    response = _link_ack_response(message)
+    history.add_assistant_response(username, response)
+    return response
+
+
+def confirm_save(username: str, message: str, recipe_name: str, history: ChatHistory) -> str:
+    """ Templated confirmation that a previously sent recipe is saved in the background """
+    history.add_user_message(username, f"Der Benutzer {username} hat das Speichern des zuletzt gesendeten "
+                                       f"Rezeptes angefragt: {message[:2000]}")
+    response = f"Alles klar, {recipe_name} wird jetzt im Hintergrund in deinem Nextcloud Kochbuch gespeichert."
+    history.add_assistant_response(username, response)
+    INTENT_ROUTER.count(Intent.SAVE)
+    return response
+
+
+def requested_recipe(username: str, message: str, history: ChatHistory) -> Optional[Recipe]:
+    """ The last sent recipe if the user asks to show it again, only a reference is kept in the history """
+    if INTENT_ROUTER.classify(message) != Intent.SHOW_RECIPE:
+        return None
+
+    recipe = history.get_last_recipe(username)
+    if recipe is not None:
+        INTENT_ROUTER.count(Intent.SHOW_RECIPE)
+    return recipe
+
+
+def is_save_request(message: str) -> bool:
+    """ Message contains the save term or is a plain save confirmation like "ja speichern" """
+    return SAVE_RECIPE_TERM in message or INTENT_ROUTER.classify(message) == Intent.SAVE
+
+
+async def summarize_history(summary: str, messages: list) -> str:
+    """ Rolling summary of messages that fell out of the chat history window """
+    conversation = "\n".join(f"{m['role']}: {m['content'][:2000]}" for m in messages)
+    return await LLM_ROUTER.request(
+        Task.HISTORY,
+        [{'role': 'system', 'content': SYS_PROMPT_HISTORY_SUMMARY[1:]},
+         {'role': 'user', 'content': f"Bisherige Zusammenfassung: {summary or '-'}\n\nNeue Nachrichten:\n{conversation}"}],
+        options={'stream': True, "temperature": 0, "max_tokens": 256}
+    )
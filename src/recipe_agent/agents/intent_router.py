@@ -0,0 +1,119 @@
+""" Local intent classification in front of the chat agent
+
+Greetings, thanks, help requests, save confirmations and requests to show the last recipe again
+make up most of the chat messages. They are recognized with keyword rules and answered from
+templates in microseconds, only open-ended messages are escalated to the LLM.
+"""
+import logging
+import random
+import re
+from collections import Counter
+from enum import Enum
+from typing import Optional
+
+from recipe_agent.chat_history import ChatHistory
+from recipe_agent.recipe_config import SAVE_RECIPE_TERM
+
+# Longer messages are likely open-ended even if they start with a greeting
+MAX_ROUTINE_MESSAGE_LENGTH = 60
+
+
+class Intent(str, Enum):
+    GREETING = "greeting"
+    THANKS = "thanks"
+    GOODBYE = "goodbye"
+    HELP = "help"
+    ACK = "ack"
+    SAVE = "save"
+    SHOW_RECIPE = "show_recipe"
+    CHAT = "chat"
+
+
+def _rule(pattern: str) -> re.Pattern:
+    # -- An optional form of address may follow, eg. "hallo bot", "danke dir"
+    return re.compile(rf"^(?:{pattern})(?: (?:du|dir|bot|rezeptbot|\w+bot))?$")
+
+
+RULES = [
+    (Intent.SAVE, _rule(rf"(?:ja |ok |okay |bitte )?(?:{re.escape(SAVE_RECIPE_TERM.strip('!'))}|speicher[nt]?|"
+                        r"abspeichern|sichern)(?: (?:das|es|bitte|das rezept|rezept|ab))*")),
+    (Intent.SHOW_RECIPE, _rule(r"(?:bitte )?(?:zeig|zeige|schick|schicke|sende)(?: mir)?(?: bitte)?"
+                               r"(?: das| dieses| nochmal das)? (?:letzte )?rezept(?: nochmal| noch mal| bitte)*|"
+                               r"(?:das )?rezept(?: bitte)? (?:nochmal|noch mal)")),
+    (Intent.GREETING, _rule(r"hallo|hi|hey|huhu|moin(?: moin)?|servus|hello|guten (?:morgen|tag|abend)|"
+                            r"grüß gott|grüezi|na")),
+    (Intent.THANKS, _rule(r"(?:super |cool |top |perfekt |ok |okay )?(?:danke(?: schön| sehr)?|dankeschön|"
+                          r"vielen dank|thx|thanks|merci)")),
+    (Intent.GOODBYE, _rule(r"tschüss|tschüs|ciao|bye|bis dann|bis später|gute nacht")),
+    (Intent.HELP, _rule(r"hilfe|help|start|was kannst du|was kannst du alles|wie funktioniert das|"
+                        r"wie geht das")),
+    (Intent.ACK, _rule(r"ok|okay|alles klar|cool|super|top|perfekt|prima|klasse|gut|nice|lecker")),
+]
+
+TEMPLATES = {
+    Intent.GREETING: ["Hey! Schick mir einen Link zu einem Rezept und ich hole dir Zutaten und Zubereitung.",
+                      "Hallo! Welches Rezept soll ich mir anschauen? Schick mir einfach den Link."],
+    Intent.THANKS: ["Gern geschehen! Guten Appetit!", "Immer gerne! Lass es dir schmecken."],
+    Intent.GOODBYE: ["Bis bald und guten Appetit!", "Tschüss! Ich bin da, wenn du das nächste Rezept hast."],
+    Intent.HELP: [f"Schick mir einen Link zu einem Rezept, z.B. https://beispiel.de/dein-rezept, und ich schicke "
+                  f"dir die Zutaten und Zubereitung ohne das Drumherum. Schreibe {SAVE_RECIPE_TERM} dazu, wenn "
+                  f"du das Rezept in deinem Nextcloud Kochbuch speichern möchtest."],
+    Intent.ACK: ["👍", "Alles klar!"],
+}
+
+
+def normalize_message(message: str) -> str:
+    message = re.sub(r"[^\w\s!]", " ", message.lower())
+    return re.sub(r"\s+", " ", message).strip(" !")
+
+
+class IntentRouter:
+    def __init__(self):
+        self.handled: Counter = Counter()
+        self.escalated = 0
+
+    @property
+    def saved_llm_calls(self) -> int:
+        return sum(self.handled.values())
+
+    def classify(self, message: str) -> Intent:
+        if len(message) > MAX_ROUTINE_MESSAGE_LENGTH:
+            return Intent.CHAT
+
+        normalized = normalize_message(message)
+        for intent, pattern in RULES:
+            if pattern.match(normalized):
+                return intent
+        return Intent.CHAT
+
+    def answer(self, username: str, message: str, history: ChatHistory, prompt: str) -> Optional[str]:
+        """ Answer routine messages from a template
+
+        Args:
+            prompt: The user prompt that is recorded in the history like a LLM request would
+
+        Returns:
+            The templated answer or None if the message has to be answered by the LLM
+        """
+        intent = self.classify(message)
+        if intent not in TEMPLATES:
+            self.escalated += 1
+            return None
+
+        response = random.choice(TEMPLATES[intent])
+        history.add_user_message(username, prompt)
+        history.add_assistant_response(username, response)
+        self.count(intent)
+        return response
+
+    def count(self, intent: Intent):
+        """ Count a LLM call that was saved by handling intent locally """
+        self.handled[intent] += 1
+        logging.info(f"Answered {intent.value} intent locally: {self.stats()}")
+
+    def stats(self) -> dict:
+        return {"saved_llm_calls": self.saved_llm_calls, "escalated": self.escalated,
+                **{intent.value: count for intent, count in self.handled.items()}}
+
+
+INTENT_ROUTER = IntentRouter()
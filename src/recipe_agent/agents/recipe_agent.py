@@ -1,16 +1,66 @@
 import asyncio
 import json
 import logging
-import re
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 
-from crawl4ai import AsyncWebCrawler, CrawlResult
+from pydantic import BaseModel
 
 from recipe_agent import recipe
+from recipe_agent.crawl_cache import crawl_page
+from recipe_agent.executors import EXECUTORS
+from recipe_agent.extraction_cache import EXTRACTION_CACHE
 from recipe_agent.io.cookbook_api import upload_recipe
-from recipe_agent.recipe import RecipeLLM
-from recipe_agent.openrouter_chat import openrouter_chat_request
-from recipe_agent.recipe_config import BASE_BROWSER, LL_EXTRACTION_STRATEGY, LLM_PROVIDER, CRAWL_CONFIG
-from recipe_agent.utils import exception_and_traceback, get_link_preview_image_url
+from recipe_agent.model_router import LLM_ROUTER, Task
+from recipe_agent.page_reducer import chunk_page, merge_recipe_llms
+from recipe_agent.recipe import Recipe, RecipeLLM
+from recipe_agent.recipe_config import (LL_EXTRACTION_STRATEGY, CRAWL_CONFIG, RECIPE_MAX_CONCURRENCY,
+                                        RECIPE_MAX_CONCURRENCY_PER_USER, RECIPE_DELIVERY_ORDER,
+                                        EXTRACTION_TOKEN_BUDGET, EXTRACTION_MAX_CHUNKS, STRUCTURED_RECIPE_PROBE)
+from recipe_agent.single_flight import SingleFlight
+from recipe_agent.structured_recipe import fetch_structured_recipe, usable_recipe
+from recipe_agent.utils import clean_markdown, exception_and_traceback, get_link_preview_image_url, normalize_url
+
+
+class ScrapeResult(BaseModel):
+    url: str
+    recipe: Optional[Recipe] = None
+    error: str = ""
+
+
+class ScrapeLimiter:
+    """ Limits concurrent recipe scrapes globally and per user """
+
+    def __init__(self, max_concurrency: int = RECIPE_MAX_CONCURRENCY,
+                 max_concurrency_per_user: int = RECIPE_MAX_CONCURRENCY_PER_USER):
+        self._max_concurrency = max(1, max_concurrency)
+        self._max_concurrency_per_user = max(1, max_concurrency_per_user)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        # user -> (semaphore, number of scrapes holding or waiting for it)
+        self._user_semaphores: Dict[str, Tuple[asyncio.Semaphore, int]] = dict()
+
+    @asynccontextmanager
+    async def acquire(self, user: str):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+
+        user_semaphore, users = self._user_semaphores.get(
+            user, (asyncio.Semaphore(self._max_concurrency_per_user), 0))
+        self._user_semaphores[user] = (user_semaphore, users + 1)
+
+        try:
+            async with user_semaphore, self._semaphore:
+                yield
+        finally:
+            user_semaphore, users = self._user_semaphores[user]
+            if users <= 1:
+                self._user_semaphores.pop(user)
+            else:
+                self._user_semaphores[user] = (user_semaphore, users - 1)
+
+
+SCRAPE_LIMITER = ScrapeLimiter()
+SCRAPE_FLIGHTS = SingleFlight("scrape_recipe")
 
 
 async def process_with_openrouter(crawled_markdown: str, url: str) -> str:
@@ -20,25 +70,68 @@ async def process_with_openrouter(crawled_markdown: str, url: str) -> str:
     :param url:
     :return:
     """
-    crawled_markdown = re.sub(r"\s\||(?:\(http.*\)|(?:\[|]))", "", crawled_markdown)
+    # -- Large pages keep the regex busy for a while, it runs in the process pool
+    crawled_markdown = await EXECUTORS.run_cpu(clean_markdown, crawled_markdown)
+
+    # -- Unchanged page content was already extracted by one of the route's models with the same
+    #    instruction and schema
+    res_format = RecipeLLM.get_in_openai_format()
+
+    def _cache_key(model: str) -> str:
+        return EXTRACTION_CACHE.key(model, res_format, LL_EXTRACTION_STRATEGY.instruction, crawled_markdown)
+
+    cache_keys = [_cache_key(model) for model in LLM_ROUTER.models(Task.EXTRACTION)]
+    cached_recipe = await EXECUTORS.run_io(EXTRACTION_CACHE.get_any, cache_keys)
+    if cached_recipe is not None:
+        logging.info(f"Extraction cache hit for {url}")
+        cached_recipe.url = url
+        return cached_recipe.model_dump_json(by_alias=True)
+
+    # -- Only send the recipe relevant sections, oversized pages are extracted chunk by chunk
+    model = LLM_ROUTER.routes[Task.EXTRACTION].models[0]
+    # -- Tokenizing the whole page takes long, it must not block the other chats
+    chunks = await EXECUTORS.run_cpu(chunk_page, crawled_markdown, model, EXTRACTION_TOKEN_BUDGET,
+                                     EXTRACTION_MAX_CHUNKS)
+    answers = await asyncio.gather(*(_extract_chunk(chunk, url, res_format) for chunk in chunks))
+    responses, models = [response for response, _ in answers], {model for _, model in answers}
+
+    if len(responses) == 1:
+        response = responses[0]
+    else:
+        logging.info(f"Merging extractions of {len(responses)} chunks of {url}")
+        response = merge_recipe_llms([RecipeLLM(**json.loads(r)) for r in responses]).model_dump_json(by_alias=True)
+
+    # -- Cached under the model that answered, chunks answered by different models are not cached
+    if len(models) == 1:
+        model = models.pop()
+        await EXECUTORS.run_io(EXTRACTION_CACHE.put, _cache_key(model), RecipeLLM(**json.loads(response)), url,
+                               model)
+    return response
+
+
+async def _extract_chunk(markdown: str, url: str, res_format: dict) -> Tuple[str, str]:
     content = LL_EXTRACTION_STRATEGY.instruction
-    content += f'\nUrl: {url} Context: {crawled_markdown}'
+    content += f'\nUrl: {url} Context: {markdown}'
     message = {'role': 'user', 'content': content}
 
     logging.info(f"Message to LLM: [{len(message['content'])}] {message}")
 
-    response = await openrouter_chat_request(
-        LLM_PROVIDER,
+    # -- Answers that do not validate against the schema fall back to the next model of the route
+    return await LLM_ROUTER.request_with_model(
+        Task.EXTRACTION,
         [message],
-        RecipeLLM.get_in_openai_format(),
+        res_format,
         LL_EXTRACTION_STRATEGY.extra_args,
+        validate=lambda r: RecipeLLM(**json.loads(r)),
     )
 
-    return response
 
+async def extract_recipe_with_browser(url) -> Tuple[recipe.Recipe, bool]:
+    """ Crawl the page with the shared browser, parse its structured data or extract the recipe with an LLM
 
-async def scrape_recipe(url, save: bool = False) -> recipe.Recipe:
-    """ Scrape a web page for a cooking recipe and return the data structured by an LLM """
+    Returns:
+        The recipe and whether it was parsed from schema.org structured data
+    """
     data = None
 
     # Get the base url from url
@@ -51,37 +144,105 @@ async def scrape_recipe(url, save: bool = False) -> recipe.Recipe:
         crawl_config.css_selector = 'main article'
         crawl_config.excluded_selector = 'article#recipe-comments, amg-img, amp-carousel, amp-lightbox, amp-social-share'
 
-    async with AsyncWebCrawler(config=BASE_BROWSER) as crawler:
-        result: CrawlResult = await crawler.arun(
-            url=url,
-            config=crawl_config
-        )
-
-        if result.success:
-            if crawl_config.extraction_strategy is None:
-                response = await process_with_openrouter(result.markdown, url)
-                img_list = result.media.get("images")
-                logging.debug("Image List: %s", img_list)
-            else:
-                response = result.extracted_content
+    page = await crawl_page(url, crawl_config)
 
-            # Extracted content is presumably JSON
-            data = json.loads(response)
-            logging.debug("Extracted items: %s", json.dumps(data, indent=4, ensure_ascii=False))
-        else:
-            logging.error("Error: %s", result.error_message)
+    if page is not None:
+        recipe_obj = usable_recipe(page.structured_data, url) if page.structured_data else None
+        if recipe_obj is not None:
+            logging.info(f"Recipe {recipe_obj.name} extracted from structured data of {url}")
+            return recipe_obj, True
 
-    recipe_obj = recipe.construct_recipe_from_recipe_llm(recipe.RecipeLLM(**data))
+        response = await process_with_openrouter(page.markdown, url)
+        img_list = page.media.get("images")
+        logging.debug("Image List: %s", img_list)
 
-    # -- Save Recipe in another task
-    if save:
-        image_url = get_link_preview_image_url(url)
-        recipe_obj.image = image_url
-        task = asyncio.create_task(upload_recipe(recipe_obj))
+        # Extracted content is presumably JSON
+        data = json.loads(response)
+        logging.debug("Extracted items: %s", json.dumps(data, indent=4, ensure_ascii=False))
+
+    return recipe.construct_recipe_from_recipe_llm(recipe.RecipeLLM(**data)), False
+
+
+async def extract_recipe(url) -> Tuple[recipe.Recipe, bool]:
+    """ Extract the recipe from structured data or with browser and LLM
+
+    Returns:
+        The recipe and whether it was parsed from schema.org structured data
+    """
+    if STRUCTURED_RECIPE_PROBE:
+        recipe_obj = await fetch_structured_recipe(url)
+        if recipe_obj is not None:
+            logging.info(f"Recipe {recipe_obj.name} extracted from structured data of {url} without browser")
+            return recipe_obj, True
+
+    return await extract_recipe_with_browser(url)
 
-        task.add_done_callback(
-            lambda t: logging.error(f"Background save failed: {exception_and_traceback(t.exception())}")
-            if t.exception() else None
-        )
+
+async def scrape_recipe(url, save: bool = False) -> recipe.Recipe:
+    """ Scrape a web page for a cooking recipe and return the data structured by an LLM
+
+    Pages with embedded schema.org structured data are parsed directly without LLM.
+    Concurrent requests for the same url share a single crawl and extraction.
+    """
+    recipe_obj, from_structured_data = await SCRAPE_FLIGHTS.do(normalize_url(url), lambda: extract_recipe(url))
+
+    # -- Every caller gets its own copy as saving modifies the recipe
+    recipe_obj = recipe_obj.model_copy(deep=True)
+
+    if save:
+        _save_in_background(recipe_obj, url, replace_image=not from_structured_data or not recipe_obj.image)
 
     return recipe_obj
+
+
+def _save_in_background(recipe_obj: recipe.Recipe, url: str, replace_image: bool):
+    """ Save Recipe in another task """
+    if replace_image:
+        recipe_obj.image = get_link_preview_image_url(url)
+    task = asyncio.create_task(upload_recipe(recipe_obj))
+
+    task.add_done_callback(
+        lambda t: logging.error(f"Background save failed: {exception_and_traceback(t.exception())}")
+        if t.exception() else None
+    )
+
+
+async def scrape_recipes(urls: List[str], save: bool = False, user: str = "",
+                         order: str = RECIPE_DELIVERY_ORDER,
+                         known_recipes: Optional[Dict[str, Recipe]] = None) -> AsyncIterator[ScrapeResult]:
+    """ Scrape several recipe urls concurrently and yield each result as soon as it may be delivered
+
+    Failed urls are yielded with an error message instead of aborting the remaining scrapes.
+
+    Args:
+        urls: Urls to scrape, duplicates are only scraped once
+        save: Save every recipe to the Nextcloud cookbook
+        user: Key of the requesting user for the per user concurrency limit
+        order: 'arrival' yields results in the order of urls, 'completion' as soon as they are finished
+        known_recipes: Already extracted recipes by url, these are not scraped again
+    """
+    async def _scrape(url: str) -> ScrapeResult:
+        if known_recipes and url in known_recipes:
+            recipe_obj = known_recipes[url].model_copy(deep=True)
+            if save:
+                _save_in_background(recipe_obj, url, replace_image=not recipe_obj.image)
+            return ScrapeResult(url=url, recipe=recipe_obj)
+
+        async with SCRAPE_LIMITER.acquire(user):
+            try:
+                return ScrapeResult(url=url, recipe=await scrape_recipe(url, save))
+            except Exception as e:
+                logging.error(f"Error creating recipe from {url}: {exception_and_traceback(e)}")
+                return ScrapeResult(url=url, error=str(e))
+
+    tasks = [asyncio.create_task(_scrape(url)) for url in dict.fromkeys(urls)]
+    try:
+        if order == "completion":
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        else:
+            for task in tasks:
+                yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
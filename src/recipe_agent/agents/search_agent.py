@@ -2,13 +2,12 @@ import json
 import logging
 from typing import Optional
 
-from crawl4ai import AsyncWebCrawler, CrawlResult
-
 from recipe_agent.chat_history import ChatHistory
-from recipe_agent.openrouter_chat import openrouter_chat_request
-from recipe_agent.recipe_config import CRAWL_CONFIG, BASE_BROWSER
-from recipe_agent.tools.duckducktool import SearchResultSelection, duckduckgo_search_local
-from recipe_agent.recipe_config import LLM_PROVIDER
+from recipe_agent.crawl_cache import crawl_page
+from recipe_agent.model_router import LLM_ROUTER, Task
+from recipe_agent.page_reducer import reduce_page
+from recipe_agent.recipe_config import CRAWL_CONFIG, SUMMARY_TOKEN_BUDGET
+from recipe_agent.tools.duckducktool import SearchResultSelection, duckduckgo_search
 
 
 MAX_ITERATIONS = 4
@@ -25,7 +24,7 @@ SEARCH_SYS_PROMPT = (
     "refine_search_query field\n"
     "* if you want to refine the search query, store it in the field refined_search_query\n"
 )
-ITERATIVE_SEARCH_HISTORY = ChatHistory(SEARCH_SYS_PROMPT)
+ITERATIVE_SEARCH_HISTORY = ChatHistory(SEARCH_SYS_PROMPT, max_tokens=16384)
 
 AGENT_SYS_PROMPT = summarizer_instructions = """
 <GOAL>
@@ -51,20 +50,22 @@ When EXTENDING an existing summary:
 < FORMATTING >
 - Start directly with the updated summary, without preamble or titles. Do not use XML tags in the output.  
 < /FORMATTING >"""
-AGENT_HISTORY = ChatHistory(AGENT_SYS_PROMPT)
+# The running summary of the search results has to stay in the window
+AGENT_HISTORY = ChatHistory(AGENT_SYS_PROMPT, max_tokens=16384)
 
 
 async def iterative_refine(query: str) -> SearchResultSelection:
     iterations = 0
 
     while True:
-        search_results = duckduckgo_search_local(query)
+        search_results = await duckduckgo_search(query)
         prompt = f"User search query: \"{query}\"\nResults:\n{str(search_results)}"
         ITERATIVE_SEARCH_HISTORY.add_user_message(USER, prompt)
 
-        response = await openrouter_chat_request(LLM_PROVIDER, ITERATIVE_SEARCH_HISTORY.get_messages(USER),
-                                                 options={'stream': True},
-                                                 res_format=SearchResultSelection.model_json_schema())
+        response = await LLM_ROUTER.request(Task.SEARCH, ITERATIVE_SEARCH_HISTORY.get_messages(USER),
+                                            options={'stream': True},
+                                            res_format=SearchResultSelection.model_json_schema(),
+                                            validate=lambda r: SearchResultSelection.model_validate(json.loads(r)))
         ITERATIVE_SEARCH_HISTORY.add_assistant_response(USER, response)
 
         result_response = SearchResultSelection.model_validate(json.loads(response))
@@ -90,16 +91,15 @@ async def scrape_result_page(url) -> Optional[str]:
     # Disable LLM Extraction for now as it does not work reliably
     crawl_config.extraction_strategy = None
 
-    async with AsyncWebCrawler(config=BASE_BROWSER) as crawler:
-        result: CrawlResult = await crawler.arun(url=url, config=crawl_config)
+    page = await crawl_page(url, crawl_config)
 
-        if result.success:
-            return result.markdown
-        else:
-            logging.error("Error: %s", result.error_message)
+    if page is not None:
+        return page.markdown
 
 
 async def summarize_scrape_result(scraped_content: str, query: str):
+    scraped_content = reduce_page(scraped_content or str(), LLM_ROUTER.routes[Task.SUMMARY].models[0],
+                                  SUMMARY_TOKEN_BUDGET)
     messages = [
         {'role': 'system', 'content': 'You are Web Search Assistant. Take this markdown cluttered with '
                                       'general website content and create a concise summary of the article or '
@@ -110,12 +110,12 @@ async def summarize_scrape_result(scraped_content: str, query: str):
                                       '* if the content is not helpful or related to the user search query '
                                       'return the word None'},
         {'role': 'user', 'content': f"The query we are searching the Web for is: \"{query}\"\n"
-                                    f"This is the extracted markdown:\n{scraped_content[:10000]}"}
+                                    f"This is the extracted markdown:\n{scraped_content}"}
     ]
-    response = await openrouter_chat_request(LLM_PROVIDER, messages,
-                                             options={'stream': True, "temperature": 0, "max_tokens": 8192,
-                                                      # "num_ctx": 8192
-                                             })
+    response = await LLM_ROUTER.request(Task.SUMMARY, messages,
+                                        options={'stream': True, "temperature": 0, "max_tokens": 8192,
+                                                 # "num_ctx": 8192
+                                        })
     return response
 
 
@@ -135,10 +135,10 @@ async def search_agent(query: str) -> str:
         )
         AGENT_HISTORY.add_user_message(USER, prompt)
 
-        response = await openrouter_chat_request(LLM_PROVIDER, AGENT_HISTORY.get_messages(USER),
-                                                 options={'stream': True, "temperature": 0.1, "max_tokens": 16384,
-                                                          # "num_ctx": 16384
-                                                          })
+        response = await LLM_ROUTER.request(Task.SUMMARY, AGENT_HISTORY.get_messages(USER),
+                                            options={'stream': True, "temperature": 0.1, "max_tokens": 16384,
+                                                     # "num_ctx": 16384
+                                                     })
         AGENT_HISTORY.add_assistant_response(USER, response)
 
     return AGENT_HISTORY.get_messages(USER)[-1]['content']
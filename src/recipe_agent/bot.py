@@ -1,9 +1,8 @@
 import asyncio
 import logging
 import os
-import re
-import threading
 import time
+from contextlib import aclosing
 from typing import List
 
 from telegram import Update, LinkPreviewOptions
@@ -13,8 +12,17 @@ from telegram.ext import Application, CommandHandler, MessageHandler, ContextTyp
 from recipe_agent.agents import recipe_agent, chat_agent
 from recipe_agent.recipe_config import SAVE_RECIPE_TERM
 from recipe_agent.chat_history import ChatHistory
-from recipe_agent.utils import exception_and_traceback, to_telegram_md_recipe
-from recipe_agent.web_app import start_web_app
+from recipe_agent.crawl_cache import CRAWL_CACHE
+from recipe_agent.crawler_pool import CRAWLER_POOL
+from recipe_agent.executors import EXECUTORS
+from recipe_agent.extraction_cache import EXTRACTION_CACHE
+from recipe_agent.history_backend import HISTORY_BACKEND
+from recipe_agent.io.cookbook_api import COOKBOOK_REINDEX
+from recipe_agent.io.nextcloud_client import NEXTCLOUD_CLIENTS
+from recipe_agent.llm_scheduler import LLM_SCHEDULER
+from recipe_agent.openrouter_chat import close_http_client
+from recipe_agent.utils import exception_and_traceback, find_urls, to_telegram_md_recipe
+from recipe_agent.web_app import start_web_server, stop_web_server
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -22,7 +30,12 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 DEFAULTS = Defaults(
     link_preview_options=LinkPreviewOptions(is_disabled=True)
 )
-BOT_AI_CHAT_HISTORY = ChatHistory(max_history_length=10)
+BOT_AI_CHAT_HISTORY = ChatHistory(max_history_length=10, summarizer=chat_agent.summarize_history,
+                                  backend=HISTORY_BACKEND, namespace="telegram")
+# Telegram limits message edits, streamed answers are updated at most once per interval
+STREAM_EDIT_INTERVAL = 1.5
+# Reply with a template instead of the LLM once this many LLM requests are waiting
+ACK_TEMPLATE_QUEUE_LENGTH = int(os.getenv("ACK_TEMPLATE_QUEUE_LENGTH", 1))
 
 
 async def answer_message_with_dots(update, username, message_text, initial_message):
@@ -32,14 +45,24 @@ async def answer_message_with_dots(update, username, message_text, initial_messa
     # Create a task to periodically update the message with dots
     dot_task = asyncio.create_task(_add_dots(answer, initial_message))
 
-    # Wait for the response from the chat_agent
-    response = await chat_agent.answer_message(username, message_text, BOT_AI_CHAT_HISTORY)
-
-    # Cancel the dot task
-    dot_task.cancel()
+    # Stream the response from the chat_agent into the message
+    # The stream holds the user's history lock and a scheduler slot, aclosing releases them right away
+    # if editing the message fails, eg. on flood limits or a deleted message
+    response, sent_response, last_edit = str(), initial_message, 0.0
+    try:
+        async with aclosing(chat_agent.answer_message_stream(username, message_text, BOT_AI_CHAT_HISTORY)) as stream:
+            async for response in stream:
+                # Cancel the dot task once the first words arrive
+                dot_task.cancel()
+                if time.time() - last_edit >= STREAM_EDIT_INTERVAL and response.strip() not in (str(), sent_response):
+                    await answer.edit_text(response)
+                    sent_response, last_edit = response.strip(), time.time()
+    finally:
+        dot_task.cancel()
 
     # Edit the message with the final response
-    await answer.edit_text(response)
+    if response.strip() and response.strip() != sent_response:
+        await answer.edit_text(response)
 
 
 async def _add_dots(answer, initial_message: str):
@@ -56,6 +79,13 @@ async def message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
 async def _chat(update: Update, message_text):
     try:
+        # The history only references sent recipes, show the full recipe again on request
+        last_recipe = chat_agent.requested_recipe(update.effective_user.first_name or "Du", message_text,
+                                                  BOT_AI_CHAT_HISTORY)
+        if last_recipe is not None:
+            await update.message.reply_markdown_v2(to_telegram_md_recipe(last_recipe))
+            return
+
         await answer_message_with_dots(update, update.effective_user.first_name or "Du", message_text,
                                        "Kurz nachdenken")
     except Exception as e:
@@ -65,48 +95,64 @@ async def _chat(update: Update, message_text):
         await update.message.reply_text(response)
 
 
-async def _process_recipe(update: Update, urls: List[str], message_text: str, just_save: bool):
-    username = update.effective_user.first_name or "Du"
-    save: bool = True if SAVE_RECIPE_TERM in message_text or just_save else False
-
-    if not just_save:
-        # -- Respond dynamically that we are scraping
-        response = await chat_agent.answer_message_with_link(
-            username, message_text, BOT_AI_CHAT_HISTORY
-        )
-    else:
+async def _acknowledge_link(update: Update, username: str, message_text: str, just_save: bool,
+                            acknowledged: asyncio.Event):
+    if just_save:
         # -- Respond static so we get quicker to save
         response = "Rezept wird abgerufen und gespeichert"
+    elif LLM_SCHEDULER.queue_length >= ACK_TEMPLATE_QUEUE_LENGTH:
+        # -- Do not queue behind other LLM requests just to say that we are scraping
+        response = chat_agent.acknowledge_link(username, message_text, BOT_AI_CHAT_HISTORY)
+    else:
+        # -- Respond dynamically that we are scraping
+        response = await chat_agent.answer_message_with_link(username, message_text, BOT_AI_CHAT_HISTORY)
 
     answer = await update.message.reply_text(response)
+    acknowledged.set()
+    await _add_dots(answer, response)
 
-    for url in urls:
-        dot_task = asyncio.create_task(_add_dots(answer, response))
 
-        # Extract
-        try:
-            recipe_obj = await recipe_agent.scrape_recipe(url, save)
-        except Exception as e:
-            logging.error(f"Error creating recipe: {exception_and_traceback(e)}")
-            await update.message.reply_text("Etwas ist schiefgelaufen. Versuch es später nochmal!")
-            dot_task.cancel()
-            return
+async def _process_recipe(update: Update, urls: List[str], message_text: str, just_save: bool):
+    username = update.effective_user.first_name or "Du"
+    save: bool = True if SAVE_RECIPE_TERM in message_text or just_save else False
 
-        dot_task.cancel()
+    # Scraping starts right away, the acknowledgement is answered alongside
+    acknowledged = asyncio.Event()
+    ack_task = asyncio.create_task(_acknowledge_link(update, username, message_text, just_save, acknowledged))
+    # Let the acknowledgement record the link message in the history before it could get cancelled
+    await asyncio.sleep(0)
 
-        if not just_save:
-            markdown_recipe = to_telegram_md_recipe(recipe_obj)
-            BOT_AI_CHAT_HISTORY.add_assistant_response(username, markdown_recipe)
-            await update.message.reply_markdown_v2(
-                markdown_recipe
-            )
-        else:
-            prompt = (f"Der Benutzer {username} hatte das speichern des zuletzt gesendeten Rezeptes angefragt. "
-                      f"Antworte das dass Speichern nun im Hintergrund erfolgt. "
-                      f"Seine Nachricht war: {message_text}")
-            await update.message.reply_text(
-                await chat_agent.answer_message(username, message_text, BOT_AI_CHAT_HISTORY, prompt)
-            )
+    # Recipes the user has already seen are saved without scraping them again
+    known_recipes = BOT_AI_CHAT_HISTORY.get_recipes_for_urls(username, urls) if just_save else None
+
+    # Extract all urls concurrently, each recipe is sent as soon as it is ready
+    try:
+        async for result in recipe_agent.scrape_recipes(urls, save, str(update.effective_user.id),
+                                                        known_recipes=known_recipes):
+            if not acknowledged.is_set() and not ack_task.done():
+                # -- The recipe was faster than the acknowledgement, no need to send it anymore. The
+                #    cancelled acknowledgement completes its history turn before the recipe is added
+                ack_task.cancel()
+                await asyncio.wait([ack_task])
+
+            if result.recipe is None:
+                error_message = "Etwas ist schiefgelaufen. Versuch es später nochmal!"
+                if len(urls) > 1:
+                    error_message = f"Etwas ist schiefgelaufen mit {result.url}. Versuch es später nochmal!"
+                await update.message.reply_text(error_message)
+                continue
+
+            if not just_save:
+                BOT_AI_CHAT_HISTORY.add_recipe(username, result.recipe, result.url)
+                await update.message.reply_markdown_v2(
+                    to_telegram_md_recipe(result.recipe)
+                )
+            else:
+                await update.message.reply_text(
+                    chat_agent.confirm_save(username, message_text, result.recipe.name, BOT_AI_CHAT_HISTORY)
+                )
+    finally:
+        ack_task.cancel()
 
 
 async def rezept(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -120,12 +166,13 @@ async def rezept(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
     if hasattr(update, 'message'):
         message_text = update.message.text or ""
-        urls = re.findall(r'https?://\S+', message_text)
+        urls = find_urls(message_text)
 
-    save: bool = True if SAVE_RECIPE_TERM in message_text else False
+    await BOT_AI_CHAT_HISTORY.load(update.effective_user.first_name or "Du")
+    save: bool = chat_agent.is_save_request(message_text)
     just_save = False
     if save and not urls:
-        urls = BOT_AI_CHAT_HISTORY.get_last_message_with_url(update.effective_user.first_name)
+        urls = BOT_AI_CHAT_HISTORY.get_last_message_with_url(update.effective_user.first_name or "Du")
         # User has seen the recipe, just save and confirm
         just_save = True
 
@@ -143,8 +190,31 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     )
 
 
+async def _post_init(application: Application) -> None:
+    # Conversations from before the restart, the web histories are restored by the web server
+    BOT_AI_CHAT_HISTORY.restore()
+    # Web-Server und Browser teilen sich den Event-Loop des Bots
+    start_web_server()
+    await CRAWLER_POOL.start()
+
+
+async def _post_shutdown(application: Application) -> None:
+    stop_web_server()
+    await CRAWLER_POOL.close()
+    await close_http_client()
+    # Reindex the recipes saved since the last reindex before the connections are closed
+    await COOKBOOK_REINDEX.flush()
+    await NEXTCLOUD_CLIENTS.close()
+    EXECUTORS.shutdown()
+    # Write the pending chat histories and cache access times
+    HISTORY_BACKEND.close()
+    CRAWL_CACHE.flush()
+    EXTRACTION_CACHE.flush()
+
+
 def run_telegram_bot() -> None:
-    application = Application.builder().token(os.environ.get('TELEBOT_TOKEN')).defaults(DEFAULTS).build()
+    application = (Application.builder().token(os.environ.get('TELEBOT_TOKEN')).defaults(DEFAULTS)
+                   .post_init(_post_init).post_shutdown(_post_shutdown).build())
 
     # Add the /start command handler
     application.add_handler(CommandHandler('start', start))
@@ -167,11 +237,7 @@ def run_telegram_bot() -> None:
 
 
 def main() -> None:
-    # Starte den Web-Server in einem separaten Thread
-    web_thread = threading.Thread(target=start_web_app, daemon=True)
-    web_thread.start()
-
-    # Starte den Telegram-Bot im Hauptthread
+    # Starte den Telegram-Bot, der Web-Server wird in _post_init im selben Event-Loop gestartet
     run_telegram_bot()
 
 
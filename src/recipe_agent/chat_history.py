@@ -1,59 +1,357 @@
+import asyncio
 import logging
-import re
-from collections import defaultdict
-from typing import Optional
+import os
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
 
-MAX_USERS = 24
+from recipe_agent.executors import EXECUTORS
+from recipe_agent.history_backend import HistoryBackend
+from recipe_agent.llm_scheduler import estimate_tokens
+from recipe_agent.page_reducer import count_tokens
+from recipe_agent.recipe import Recipe
+from recipe_agent.recipe_config import LLM_PROVIDER
+from recipe_agent.recipe_store import RECIPE_STORE, RecipeStore, recipe_summary
+from recipe_agent.utils import find_urls, normalize_url
+
+MAX_USERS = int(os.getenv("CHAT_HISTORY_MAX_USERS", 24))
+# Token-Budget der Nachrichten eines Benutzers, die an das LLM geschickt werden
+MAX_TOKENS = int(os.getenv("CHAT_HISTORY_MAX_TOKENS", 2000))
+# Herausgefallene Nachrichten werden erst ab so vielen Tokens in einer LLM-Anfrage zusammengefasst
+SUMMARY_BATCH_TOKENS = int(os.getenv("CHAT_HISTORY_SUMMARY_BATCH_TOKENS", 500))
+
+# Anzahl der Rezepte pro Benutzer im Url-Index
+MAX_INDEXED_RECIPES = 16
+
+# (bisherige Zusammenfassung, herausgefallene Nachrichten) -> neue Zusammenfassung
+Summarizer = Callable[[str, List[dict]], Awaitable[str]]
+
+
+class _Conversation:
+    __slots__ = ("username", "messages", "tokens", "uncounted", "count_task", "lock", "summary", "compacted",
+                 "compacted_tokens", "summary_task", "summary_failures", "last_urls", "recipes", "last_recipe")
+
+    def __init__(self, username: str):
+        self.username = username
+        self.messages: Deque[dict] = deque()
+        self.tokens: Deque[int] = deque()
+        # Nachrichten, deren Tokens geschätzt sind, bis sie abseits des Event-Loops gezählt wurden
+        self.uncounted: List[dict] = list()
+        self.count_task: Optional[asyncio.Task] = None
+        # Serialisiert die Gesprächsrunden eines Benutzers zwischen Bot und Web-App
+        self.lock = asyncio.Lock()
+        # Zusammenfassung der Nachrichten, die aus dem Fenster gefallen sind
+        self.summary = str()
+        self.compacted: List[dict] = list()
+        self.compacted_tokens: List[int] = list()
+        self.summary_task: Optional[asyncio.Task] = None
+        self.summary_failures = 0
+        # Beim Einfügen gepflegter Index: Urls der letzten Nachricht mit Links und
+        # normalisierte Url -> Referenz des daraus erstellten Rezepts
+        self.last_urls: List[str] = list()
+        self.recipes: OrderedDict[str, str] = OrderedDict()
+        self.last_recipe: Optional[str] = None
 
 
 class ChatHistory:
-    def __init__(self, system_prompt: str = None, max_history_length: int = 10):
-        self._history = defaultdict(list)
+    def __init__(self, system_prompt: str = None, max_history_length: int = 10, max_users: int = MAX_USERS,
+                 max_tokens: int = MAX_TOKENS, model: str = LLM_PROVIDER, summarizer: Summarizer = None,
+                 summary_batch_tokens: int = SUMMARY_BATCH_TOKENS, recipe_store: RecipeStore = RECIPE_STORE,
+                 backend: HistoryBackend = None, namespace: str = ""):
+        """
+        Args:
+            max_history_length: Maximale Anzahl Nachrichten pro Benutzer
+            max_tokens: Nachrichten pro Benutzer werden auf dieses Token-Budget von model gekürzt,
+                        die neueste Nachricht bleibt immer erhalten
+            summarizer: Fasst herausgefallene Nachrichten im Hintergrund zu einer fortlaufenden
+                        Zusammenfassung zusammen, ohne summarizer werden sie verworfen
+            summary_batch_tokens: Der summarizer wird erst aufgerufen, wenn so viele Tokens herausgefallen
+                                  sind, statt mit jeder neuen Nachricht eine LLM-Anfrage auszulösen
+            backend: Speichert die Gespräche dauerhaft, gelesen wird mit load bei Gesprächen, die nicht im
+                     Speicher liegen oder die ein anderer Prozess geändert hat
+            namespace: Trennt die Gespräche mehrerer ChatHistory Instanzen im backend
+        """
+        # Least recently used Benutzer stehen vorne
+        self._history: OrderedDict[str, _Conversation] = OrderedDict()
         self._system_prompt = system_prompt or str()
         self._max_history_len = max_history_length
+        self._max_users = max(1, max_users)
+        self._max_tokens = max_tokens
+        self._model = model
+        self._summarizer = summarizer
+        self._summary_batch_tokens = max(1, summary_batch_tokens)
+        self._recipe_store = recipe_store
+        self._backend = backend or HistoryBackend()
+        self._namespace = namespace
 
     def update_sys_prompt(self, prompt: Optional[str]):
         if prompt:
             self._system_prompt = prompt
 
+    async def load(self, username: str):
+        """ Gespräch vor einer Gesprächsrunde im Thread-Pool aus dem backend laden
+
+        Lädt Gespräche, die nicht im Speicher liegen, und übernimmt Änderungen anderer Prozesse,
+        ohne den Event-Loop mit der Datenbankabfrage zu blockieren.
+        """
+        conversation = self._history.get(username)
+        if conversation is None:
+            state = await EXECUTORS.run_io(self._backend.load, self._namespace, username)
+            # -- Während des Ladens kann das Gespräch bereits angelegt worden sein
+            if state is not None and username not in self._history:
+                self._history[username] = self._apply_state(_Conversation(username), state)
+                if len(self._history) > self._max_users:
+                    self._evict(self._history[username])
+            return
+
+        state = await EXECUTORS.run_io(self._backend.reload, self._namespace, username)
+        # -- Laufende Gesprächsrunden und Zusammenfassungen nicht überschreiben
+        if state is not None and not conversation.lock.locked() and conversation.summary_task is None:
+            self._apply_state(conversation, state)
+
+    def lock(self, username: str) -> asyncio.Lock:
+        """ Lock to hold for a whole conversation turn, eg. user message, LLM request and answer """
+        return self._conversation(username).lock
+
     def get_messages(self, username: str) -> list:
+        conversation = self._conversation(username)
         messages = [{'role': 'system', 'content': self._system_prompt}]
-        messages += self._history[username]
+        if conversation.summary:
+            messages.append({'role': 'system', 'content': f"Bisheriger Gesprächsverlauf: {conversation.summary}"})
+        # -- Nur Rolle und Inhalt, Rezept-Referenzen bleiben intern
+        messages += [{'role': m['role'], 'content': m['content']} for m in conversation.messages]
 
         logging.info(f"ChatHistory messages: \n"
                      f"{'\n'.join([f"{e['role']}: {e['content']}" for e in messages if e['role'] != 'system'])}")
         return messages
 
     def get_last_message_with_url(self, username: str) -> Optional[list]:
-        for message in reversed(self._history[username]):
-            if message['role'] != 'user':
-                continue
-            urls = re.findall(r'https?://\S+', message['content'])
-            if urls:
-                return urls
+        return list(self._conversation(username).last_urls) or None
 
-        return None
+    def get_recipes_for_urls(self, username: str, urls: List[str]) -> Dict[str, Recipe]:
+        """ Bereits gesendete Rezepte der urls, die nicht erneut abgerufen werden müssen """
+        conversation, recipes = self._conversation(username), dict()
+        for url in urls:
+            ref = conversation.recipes.get(normalize_url(url))
+            recipe = self._recipe_store.get(ref) if ref else None
+            if recipe is not None:
+                recipes[url] = recipe
+        return recipes
 
     def add_user_message(self, username: str, message: str, system_prompt: str = None):
-        self._history[username].append({'role': 'user', 'content': message})
+        self._append(username, {'role': 'user', 'content': message})
         self.update_sys_prompt(system_prompt)
-        self._update_history(username)
+
+        urls = find_urls(message)
+        if urls:
+            self._conversation(username).last_urls = urls
+        self._persist(username)
 
     def add_assistant_response(self, username: str, message: str, system_prompt: str = None):
-        self._history[username].append({'role': 'assistant', 'content': message})
+        self._append(username, {'role': 'assistant', 'content': message})
         self.update_sys_prompt(system_prompt)
-        self._update_history(username)
-
-    def _check_history_size(self, username: str):
-        if len(self._history) > MAX_USERS:
-            diff = len(self._history) - MAX_USERS
-            for idx, key in enumerate(self._history):
-                if key == username:
-                    continue
-                self._history.pop(key)
-                if idx >= diff:
-                    break
-
-    def _update_history(self, username: str):
-        self._check_history_size(username)
-        self._history[username] = self._history[username][-self._max_history_len:]
+        self._persist(username)
+
+    def add_recipe(self, username: str, recipe: Recipe, url: str = None):
+        """ Gesendetes Rezept als Referenz mit einzeiliger Zusammenfassung statt als Markdown speichern
+
+        Args:
+            url: Angefragte Url, unter der das Rezept für !save gefunden wird, sonst die Url des Rezepts
+        """
+        ref = self._recipe_store.put(recipe)
+        self._append(username, {'role': 'assistant', 'content': recipe_summary(recipe), 'recipe': ref})
+
+        conversation = self._conversation(username)
+        conversation.last_recipe = ref
+        if url or recipe.url:
+            key = normalize_url(url or recipe.url)
+            conversation.recipes[key] = ref
+            conversation.recipes.move_to_end(key)
+            if len(conversation.recipes) > MAX_INDEXED_RECIPES:
+                conversation.recipes.popitem(last=False)
+        self._persist(username)
+
+    def get_last_recipe(self, username: str) -> Optional[Recipe]:
+        """ Zuletzt gesendetes Rezept des Benutzers, solange es noch im Rezept-Speicher liegt """
+        ref = self._conversation(username).last_recipe
+        return self._recipe_store.get(ref) if ref else None
+
+    def _append(self, username: str, message: dict):
+        conversation = self._conversation(username)
+        conversation.messages.append(message)
+        conversation.tokens.append(self._estimate(conversation, message))
+        self._trim(conversation)
+        self._schedule_count(conversation)
+
+    def _estimate(self, conversation: _Conversation, message: dict) -> int:
+        """ Grobe Schätzung, bis der Tokenizer die Nachricht gezählt hat """
+        conversation.uncounted.append(message)
+        return estimate_tokens([message])
+
+    def _schedule_count(self, conversation: _Conversation):
+        if not conversation.uncounted or conversation.count_task is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # -- Außerhalb eines Event-Loops wird direkt gezählt
+            messages = list(conversation.uncounted)
+            self._apply_counts(conversation, messages, [count_tokens(m['content'], self._model) for m in messages])
+            return
+        conversation.count_task = loop.create_task(self._count(conversation))
+
+    async def _count(self, conversation: _Conversation):
+        """ Tokenisiert neue Nachrichten im Executor, damit der Event-Loop andere Gespräche bedient """
+        messages = list(conversation.uncounted)
+        try:
+            counts = await asyncio.gather(*(EXECUTORS.run_cpu(count_tokens, m['content'], self._model)
+                                            for m in messages))
+        except Exception as e:
+            logging.warning(f"Tokens des Chat-Verlaufs konnten nicht gezählt werden: {e}")
+            # -- Die Schätzungen bleiben stehen
+            counts = [estimate_tokens([m]) for m in messages]
+        finally:
+            conversation.count_task = None
+
+        self._apply_counts(conversation, messages, counts)
+        # -- Während des Zählens hinzugekommene Nachrichten
+        self._schedule_count(conversation)
+
+    def _apply_counts(self, conversation: _Conversation, messages: List[dict], counts: List[int]):
+        exact = {id(m): count for m, count in zip(messages, counts)}
+        conversation.uncounted = [m for m in conversation.uncounted if id(m) not in exact]
+        conversation.tokens = deque(exact.get(id(m), t) for m, t in zip(conversation.messages, conversation.tokens))
+        conversation.compacted_tokens = [exact.get(id(m), t) for m, t in
+                                         zip(conversation.compacted, conversation.compacted_tokens)]
+        self._trim(conversation)
+
+    def _trim(self, conversation: _Conversation):
+        """ Älteste Nachrichten aus dem Fenster nehmen, bis Anzahl und Token-Budget passen """
+        total = sum(conversation.tokens)
+        while len(conversation.messages) > 1 and (
+                len(conversation.messages) > self._max_history_len or total > self._max_tokens):
+            tokens = conversation.tokens.popleft()
+            total -= tokens
+            message = conversation.messages.popleft()
+            if self._summarizer is not None:
+                conversation.compacted.append(message)
+                conversation.compacted_tokens.append(tokens)
+
+        if conversation.summary_task is None:
+            # -- Falls die Zusammenfassung dauerhaft fehlschlägt, nicht unbegrenzt sammeln: die ältesten
+            # -- herausgefallenen Nachrichten über dem Vierfachen eines Stapels werden verworfen
+            while sum(conversation.compacted_tokens) > 4 * self._summary_batch_tokens \
+                    and len(conversation.compacted) > 1:
+                conversation.compacted.pop(0)
+                conversation.compacted_tokens.pop(0)
+        self._schedule_summary(conversation)
+
+    def _schedule_summary(self, conversation: _Conversation):
+        if not conversation.compacted or conversation.summary_task is not None:
+            return
+        # -- Stapelweise zusammenfassen, nach Fehlschlägen mit größeren Stapeln
+        batch_tokens = self._summary_batch_tokens * min(1 + conversation.summary_failures, 3)
+        if sum(conversation.compacted_tokens) < batch_tokens:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # -- Außerhalb eines Event-Loops wird beim nächsten Trimmen zusammengefasst
+            return
+        conversation.summary_task = loop.create_task(self._summarize(conversation))
+
+    async def _summarize(self, conversation: _Conversation):
+        """ Fasst herausgefallene Nachrichten abseits der Gesprächsrunden zusammen """
+        messages = list(conversation.compacted)
+        try:
+            conversation.summary = (await self._summarizer(conversation.summary, messages)).strip()
+            del conversation.compacted[:len(messages)]
+            del conversation.compacted_tokens[:len(messages)]
+            conversation.summary_failures = 0
+        except Exception as e:
+            logging.warning(f"Chat-Verlauf konnte nicht zusammengefasst werden: {e}")
+            conversation.summary_failures += 1
+            return
+        finally:
+            conversation.summary_task = None
+
+        if self._history.get(conversation.username) is conversation:
+            self._persist(conversation.username)
+
+        # -- Während der Zusammenfassung herausgefallene Nachrichten
+        self._schedule_summary(conversation)
+
+    def restore(self):
+        """ Die zuletzt aktiven Gespräche aus dem backend laden, beim Start statt bei der ersten Nachricht """
+        recent = self._backend.load_recent(self._namespace, self._max_users - len(self._history))
+        # -- Bereits aktive Gespräche bleiben die zuletzt verwendeten
+        for username, state in reversed(recent.items()):
+            if username not in self._history:
+                self._history[username] = self._apply_state(_Conversation(username), state)
+                self._history.move_to_end(username, last=False)
+
+    def flush(self):
+        """ Ausstehende Änderungen sofort schreiben, zB. beim Herunterfahren """
+        self._backend.flush()
+
+    def _persist(self, username: str):
+        conversation = self._history.get(username)
+        if conversation is not None:
+            self._backend.save(self._namespace, username, self._to_state(conversation))
+
+    def _to_state(self, conversation: _Conversation) -> dict:
+        refs = set(conversation.recipes.values()) | ({conversation.last_recipe} if conversation.last_recipe else set())
+        recipes = {ref: self._recipe_store.get(ref) for ref in refs}
+        return {
+            "messages": list(conversation.messages),
+            "summary": conversation.summary,
+            "compacted": list(conversation.compacted),
+            "last_urls": list(conversation.last_urls),
+            "recipes": list(conversation.recipes.items()),
+            "last_recipe": conversation.last_recipe,
+            # -- Rezepte werden erst vom backend serialisiert
+            "recipe_data": {ref: recipe for ref, recipe in recipes.items() if recipe is not None},
+        }
+
+    def _apply_state(self, conversation: _Conversation, state: dict) -> _Conversation:
+        """ Gespeicherten Zustand übernehmen, der Lock des Gesprächs bleibt erhalten """
+        for ref, recipe in state.get("recipe_data", dict()).items():
+            if self._recipe_store.get(ref) is None:
+                self._recipe_store.put(recipe if isinstance(recipe, Recipe) else Recipe.model_validate(recipe))
+
+        conversation.uncounted = list()
+        conversation.messages = deque(state.get("messages", list()))
+        conversation.tokens = deque(self._estimate(conversation, m) for m in conversation.messages)
+        conversation.summary = state.get("summary", str())
+        conversation.compacted = list(state.get("compacted", list()))
+        conversation.compacted_tokens = [self._estimate(conversation, m) for m in conversation.compacted]
+        conversation.last_urls = list(state.get("last_urls", list()))
+        conversation.recipes = OrderedDict((key, ref) for key, ref in state.get("recipes", list()))
+        conversation.last_recipe = state.get("last_recipe")
+        self._schedule_count(conversation)
+        return conversation
+
+    def _conversation(self, username: str) -> _Conversation:
+        """ Gespräch des Benutzers als zuletzt verwendet markieren, neue Benutzer verdrängen den ältesten """
+        conversation = self._history.get(username)
+        if conversation is not None:
+            self._history.move_to_end(username)
+            return conversation
+
+        # -- Nur falls load nicht vorher aufgerufen wurde, liest das backend hier im Event-Loop
+        state = self._backend.load(self._namespace, username)
+        conversation = _Conversation(username)
+        if state is not None:
+            self._apply_state(conversation, state)
+        self._history[username] = conversation
+        if len(self._history) > self._max_users:
+            self._evict(conversation)
+        return conversation
+
+    def _evict(self, current: _Conversation):
+        for username, conversation in self._history.items():
+            if conversation is current:
+                return
+            # -- Laufende Gesprächsrunden nicht verdrängen
+            if not conversation.lock.locked():
+                del self._history[username]
+                return
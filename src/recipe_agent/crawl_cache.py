@@ -0,0 +1,199 @@
+""" Persistent on-disk cache of crawled pages
+
+Pages are stored in a local SQLite database keyed by URL (and the selectors used to crawl them).
+Entries expire after a TTL and the least recently used entries are evicted once the cache
+exceeds its size limit. Reads do not write: their access times are collected and written with the
+next put or after touch_interval seconds.
+"""
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Dict, List
+
+from crawl4ai import CrawlerRunConfig, CrawlResult
+from pydantic import BaseModel, Field
+
+from recipe_agent.crawler_pool import CRAWLER_POOL
+from recipe_agent.executors import EXECUTORS
+from recipe_agent.recipe_config import CRAWL_CACHE_PATH, CRAWL_CACHE_TTL, CRAWL_CACHE_MAX_BYTES, CACHE_TOUCH_INTERVAL
+from recipe_agent.structured_recipe import structured_data_from_html
+from recipe_agent.utils import exception_and_traceback
+
+
+class CrawledPage(BaseModel):
+    url: str
+    final_url: str
+    markdown: str
+    media: Dict[str, List[Dict]] = Field(default_factory=dict)
+    fetched_at: float = Field(default_factory=time.time)
+    content_hash: str = ""
+    # -- schema.org Recipe node of the crawled html
+    structured_data: Optional[dict] = None
+
+    @classmethod
+    def from_crawl_result(cls, url: str, result: CrawlResult, structured_data: Optional[dict] = None) -> "CrawledPage":
+        markdown = str(result.markdown or "")
+        return cls(
+            url=url,
+            final_url=result.redirected_url or result.url or url,
+            markdown=markdown,
+            media=result.media or dict(),
+            content_hash=hashlib.sha256(markdown.encode("utf-8")).hexdigest(),
+            structured_data=structured_data,
+        )
+
+
+class CrawlCache:
+    def __init__(self, path: Path = CRAWL_CACHE_PATH, ttl: float = CRAWL_CACHE_TTL,
+                 max_bytes: int = CRAWL_CACHE_MAX_BYTES, touch_interval: float = CACHE_TOUCH_INTERVAL):
+        """
+        Args:
+            path: Location of the SQLite database file
+            ttl: Seconds after which a cached page is crawled again, 0 disables the cache
+            max_bytes: Maximum size of all cached pages before least recently used entries are evicted
+            touch_interval: Seconds between writes of the access times collected by get
+        """
+        self._path = Path(path)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.touch_interval = touch_interval
+        self._lock = threading.Lock()
+        # key -> unwritten access time
+        self._touched: Dict[str, float] = dict()
+        self._touches_written = time.time()
+        self._connection: Optional[sqlite3.Connection] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_bytes > 0
+
+    def get(self, key: str) -> Optional[CrawledPage]:
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            row = self._db().execute("SELECT data, fetched_at FROM pages WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+
+            data, fetched_at = row
+            # -- Expired pages are removed by the next put
+            if time.time() - fetched_at > self.ttl:
+                return None
+
+            self._touched[key] = time.time()
+            if time.time() - self._touches_written > self.touch_interval:
+                self._write_touches()
+                self._db().commit()
+
+        return CrawledPage.model_validate_json(data)
+
+    def put(self, key: str, page: CrawledPage):
+        if not self.enabled:
+            return
+
+        data = page.model_dump_json()
+        with self._lock:
+            self._db().execute(
+                "INSERT OR REPLACE INTO pages (key, data, size, fetched_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data.encode("utf-8")), page.fetched_at, time.time())
+            )
+            self._touched.pop(key, None)
+            self._write_touches()
+            self._evict()
+            self._db().commit()
+
+    def clear(self):
+        with self._lock:
+            self._db().execute("DELETE FROM pages")
+            self._db().commit()
+
+    def flush(self):
+        """ Write the collected access times, eg. before the process exits """
+        with self._lock:
+            self._write_touches()
+            self._db().commit()
+
+    def size(self) -> int:
+        with self._lock:
+            return self._db().execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+
+    def _write_touches(self):
+        touched, self._touched = self._touched, dict()
+        self._db().executemany("UPDATE pages SET last_access = ? WHERE key = ?",
+                               [(last_access, key) for key, last_access in touched.items()])
+        self._touches_written = time.time()
+
+    def _evict(self):
+        """ Remove expired pages, then the least recently used ones until the cache fits max_bytes """
+        db = self._db()
+        db.execute("DELETE FROM pages WHERE fetched_at < ?", (time.time() - self.ttl,))
+
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        for key, size in db.execute("SELECT key, size FROM pages ORDER BY last_access ASC").fetchall():
+            db.execute("DELETE FROM pages WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def _db(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(self._path, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                "key TEXT PRIMARY KEY, data TEXT NOT NULL, size INTEGER NOT NULL, "
+                "fetched_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS pages_last_access ON pages (last_access)")
+            self._connection.commit()
+        return self._connection
+
+
+CRAWL_CACHE = CrawlCache()
+
+
+def cache_key(url: str, crawl_config: CrawlerRunConfig) -> str:
+    """ Pages crawled with site specific selectors are cached separately from full pages """
+    selectors = json.dumps([crawl_config.css_selector, crawl_config.excluded_selector])
+    return f"{url}#{hashlib.sha1(selectors.encode('utf-8')).hexdigest()[:12]}"
+
+
+async def crawl_page(url: str, crawl_config: CrawlerRunConfig) -> Optional[CrawledPage]:
+    """ Return the cached page or crawl it with the shared browser """
+    key = cache_key(url, crawl_config)
+    try:
+        page = await EXECUTORS.run_io(CRAWL_CACHE.get, key)
+    except Exception as e:
+        logging.error(f"Error reading crawl cache: {exception_and_traceback(e)}")
+        page = None
+
+    if page is not None:
+        logging.info(f"Crawl cache hit for {url}")
+        return page
+
+    result: CrawlResult = await CRAWLER_POOL.arun(url, crawl_config)
+    if not result.success:
+        logging.error("Error: %s", result.error_message)
+        return None
+
+    try:
+        structured_data = await EXECUTORS.run_cpu(structured_data_from_html, result.html or "")
+    except Exception as e:
+        logging.error(f"Error parsing structured data of {url}: {exception_and_traceback(e)}")
+        structured_data = None
+
+    page = CrawledPage.from_crawl_result(url, result, structured_data)
+    try:
+        await EXECUTORS.run_io(CRAWL_CACHE.put, key, page)
+    except Exception as e:
+        logging.error(f"Error writing crawl cache: {exception_and_traceback(e)}")
+
+    return page
@@ -0,0 +1,172 @@
+""" Process wide pool of long-lived Chromium crawlers
+
+Starting Chromium is the most expensive part of every crawl. The pool starts the browser once,
+lets a bounded number of crawls share it and recycles it after a number of pages or when the
+browser processes exceed a memory ceiling.
+"""
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+import psutil
+from crawl4ai import AsyncWebCrawler, BrowserConfig, CrawlerRunConfig, CrawlResult
+
+from recipe_agent.executors import EXECUTORS
+from recipe_agent.recipe_config import (BASE_BROWSER, CRAWLER_POOL_MAX_CONCURRENCY, CRAWLER_POOL_MAX_PAGES,
+                                        CRAWLER_POOL_MAX_RSS_MB)
+from recipe_agent.utils import exception_and_traceback
+
+
+class CrawlerPool:
+    def __init__(self, browser_config: BrowserConfig = BASE_BROWSER,
+                 max_concurrency: int = CRAWLER_POOL_MAX_CONCURRENCY,
+                 max_pages: int = CRAWLER_POOL_MAX_PAGES,
+                 max_rss_mb: int = CRAWLER_POOL_MAX_RSS_MB):
+        """
+        Args:
+            browser_config: Browser configuration used for every (re-)started crawler
+            max_concurrency: Maximum number of pages crawled at the same time
+            max_pages: Recycle the browser after this many pages, 0 disables the limit
+            max_rss_mb: Recycle the browser once its processes use more memory, 0 disables the limit
+        """
+        self._browser_config = browser_config
+        self._max_concurrency = max(1, max_concurrency)
+        self._max_pages = max_pages
+        self._max_rss_mb = max_rss_mb
+
+        self._crawler: Optional[AsyncWebCrawler] = None
+        # Playwright driver and managed Chromium of the crawler, their process trees are the browser
+        self._browser_pids: List[int] = list()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._condition: Optional[asyncio.Condition] = None
+        self._active = 0
+        self._pages = 0
+
+    @property
+    def running(self) -> bool:
+        return self._crawler is not None
+
+    async def start(self):
+        """ Start the browser, does nothing if the pool is already running """
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+
+        async with self._condition:
+            await self._start_crawler()
+
+    async def close(self):
+        """ Wait for running crawls to finish and shut the browser down """
+        if self._condition is None:
+            return
+
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._active == 0)
+            await self._close_crawler()
+
+    @asynccontextmanager
+    async def crawler(self):
+        """ Borrow the shared crawler for a single crawl
+
+        The pool is started on first use if it was not started with the app.
+        """
+        if self._condition is None:
+            await self.start()
+
+        async with self._semaphore:
+            async with self._condition:
+                if await self._needs_recycle():
+                    # -- Let running crawls finish before the browser is replaced
+                    await self._condition.wait_for(lambda: self._active == 0)
+                    if await self._needs_recycle():
+                        await self._close_crawler()
+                await self._start_crawler()
+                self._active += 1
+                self._pages += 1
+                crawler = self._crawler
+
+            try:
+                yield crawler
+            finally:
+                async with self._condition:
+                    self._active -= 1
+                    self._condition.notify_all()
+
+    async def arun(self, url: str, config: CrawlerRunConfig) -> CrawlResult:
+        async with self.crawler() as crawler:
+            return await crawler.arun(url=url, config=config)
+
+    async def _start_crawler(self):
+        if self._crawler is not None:
+            return
+
+        logging.info("Starting shared crawler browser")
+        crawler = AsyncWebCrawler(config=self._browser_config)
+        await crawler.start()
+        self._crawler, self._pages = crawler, 0
+        self._browser_pids = _browser_pids(crawler)
+
+    async def _close_crawler(self):
+        if self._crawler is None:
+            return
+
+        crawler, self._crawler = self._crawler, None
+        self._browser_pids = list()
+        logging.info(f"Closing shared crawler browser after {self._pages} pages")
+        try:
+            await crawler.close()
+        except Exception as e:
+            logging.error(f"Error closing crawler browser: {exception_and_traceback(e)}")
+
+    async def _needs_recycle(self) -> bool:
+        if self._crawler is None:
+            return False
+        if self._max_pages and self._pages >= self._max_pages:
+            return True
+        # -- Walking the process tree reads /proc for every process, not on the event loop
+        if self._max_rss_mb and self._browser_pids and \
+                await EXECUTORS.run_io(_browser_rss_mb, self._browser_pids) >= self._max_rss_mb:
+            return True
+        return False
+
+
+def _browser_pids(crawler: AsyncWebCrawler) -> List[int]:
+    """ Pids of the playwright driver, which launches Chromium, and of a managed Chromium
+
+    Only these process trees are measured, other child processes like the workers of the
+    process pool do not belong to the browser.
+    """
+    pids = list()
+    browser_manager = getattr(getattr(crawler, "crawler_strategy", None), "browser_manager", None)
+    try:
+        driver = browser_manager.playwright._impl_obj._connection._transport._proc
+        pids.append(driver.pid)
+    except AttributeError:
+        pass
+    browser_process = getattr(getattr(browser_manager, "managed_browser", None), "browser_process", None)
+    if browser_process is not None:
+        pids.append(browser_process.pid)
+    if not pids:
+        logging.warning("Browser processes not found, the crawler memory ceiling is not checked")
+    return pids
+
+
+def _browser_rss_mb(pids: List[int]) -> float:
+    """ Resident memory of the process trees of pids, ie. the playwright driver and Chromium """
+    rss = 0
+    for pid in pids:
+        try:
+            root = psutil.Process(pid)
+            processes = [root] + root.children(recursive=True)
+        except psutil.Error:
+            continue
+        for process in processes:
+            try:
+                rss += process.memory_info().rss
+            except psutil.Error:
+                continue
+    return rss / (1024 * 1024)
+
+
+CRAWLER_POOL = CrawlerPool()
@@ -0,0 +1,132 @@
+""" Shared executors for work that must not run on the event loop
+
+CPU-bound work (image decoding, HTML parsing, large regex passes) runs in a process pool so it
+does not hold the GIL of the event loop. Blocking I/O (requests, SQLite, synchronous libraries)
+runs in a thread pool. Both pools are created on first use and report their queue depth.
+"""
+import asyncio
+import concurrent.futures
+import logging
+import multiprocessing
+import threading
+from typing import Callable, Dict, Optional, TypeVar
+
+from recipe_agent.recipe_config import EXECUTOR_CPU_WORKERS, EXECUTOR_IO_WORKERS
+
+T = TypeVar("T")
+
+
+class _PoolStats:
+    def __init__(self, workers: int):
+        self.workers = workers
+        # Stats of the other tasks running in the same workers, eg. CPU-bound work in the I/O threads
+        self.shared: Optional["_PoolStats"] = None
+        self.pending = 0
+        self.max_pending = 0
+        self.completed = 0
+        self._lock = threading.Lock()
+
+    @property
+    def queued(self) -> int:
+        """ Submitted tasks waiting for a free worker, with shared workers the depth of their common queue """
+        pending = self.pending if self.shared is None else self.pending + self.shared.pending
+        return max(0, pending - self.workers)
+
+    def share_workers(self, other: "_PoolStats"):
+        self.workers = other.workers
+        self.shared, other.shared = other, self
+
+    def submitted(self):
+        with self._lock:
+            self.pending += 1
+            self.max_pending = max(self.max_pending, self.pending)
+
+    def done(self, _future=None):
+        with self._lock:
+            self.pending -= 1
+            self.completed += 1
+
+    def as_dict(self) -> dict:
+        return {"workers": self.workers, "pending": self.pending, "queued": self.queued,
+                "max_pending": self.max_pending, "completed": self.completed}
+
+
+class Executors:
+    def __init__(self, cpu_workers: int = EXECUTOR_CPU_WORKERS, io_workers: int = EXECUTOR_IO_WORKERS):
+        """
+        Args:
+            cpu_workers: Processes for CPU-bound work, 0 runs it in the thread pool instead
+            io_workers: Threads for blocking I/O
+        """
+        self.cpu_workers = max(0, cpu_workers)
+        self.io_workers = max(1, io_workers)
+        self._cpu_pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self._io_pool: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._cpu_stats = _PoolStats(self.cpu_workers)
+        self._io_stats = _PoolStats(self.io_workers)
+        if self.cpu_workers == 0:
+            # -- CPU-bound work runs in the I/O threads and is counted against them
+            self._cpu_stats.share_workers(self._io_stats)
+
+    async def run_cpu(self, func: Callable[..., T], *args, **kwargs) -> T:
+        """ Run a CPU-bound function in the process pool, func and arguments have to be picklable """
+        return await asyncio.wrap_future(self.submit_cpu(func, *args, **kwargs))
+
+    async def run_io(self, func: Callable[..., T], *args, **kwargs) -> T:
+        """ Run a blocking function in the thread pool """
+        return await asyncio.wrap_future(self.submit_io(func, *args, **kwargs))
+
+    def submit_cpu(self, func: Callable[..., T], *args, **kwargs) -> concurrent.futures.Future:
+        """ Like run_cpu, returns a concurrent.futures.Future
+
+        Never wait for the result in a thread of the I/O pool: with cpu_workers=0 the work is queued behind it.
+        """
+        if self.cpu_workers == 0:
+            return self._submit(self._io(), self._cpu_stats, func, *args, **kwargs)
+        return self._submit(self._cpu(), self._cpu_stats, func, *args, **kwargs)
+
+    def submit_io(self, func: Callable[..., T], *args, **kwargs) -> concurrent.futures.Future:
+        return self._submit(self._io(), self._io_stats, func, *args, **kwargs)
+
+    def stats(self) -> Dict[str, dict]:
+        return {"cpu": self._cpu_stats.as_dict(), "io": self._io_stats.as_dict()}
+
+    def shutdown(self, wait: bool = True):
+        """ Stop the pools, they are started again on the next use """
+        with self._lock:
+            cpu_pool, self._cpu_pool = self._cpu_pool, None
+            io_pool, self._io_pool = self._io_pool, None
+        for pool in (cpu_pool, io_pool):
+            if pool is not None:
+                pool.shutdown(wait=wait, cancel_futures=not wait)
+
+    def _submit(self, pool: concurrent.futures.Executor, stats: _PoolStats, func: Callable[..., T],
+                *args, **kwargs) -> concurrent.futures.Future:
+        stats.submitted()
+        try:
+            future = pool.submit(func, *args, **kwargs)
+        except Exception:
+            stats.done()
+            raise
+        future.add_done_callback(stats.done)
+        if stats.queued:
+            logging.debug(f"Executor queue depth: {self.stats()}")
+        return future
+
+    def _cpu(self) -> concurrent.futures.ProcessPoolExecutor:
+        with self._lock:
+            if self._cpu_pool is None:
+                # -- Forking the multi-threaded bot process is unsafe, workers are started fresh
+                self._cpu_pool = concurrent.futures.ProcessPoolExecutor(
+                    self.cpu_workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._cpu_pool
+
+    def _io(self) -> concurrent.futures.ThreadPoolExecutor:
+        with self._lock:
+            if self._io_pool is None:
+                self._io_pool = concurrent.futures.ThreadPoolExecutor(self.io_workers, thread_name_prefix="blocking-io")
+            return self._io_pool
+
+
+EXECUTORS = Executors()
@@ -0,0 +1,178 @@
+""" Content-addressed cache of LLM recipe extractions
+
+Extractions are keyed by model, response schema, instruction and the cleaned page content, so an
+unchanged page is never sent to the LLM twice. Only validated RecipeLLM data is stored. Hits and
+misses are counted in the database, so the stats command sees those of all processes. Reads do not
+write: access times and counters are collected and written with the next put or after
+touch_interval seconds.
+
+Usage:
+    python -m recipe_agent.extraction_cache stats
+    python -m recipe_agent.extraction_cache invalidate https://www.chefkoch.de/rezepte/...
+    python -m recipe_agent.extraction_cache clear
+"""
+import argparse
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from recipe_agent.recipe import RecipeLLM
+from recipe_agent.recipe_config import EXTRACTION_CACHE_PATH, EXTRACTION_CACHE_MAX_ENTRIES, CACHE_TOUCH_INTERVAL
+from recipe_agent.utils import normalize_url
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ExtractionCache:
+    def __init__(self, path: Path = EXTRACTION_CACHE_PATH, max_entries: int = EXTRACTION_CACHE_MAX_ENTRIES,
+                 touch_interval: float = CACHE_TOUCH_INTERVAL):
+        """
+        Args:
+            path: Location of the SQLite database file
+            max_entries: Least recently used extractions are evicted beyond this number, 0 disables the cache
+            touch_interval: Seconds between writes of the access times and counters collected by get
+        """
+        self._path = Path(path)
+        self.max_entries = max_entries
+        self.touch_interval = touch_interval
+        # key -> unwritten access time, counter -> unwritten increment
+        self._touched: Dict[str, float] = dict()
+        self._counted: Dict[str, int] = dict()
+        self._touches_written = time.time()
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+
+    @staticmethod
+    def key(model: str, schema: dict, instruction: str, cleaned_markdown: str) -> str:
+        return _sha256(json.dumps([
+            model, _sha256(json.dumps(schema, sort_keys=True)), _sha256(instruction), _sha256(cleaned_markdown)
+        ]))
+
+    def get(self, key: str) -> Optional[RecipeLLM]:
+        return self.get_any([key])
+
+    def get_any(self, keys: List[str]) -> Optional[RecipeLLM]:
+        """ Extraction of the first key that is cached, eg. the keys of the models of a route in order """
+        if self.max_entries <= 0:
+            return None
+
+        with self._lock:
+            row = None
+            for key in keys:
+                row = self._db().execute("SELECT data FROM extractions WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self._touched[key] = time.time()
+                    break
+            counter = "hits" if row else "misses"
+            self._counted[counter] = self._counted.get(counter, 0) + 1
+            if time.time() - self._touches_written > self.touch_interval:
+                self._write_touches()
+                self._db().commit()
+
+        return RecipeLLM.model_validate_json(row[0]) if row else None
+
+    def put(self, key: str, recipe_llm: RecipeLLM, url: str, model: str):
+        if self.max_entries <= 0:
+            return
+
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO extractions (key, url, model, data, created, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, normalize_url(url), model, recipe_llm.model_dump_json(by_alias=True), time.time(), time.time())
+            )
+            self._touched.pop(key, None)
+            self._write_touches()
+            db.execute(
+                "DELETE FROM extractions WHERE key IN "
+                "(SELECT key FROM extractions ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            db.commit()
+
+    def invalidate(self, url: Optional[str] = None) -> int:
+        """ Remove the extractions of url or all extractions
+
+        Returns:
+            Number of removed extractions
+        """
+        with self._lock:
+            if url:
+                cursor = self._db().execute("DELETE FROM extractions WHERE url = ?", (normalize_url(url),))
+            else:
+                cursor = self._db().execute("DELETE FROM extractions")
+            self._db().commit()
+            return cursor.rowcount
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._db().execute("SELECT COUNT(*) FROM extractions").fetchone()[0]
+            counters = dict(self._db().execute("SELECT name, value FROM counters").fetchall())
+            for name, count in self._counted.items():
+                counters[name] = counters.get(name, 0) + count
+        return {"entries": entries, "hits": counters.get("hits", 0), "misses": counters.get("misses", 0)}
+
+    def flush(self):
+        """ Write the collected access times and counters, eg. before the process exits """
+        with self._lock:
+            self._write_touches()
+            self._db().commit()
+
+    def _write_touches(self):
+        touched, self._touched = self._touched, dict()
+        counted, self._counted = self._counted, dict()
+        db = self._db()
+        db.executemany("UPDATE extractions SET last_access = ? WHERE key = ?",
+                       [(last_access, key) for key, last_access in touched.items()])
+        db.executemany("INSERT INTO counters (name, value) VALUES (?, ?) "
+                       "ON CONFLICT (name) DO UPDATE SET value = value + excluded.value", list(counted.items()))
+        self._touches_written = time.time()
+
+    def _db(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(self._path, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS extractions ("
+                "key TEXT PRIMARY KEY, url TEXT NOT NULL, model TEXT NOT NULL, data TEXT NOT NULL, "
+                "created REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS extractions_url ON extractions (url)")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+            )
+            self._connection.commit()
+        return self._connection
+
+
+EXTRACTION_CACHE = ExtractionCache()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the LLM recipe extraction cache")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("stats", help="Show the number of cached extractions")
+    invalidate_parser = subparsers.add_parser("invalidate", help="Remove the cached extractions of a url")
+    invalidate_parser.add_argument("url")
+    subparsers.add_parser("clear", help="Remove all cached extractions")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.command == "stats":
+        print(json.dumps(EXTRACTION_CACHE.stats()))
+    elif args.command == "invalidate":
+        print(f"{EXTRACTION_CACHE.invalidate(args.url)} Extraktionen entfernt")
+    else:
+        print(f"{EXTRACTION_CACHE.invalidate()} Extraktionen entfernt")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+""" Persistence backends for ChatHistory
+
+Conversations are read from memory; the backend is consulted when a conversation is not in
+memory, eg. after a restart, and before every conversation turn to pick up what another process
+wrote meanwhile. The SQLite backend writes behind: saved states are collected in memory and flushed
+in batches by a writer thread, so the message path never waits for the disk. The database runs in
+WAL mode with a separate reading connection, so reads do not wait for a flush and several worker
+processes can share it. Processes serving the same user at the same time are not merged, the last
+written turn wins.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from recipe_agent.recipe_config import (CHAT_HISTORY_BACKEND, CHAT_HISTORY_PATH, CHAT_HISTORY_FLUSH_INTERVAL,
+                                        CHAT_HISTORY_MAX_AGE)
+
+
+class HistoryBackend:
+    """ Keeps conversations in memory only """
+
+    def load(self, namespace: str, username: str) -> Optional[dict]:
+        return None
+
+    def load_recent(self, namespace: str, limit: int) -> Dict[str, dict]:
+        """ The most recently updated conversations of namespace, oldest first """
+        return dict()
+
+    def reload(self, namespace: str, username: str) -> Optional[dict]:
+        """ The stored state if another process updated the conversation since it was last read or written """
+        return None
+
+    def save(self, namespace: str, username: str, state: dict):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SQLiteHistoryBackend(HistoryBackend):
+    def __init__(self, path: Path = CHAT_HISTORY_PATH, flush_interval: float = CHAT_HISTORY_FLUSH_INTERVAL,
+                 max_age: float = CHAT_HISTORY_MAX_AGE):
+        """
+        Args:
+            path: Location of the SQLite database file
+            flush_interval: Seconds between batched writes
+            max_age: Seconds after which conversations without updates are removed
+        """
+        self._path = Path(path)
+        self.flush_interval = flush_interval
+        self.max_age = max_age
+
+        # (namespace, username) -> latest unwritten state
+        self._pending: Dict[Tuple[str, str], dict] = dict()
+        self._pending_lock = threading.Lock()
+        # (namespace, username) -> updated column of the row this process read or wrote last
+        self._versions: Dict[Tuple[str, str], float] = dict()
+        self._db_lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._read_connection: Optional[sqlite3.Connection] = None
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._writer: Optional[threading.Thread] = None
+
+    def load(self, namespace: str, username: str) -> Optional[dict]:
+        with self._pending_lock:
+            if (namespace, username) in self._pending:
+                return self._pending[(namespace, username)]
+
+        with self._read_lock:
+            row = self._reader().execute(
+                "SELECT state, updated FROM conversations WHERE namespace = ? AND username = ?",
+                (namespace, username)).fetchone()
+        if row is None:
+            return None
+        self._versions[(namespace, username)] = row[1]
+        return json.loads(row[0])
+
+    def load_recent(self, namespace: str, limit: int) -> Dict[str, dict]:
+        with self._read_lock:
+            rows = self._reader().execute(
+                "SELECT username, state, updated FROM conversations WHERE namespace = ? "
+                "ORDER BY updated DESC LIMIT ?", (namespace, limit)
+            ).fetchall()
+        for username, _, updated in rows:
+            self._versions[(namespace, username)] = updated
+        return {username: json.loads(state) for username, state, _ in reversed(rows)}
+
+    def reload(self, namespace: str, username: str) -> Optional[dict]:
+        key = (namespace, username)
+        with self._pending_lock:
+            if key in self._pending:
+                # -- Own unwritten changes are newer than anything in the database
+                return None
+        with self._read_lock:
+            row = self._reader().execute(
+                "SELECT state, updated FROM conversations WHERE namespace = ? AND username = ? AND updated IS NOT ?",
+                (namespace, username, self._versions.get(key))).fetchone()
+        if row is None:
+            return None
+        self._versions[key] = row[1]
+        return json.loads(row[0])
+
+    def save(self, namespace: str, username: str, state: dict):
+        with self._pending_lock:
+            self._pending[(namespace, username)] = state
+
+        if self._writer is None and not self._closed:
+            self._writer = threading.Thread(target=self._write_behind, name="chat-history-writer", daemon=True)
+            self._writer.start()
+
+    def flush(self):
+        """ Write all pending states in one transaction """
+        with self._pending_lock:
+            pending, self._pending = self._pending, dict()
+        if not pending:
+            return
+
+        now = time.time()
+        try:
+            # -- Recipes are referenced as models and only serialized here in the writer thread
+            rows = [(namespace, username, json.dumps(state, ensure_ascii=False, default=_model_dump), now)
+                    for (namespace, username), state in pending.items()]
+            with self._db_lock:
+                db = self._db()
+                try:
+                    db.executemany("INSERT OR REPLACE INTO conversations (namespace, username, state, updated) "
+                                   "VALUES (?, ?, ?, ?)", rows)
+                    if self.max_age > 0:
+                        db.execute("DELETE FROM conversations WHERE updated < ?", (now - self.max_age,))
+                    db.commit()
+                except Exception:
+                    db.rollback()
+                    raise
+        except Exception:
+            # -- Keep the batch for the next flush, states saved meanwhile are newer
+            with self._pending_lock:
+                self._pending = pending | self._pending
+            raise
+
+        for key in pending:
+            self._versions[key] = now
+
+    def close(self):
+        """ Stop the writer thread after a final flush """
+        self._closed = True
+        self._wakeup.set()
+        if self._writer is not None:
+            self._writer.join(timeout=10.0)
+            self._writer = None
+        self.flush()
+
+    def _write_behind(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Chat-Verlauf konnte nicht gespeichert werden: {e}")
+
+    def _reader(self) -> sqlite3.Connection:
+        if self._read_connection is None:
+            # -- Creates the schema before the first read
+            with self._db_lock:
+                self._db()
+            self._read_connection = sqlite3.connect(self._path, check_same_thread=False)
+            self._read_connection.execute("PRAGMA busy_timeout=5000")
+        return self._read_connection
+
+    def _db(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(self._path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute("PRAGMA busy_timeout=5000")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS conversations ("
+                "namespace TEXT NOT NULL, username TEXT NOT NULL, state TEXT NOT NULL, updated REAL NOT NULL, "
+                "PRIMARY KEY (namespace, username))"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS conversations_updated ON conversations (updated)")
+            self._connection.commit()
+        return self._connection
+
+
+def _model_dump(obj):
+    return obj.model_dump(by_alias=True)
+
+
+def create_history_backend(kind: str = CHAT_HISTORY_BACKEND) -> HistoryBackend:
+    if kind == "sqlite":
+        return SQLiteHistoryBackend()
+    if kind != "memory":
+        logging.warning(f"Unknown chat history backend {kind}, keeping chat histories in memory")
+    return HistoryBackend()
+
+
+HISTORY_BACKEND = create_history_backend()
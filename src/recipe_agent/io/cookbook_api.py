@@ -5,16 +5,30 @@ Diese Klasse implementiert einen Wrapper für die Nextcloud Cookbook API
 basierend auf der Dokumentation: https://nextcloud.github.io/cookbook/dev/api/0.1.2/
 """
 
+import asyncio
 import logging
 import os
-from typing import List, Optional, Union, Dict, Any
+import re
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import List, Optional, Union, Dict, Any, Tuple
 
 import httpx
 from pydantic import ValidationError
 
+from recipe_agent.executors import EXECUTORS
+from recipe_agent.io.cookbook_urls import CookbookUrls
 from recipe_agent.io.nextcloud import NextcloudRecipe
+from recipe_agent.io.nextcloud_client import NEXTCLOUD_CLIENTS, NextcloudClients
 from recipe_agent.recipe import Recipe
-from recipe_agent.utils import generate_recipe_uid
+from recipe_agent.utils import generate_recipe_uid, normalize_url
+
+# Sekunden, nach denen der Rezept-Index im Hintergrund mit dem Kochbuch abgeglichen wird
+COOKBOOK_INDEX_REFRESH_INTERVAL = float(os.getenv("COOKBOOK_INDEX_REFRESH_INTERVAL", 15 * 60))
+# Reindexierung erst nach so vielen Sekunden ohne weitere Speicherung, spätestens nach der maximalen Verzögerung
+COOKBOOK_REINDEX_QUIET_WINDOW = float(os.getenv("COOKBOOK_REINDEX_QUIET_WINDOW", 10.0))
+COOKBOOK_REINDEX_MAX_DELAY = float(os.getenv("COOKBOOK_REINDEX_MAX_DELAY", 60.0))
 
 
 class NextcloudCookbookAPI:
@@ -23,7 +37,8 @@ class NextcloudCookbookAPI:
     Implementiert GET, PUT und POST Methoden für den Endpunkt /api/v1/recipes
     """
 
-    def __init__(self, base_url: str = None, username: str = None, app_password: str = None):
+    def __init__(self, base_url: str = None, username: str = None, app_password: str = None,
+                 clients: NextcloudClients = NEXTCLOUD_CLIENTS):
         """
         Initialisiert den API-Wrapper mit den Zugangsdaten
 
@@ -31,6 +46,7 @@ class NextcloudCookbookAPI:
             base_url: Basis-URL der Nextcloud-Instanz (ohne abschließenden Slash)
             username: Benutzername für die Nextcloud-Instanz
             app_password: App-Passwort oder Passwort für die Nextcloud-Instanz
+            clients: Geteilte HTTP-Clients, alle Anfragen an eine Instanz nutzen dieselben Verbindungen
         """
         self.base_url = base_url or os.getenv("NEXTCLOUD_URL", "")
         self.username = username or os.getenv("NEXTCLOUD_USERNAME", "")
@@ -40,9 +56,16 @@ class NextcloudCookbookAPI:
             logging.warning("Nextcloud-Konfiguration unvollständig. Stelle sicher, dass NEXTCLOUD_URL, "
                             "NEXTCLOUD_USERNAME und NEXTCLOUD_APP_PASSWORD gesetzt sind.")
 
+        self._clients = clients
+
         # API-Endpunkt für Rezepte
         self.recipes_endpoint = f"{self.base_url}/index.php/apps/cookbook/api/v1/recipes"
 
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Geteilter Client der Nextcloud-Instanz mit Keep-Alive"""
+        return self._clients.get(self.base_url, self.username, self.app_password)
+
     async def get_all_recipes(self) -> List[Dict[str, Any]]:
         """
         Ruft alle verfügbaren Rezepte von der Nextcloud Cookbook API ab
@@ -53,20 +76,23 @@ class NextcloudCookbookAPI:
         if not self._check_credentials():
             return []
 
-        async with httpx.AsyncClient(auth=(self.username, self.app_password)) as client:
-            try:
-                response = await client.get(self.recipes_endpoint)
-                response.raise_for_status()
-                return response.json()
-            except httpx.HTTPStatusError as exc:
-                logging.error(f"HTTP Fehler beim Abrufen der Rezepte: HTTP {exc.response.status_code} - {exc.response.text.strip()}")
-            except httpx.RequestError as exc:
-                logging.error(f"Fehler bei der Anfrage für Rezepte: {exc}")
-            except Exception as e:
-                logging.error(f"Unerwarteter Fehler beim Abrufen der Rezepte: {e}")
+        try:
+            return await self._fetch_all_recipes()
+        except httpx.HTTPStatusError as exc:
+            logging.error(f"HTTP Fehler beim Abrufen der Rezepte: HTTP {exc.response.status_code} - {exc.response.text.strip()}")
+        except httpx.RequestError as exc:
+            logging.error(f"Fehler bei der Anfrage für Rezepte: {exc}")
+        except Exception as e:
+            logging.error(f"Unerwarteter Fehler beim Abrufen der Rezepte: {e}")
 
         return []
 
+    async def _fetch_all_recipes(self) -> List[Dict[str, Any]]:
+        """Wie get_all_recipes, Fehler werden aber weitergereicht"""
+        response = await self.client.get(self.recipes_endpoint)
+        response.raise_for_status()
+        return response.json()
+
     async def get_recipe(self, recipe_id: int) -> Optional[Dict[str, Any]]:
         """
         Ruft ein einzelnes Rezept anhand seiner ID ab
@@ -80,21 +106,20 @@ class NextcloudCookbookAPI:
         if not self._check_credentials():
             return None
 
-        async with httpx.AsyncClient(auth=(self.username, self.app_password)) as client:
-            try:
-                response = await client.get(f"{self.recipes_endpoint}/{recipe_id}")
-                response.raise_for_status()
-                return response.json()
-            except httpx.HTTPStatusError as exc:
-                if exc.response.status_code == 404:
-                    logging.warning(f"Rezept mit ID {recipe_id} nicht gefunden.")
-                else:
-                    logging.error(f"HTTP Fehler beim Abrufen des Rezepts {recipe_id}: "
-                                  f"HTTP {exc.response.status_code} - {exc.response.text.strip()}")
-            except httpx.RequestError as exc:
-                logging.error(f"Fehler bei der Anfrage für Rezept {recipe_id}: {exc}")
-            except Exception as e:
-                logging.error(f"Unerwarteter Fehler beim Abrufen des Rezepts {recipe_id}: {e}")
+        try:
+            response = await self.client.get(f"{self.recipes_endpoint}/{recipe_id}")
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPStatusError as exc:
+            if exc.response.status_code == 404:
+                logging.warning(f"Rezept mit ID {recipe_id} nicht gefunden.")
+            else:
+                logging.error(f"HTTP Fehler beim Abrufen des Rezepts {recipe_id}: "
+                              f"HTTP {exc.response.status_code} - {exc.response.text.strip()}")
+        except httpx.RequestError as exc:
+            logging.error(f"Fehler bei der Anfrage für Rezept {recipe_id}: {exc}")
+        except Exception as e:
+            logging.error(f"Unerwarteter Fehler beim Abrufen des Rezepts {recipe_id}: {e}")
 
         return None
 
@@ -121,18 +146,17 @@ class NextcloudCookbookAPI:
         if "id" in recipe_data:
             recipe_data.pop("id", None)
 
-        async with httpx.AsyncClient(auth=(self.username, self.app_password)) as client:
-            try:
-                response = await client.post(self.recipes_endpoint, json=recipe_data)
-                response.raise_for_status()
-                return response.json()
-            except httpx.HTTPStatusError as exc:
-                logging.error(f"HTTP Fehler beim Erstellen des Rezepts: "
-                              f"HTTP {exc.response.status_code} - {exc.response.text.strip()}")
-            except httpx.RequestError as exc:
-                logging.error(f"Fehler bei der Anfrage zum Erstellen des Rezepts: {exc}")
-            except Exception as e:
-                logging.error(f"Unerwarteter Fehler beim Erstellen des Rezepts: {e}")
+        try:
+            response = await self.client.post(self.recipes_endpoint, json=recipe_data)
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPStatusError as exc:
+            logging.error(f"HTTP Fehler beim Erstellen des Rezepts: "
+                          f"HTTP {exc.response.status_code} - {exc.response.text.strip()}")
+        except httpx.RequestError as exc:
+            logging.error(f"Fehler bei der Anfrage zum Erstellen des Rezepts: {exc}")
+        except Exception as e:
+            logging.error(f"Unerwarteter Fehler beim Erstellen des Rezepts: {e}")
 
         return None
 
@@ -158,21 +182,20 @@ class NextcloudCookbookAPI:
         # Stellen sicher, dass die ID im Rezept mit der angegebenen ID übereinstimmt
         recipe_data["id"] = recipe_id
 
-        async with httpx.AsyncClient(auth=(self.username, self.app_password)) as client:
-            try:
-                response = await client.put(f"{self.recipes_endpoint}/{recipe_id}", json=recipe_data)
-                response.raise_for_status()
-                return response.json()
-            except httpx.HTTPStatusError as exc:
-                if exc.response.status_code == 404:
-                    logging.warning(f"Rezept mit ID {recipe_id} nicht gefunden.")
-                else:
-                    logging.error(f"HTTP Fehler beim Aktualisieren des Rezepts {recipe_id}: "
-                                  f"HTTP {exc.response.status_code} - {exc.response.text.strip()}")
-            except httpx.RequestError as exc:
-                logging.error(f"Fehler bei der Anfrage zum Aktualisieren des Rezepts {recipe_id}: {exc}")
-            except Exception as e:
-                logging.error(f"Unerwarteter Fehler beim Aktualisieren des Rezepts {recipe_id}: {e}")
+        try:
+            response = await self.client.put(f"{self.recipes_endpoint}/{recipe_id}", json=recipe_data)
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPStatusError as exc:
+            if exc.response.status_code == 404:
+                logging.warning(f"Rezept mit ID {recipe_id} nicht gefunden.")
+            else:
+                logging.error(f"HTTP Fehler beim Aktualisieren des Rezepts {recipe_id}: "
+                              f"HTTP {exc.response.status_code} - {exc.response.text.strip()}")
+        except httpx.RequestError as exc:
+            logging.error(f"Fehler bei der Anfrage zum Aktualisieren des Rezepts {recipe_id}: {exc}")
+        except Exception as e:
+            logging.error(f"Unerwarteter Fehler beim Aktualisieren des Rezepts {recipe_id}: {e}")
 
         return None
 
@@ -193,25 +216,24 @@ class NextcloudCookbookAPI:
         # Endpunkt für die Reindexierung
         reindex_endpoint = f"{self.base_url}/apps/cookbook/api/v1/reindex"
 
-        async with httpx.AsyncClient(auth=(self.username, self.app_password)) as client:
-            try:
-                # POST-Request ohne Payload senden
-                response = await client.post(reindex_endpoint)
-                response.raise_for_status()
+        try:
+            # POST-Request ohne Payload senden
+            response = await self.client.post(reindex_endpoint)
+            response.raise_for_status()
 
-                if response.status_code in [200, 201, 204]:
-                    logging.info("Reindexierung der Rezepte erfolgreich gestartet.")
-                    return True
-                else:
-                    logging.warning(f"Unerwarteter Status bei der Reindexierung: {response.status_code}")
-                    return False
+            if response.status_code in [200, 201, 204]:
+                logging.info("Reindexierung der Rezepte erfolgreich gestartet.")
+                return True
+            else:
+                logging.warning(f"Unerwarteter Status bei der Reindexierung: {response.status_code}")
+                return False
 
-            except httpx.HTTPStatusError as exc:
-                logging.error(f"HTTP Fehler bei der Reindexierung: HTTP {exc.response.status_code} - {exc.response.text.strip()}")
-            except httpx.RequestError as exc:
-                logging.error(f"Fehler bei der Anfrage zur Reindexierung: {exc}")
-            except Exception as e:
-                logging.error(f"Unerwarteter Fehler bei der Reindexierung: {e}")
+        except httpx.HTTPStatusError as exc:
+            logging.error(f"HTTP Fehler bei der Reindexierung: HTTP {exc.response.status_code} - {exc.response.text.strip()}")
+        except httpx.RequestError as exc:
+            logging.error(f"Fehler bei der Anfrage zur Reindexierung: {exc}")
+        except Exception as e:
+            logging.error(f"Unerwarteter Fehler bei der Reindexierung: {e}")
 
         return False
 
@@ -261,26 +283,330 @@ class NextcloudCookbookAPI:
             return None
 
 
-async def upload_recipe(recipe_instance: Recipe) -> bool:
-    api = NextcloudCookbookAPI()
-    existing_recipes = [Recipe(**r) for r in await api.get_all_recipes()]
-
-    update_recipe = False
-    for existing_recipe in existing_recipes:
-        if existing_recipe.name == recipe_instance.name:
-            recipe_instance.id = existing_recipe.id
-            update_recipe = True
-            break
-
-    if update_recipe:
-        # -- Update existing Recipe
-        if not await api.update_recipe(recipe_instance.id, recipe_instance):
+def normalize_recipe_name(name: str) -> str:
+    return re.sub(r"\s+", " ", name or "").strip().casefold()
+
+
+@dataclass
+class IndexEntry:
+    id: str
+    name: str
+    url: Optional[str] = None
+    # dateModified des Kochbuchs, um geänderte Rezepte beim Abgleich zu erkennen
+    modified: Optional[str] = None
+
+
+class CookbookIndex:
+    """
+    Lokaler Index Name/Url -> ID der Rezepte im Kochbuch
+
+    Der Index wird einmalig aus der Rezeptliste aufgebaut, bei eigenen Anlagen und Änderungen
+    gepflegt und im Hintergrund abgeglichen. Speichern braucht so genau eine Anfrage, unabhängig
+    von der Größe des Kochbuchs. Die Quell-Urls fehlen in der Rezeptliste, sie werden bei eigenen
+    Speicherungen gesichert und beim Aufbau wieder zugeordnet.
+    """
+
+    def __init__(self, api: NextcloudCookbookAPI = None, refresh_interval: float = COOKBOOK_INDEX_REFRESH_INTERVAL,
+                 urls: CookbookUrls = None):
+        self._api = api
+        self.refresh_interval = refresh_interval
+        self._urls = urls or CookbookUrls()
+        # Gesicherte Quell-Urls nach ID, beim ersten Zugriff geladen
+        self._stored_urls: Optional[Dict[str, str]] = None
+        self._by_id: Dict[str, IndexEntry] = dict()
+        self._by_name: Dict[str, IndexEntry] = dict()
+        self._by_url: Dict[str, IndexEntry] = dict()
+        self._loaded_at: Optional[float] = None
+        # Nach einem fehlgeschlagenen Update vor der nächsten Suche abgleichen
+        self._stale = False
+        # Zeitpunkt der letzten eigenen Speicherung je ID, ein laufender Abgleich überschreibt sie nicht
+        self._saved_at: Dict[str, float] = dict()
+        self._bootstrap_lock = asyncio.Lock()
+        # Serialisiert Suche und Anlage je Name und Url, damit ein Rezept nicht doppelt angelegt wird:
+        # Schlüssel -> (Lock, Anzahl der Speicherungen, die ihn halten oder darauf warten)
+        self._save_locks: Dict[str, Tuple[asyncio.Lock, int]] = dict()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    @property
+    def api(self) -> NextcloudCookbookAPI:
+        if self._api is None:
+            self._api = NextcloudCookbookAPI()
+        return self._api
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def lookup(self, recipe: Recipe) -> Optional[IndexEntry]:
+        """ Rezept im Kochbuch zuerst über die Quell-Url, dann über den Namen finden """
+        if recipe.url:
+            entry = self._by_url.get(normalize_url(recipe.url))
+            if entry is not None:
+                return entry
+        return self._by_name.get(normalize_recipe_name(recipe.name))
+
+    def put(self, entry: IndexEntry):
+        self.remove(entry.id)
+        name = normalize_recipe_name(entry.name)
+        if name in self._by_name:
+            # -- Gleichnamiges Rezept mit anderer ID, das neuere gewinnt
+            self.remove(self._by_name[name].id)
+        self._by_id[entry.id] = self._by_name[name] = entry
+        if entry.url:
+            self._by_url[normalize_url(entry.url)] = entry
+
+    def remove(self, recipe_id: str):
+        entry = self._by_id.pop(recipe_id, None)
+        if entry is None:
+            return
+        name = normalize_recipe_name(entry.name)
+        if self._by_name.get(name) is entry:
+            del self._by_name[name]
+        if entry.url and self._by_url.get(normalize_url(entry.url)) is entry:
+            del self._by_url[normalize_url(entry.url)]
+
+    async def ensure_loaded(self):
+        """ Index beim ersten Zugriff aufbauen, danach veraltete Einträge im Hintergrund abgleichen """
+        if self._loaded_at is None or self._stale:
+            async with self._bootstrap_lock:
+                if self._loaded_at is None or self._stale:
+                    await self.refresh()
+        elif time.monotonic() - self._loaded_at > self.refresh_interval and self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_in_background())
+
+    async def refresh(self) -> bool:
+        """ Index mit der Rezeptliste des Kochbuchs abgleichen, ohne die Rezepte zu validieren """
+        if not self.api._check_credentials():
             return False
-        await api.reindex()
-        return True
-    else:
-        # -- Create a new Recipe
-        if not await api.create_recipe(recipe_instance):
+        started = time.monotonic()
+        known = set(self._by_id)
+        try:
+            listing = await self.api._fetch_all_recipes()
+        except Exception as e:
+            logging.error(f"Rezeptliste für den Rezept-Index konnte nicht abgerufen werden: {e}")
             return False
-        await api.reindex()
+
+        stored_urls = await self._load_stored_urls()
+
+        # -- Während des Abrufs gespeicherte Rezepte fehlen in der Liste oder sind dort veraltet
+        saved_since = {recipe_id for recipe_id, saved_at in self._saved_at.items() if saved_at >= started}
+        seen = set()
+        for item in listing:
+            recipe_id = str(item.get("recipe_id", item.get("id", "")))
+            if not recipe_id or not item.get("name"):
+                continue
+            seen.add(recipe_id)
+            if recipe_id in saved_since:
+                continue
+            entry = self._by_id.get(recipe_id)
+            if entry is not None and entry.name == item["name"] and entry.modified == item.get("dateModified"):
+                continue
+            # -- Die Quell-Url ist in der Liste nicht enthalten und bleibt aus eigenen Speicherungen erhalten
+            url = entry.url if entry else stored_urls.get(recipe_id)
+            self.put(IndexEntry(recipe_id, item["name"], url, item.get("dateModified")))
+
+        # -- Im Kochbuch gelöschte Rezepte, nur von vor dem Abruf bekannten Einträgen
+        deleted = ((known & self._by_id.keys()) | stored_urls.keys()) - seen - saved_since
+        for recipe_id in deleted:
+            self.remove(recipe_id)
+            stored_urls.pop(recipe_id, None)
+        if deleted:
+            await self._store_urls(self._urls.remove, deleted)
+        self._saved_at = {recipe_id: self._saved_at[recipe_id] for recipe_id in saved_since}
+
+        self._loaded_at = time.monotonic()
+        self._stale = False
+        logging.info(f"Rezept-Index mit {len(self)} Rezepten abgeglichen")
         return True
+
+    def invalidate(self):
+        """ Beim nächsten Speichern im Hintergrund abgleichen """
+        if self._loaded_at is not None:
+            self._loaded_at = float("-inf")
+
+    async def save(self, recipe_instance: Recipe) -> bool:
+        """ Rezept mit genau einer Anfrage anlegen oder aktualisieren """
+        await self.ensure_loaded()
+        async with self._save_lock(recipe_instance):
+            entry = self.lookup(recipe_instance)
+            if entry is not None:
+                # -- Update existing Recipe
+                recipe_instance.id = entry.id
+                if not await self.api.update_recipe(entry.id, recipe_instance):
+                    # -- Vielleicht im Kochbuch gelöscht oder nur eine Zeitüberschreitung: der Eintrag bleibt,
+                    # -- vor dem nächsten Speichern wird abgeglichen, damit kein Duplikat entsteht
+                    self._stale = True
+                    return False
+                await self._put_saved(IndexEntry(entry.id, recipe_instance.name, recipe_instance.url or entry.url))
+                return True
+
+            # -- Create a new Recipe
+            created = await self.api.create_recipe(recipe_instance)
+            if not created:
+                return False
+            # -- Die API antwortet mit der ID des neuen Rezepts
+            recipe_id = created.get("id") if isinstance(created, dict) else created
+            if recipe_id is not None:
+                await self._put_saved(IndexEntry(str(recipe_id), recipe_instance.name, recipe_instance.url))
+            else:
+                self.invalidate()
+            return True
+
+    @asynccontextmanager
+    async def _save_lock(self, recipe: Recipe):
+        """ Speicherungen mit gleichem Namen oder gleicher Url nacheinander, alle anderen gleichzeitig """
+        keys = {f"name:{normalize_recipe_name(recipe.name)}"}
+        if recipe.url:
+            keys.add(f"url:{normalize_url(recipe.url)}")
+        # -- Immer in derselben Reihenfolge sperren, sonst warten zwei Speicherungen aufeinander
+        keys = sorted(keys)
+
+        locks = list()
+        for key in keys:
+            lock, users = self._save_locks.get(key, (asyncio.Lock(), 0))
+            self._save_locks[key] = (lock, users + 1)
+            locks.append(lock)
+
+        acquired = list()
+        try:
+            for lock in locks:
+                await lock.acquire()
+                acquired.append(lock)
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+            for key in keys:
+                lock, users = self._save_locks[key]
+                if users <= 1:
+                    self._save_locks.pop(key)
+                else:
+                    self._save_locks[key] = (lock, users - 1)
+
+    async def _put_saved(self, entry: IndexEntry):
+        self.put(entry)
+        self._saved_at[entry.id] = time.monotonic()
+        stored_urls = await self._load_stored_urls()
+        if entry.url and stored_urls.get(entry.id) != entry.url:
+            stored_urls[entry.id] = entry.url
+            await self._store_urls(self._urls.put, entry.id, entry.url)
+
+    async def _load_stored_urls(self) -> Dict[str, str]:
+        if self._stored_urls is None:
+            try:
+                stored_urls = await EXECUTORS.run_io(self._urls.load)
+            except Exception as e:
+                logging.error(f"Gesicherte Quell-Urls konnten nicht geladen werden: {e}")
+                return dict()
+            # -- Eine gleichzeitige Speicherung hat die Urls vielleicht schon geladen und ergänzt
+            if self._stored_urls is None:
+                self._stored_urls = stored_urls
+        return self._stored_urls
+
+    @staticmethod
+    async def _store_urls(func, *args):
+        try:
+            await EXECUTORS.run_io(func, *args)
+        except Exception as e:
+            logging.error(f"Quell-Urls konnten nicht gesichert werden: {e}")
+
+    async def _refresh_in_background(self):
+        try:
+            await self.refresh()
+        except Exception as e:
+            logging.error(f"Rezept-Index konnte nicht abgeglichen werden: {e}")
+        finally:
+            self._refresh_task = None
+
+
+class ReindexCoordinator:
+    """
+    Fasst Reindexierungen des Kochbuchs zusammen
+
+    Die Reindexierung ist die teuerste Anfrage der Cookbook App. Anfragen innerhalb des Ruhefensters
+    werden zu einer Reindexierung zusammengefasst, es läuft höchstens eine gleichzeitig. Während einer
+    Reindexierung eingehende Anfragen lösen danach genau eine weitere aus.
+    """
+
+    def __init__(self, api: NextcloudCookbookAPI = None, quiet_window: float = COOKBOOK_REINDEX_QUIET_WINDOW,
+                 max_delay: float = COOKBOOK_REINDEX_MAX_DELAY):
+        """
+        Args:
+            quiet_window: Sekunden ohne neue Anfrage, nach denen reindexiert wird
+            max_delay: Sekunden nach der ersten offenen Anfrage, nach denen spätestens reindexiert wird
+        """
+        self._api = api
+        self.quiet_window = quiet_window
+        self.max_delay = max(quiet_window, max_delay)
+        # Zeitpunkte der ersten und letzten noch nicht ausgeführten Anfrage
+        self._first_request: Optional[float] = None
+        self._last_request: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flushing = False
+        self.requests = 0
+        self.runs = 0
+
+    @property
+    def api(self) -> NextcloudCookbookAPI:
+        if self._api is None:
+            self._api = NextcloudCookbookAPI()
+        return self._api
+
+    @property
+    def pending(self) -> bool:
+        return self._first_request is not None
+
+    def request(self):
+        """ Reindexierung anfordern, kehrt sofort zurück """
+        now = time.monotonic()
+        if self._first_request is None:
+            self._first_request = now
+        self._last_request = now
+        self.requests += 1
+
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def flush(self):
+        """ Offene Anfragen sofort ausführen und auf laufende Reindexierungen warten, zB. beim Herunterfahren """
+        if self._task is None or self._task.done():
+            return
+        self._flushing = True
+        self._wakeup.set()
+        try:
+            await self._task
+        finally:
+            self._flushing = False
+
+    async def _run(self):
+        while self._first_request is not None:
+            delay = min(self._last_request + self.quiet_window, self._first_request + self.max_delay) - time.monotonic()
+            if delay > 0 and not self._flushing:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                # -- Neue Anfragen während des Wartens verschieben den Zeitpunkt
+                continue
+
+            coalesced = self.requests
+            self._first_request = self._last_request = None
+            self.runs += 1
+            try:
+                await self.api.reindex()
+            except Exception as e:
+                logging.error(f"Reindexierung fehlgeschlagen: {e}")
+            logging.info(f"Reindexierung {self.runs} für bisher {coalesced} Anfragen")
+
+
+COOKBOOK_INDEX = CookbookIndex()
+COOKBOOK_REINDEX = ReindexCoordinator()
+
+
+async def upload_recipe(recipe_instance: Recipe) -> bool:
+    if not await COOKBOOK_INDEX.save(recipe_instance):
+        return False
+    # -- Mehrere Speicherungen kurz hintereinander werden gemeinsam reindexiert
+    COOKBOOK_REINDEX.request()
+    return True
@@ -0,0 +1,49 @@
+"""Quell-Urls der Rezepte im Kochbuch
+
+Die Rezeptliste der Cookbook App enthält keine Quell-Urls. Damit der Rezept-Index ein Rezept auch nach
+einem Neustart über seine Url findet, werden die Urls eigener Speicherungen in einer SQLite Datenbank
+gehalten.
+"""
+
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+from recipe_agent.recipe_config import COOKBOOK_URLS_PATH
+
+
+class CookbookUrls:
+    def __init__(self, path: Path = COOKBOOK_URLS_PATH):
+        """
+        Args:
+            path: Location of the SQLite database file
+        """
+        self._path = Path(path)
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+
+    def load(self) -> Dict[str, str]:
+        """Quell-Urls nach Rezept-ID"""
+        with self._lock:
+            rows = self._db().execute("SELECT recipe_id, url FROM urls").fetchall()
+        return dict(rows)
+
+    def put(self, recipe_id: str, url: str):
+        with self._lock:
+            self._db().execute("INSERT OR REPLACE INTO urls (recipe_id, url) VALUES (?, ?)", (recipe_id, url))
+            self._db().commit()
+
+    def remove(self, recipe_ids: Iterable[str]):
+        """Urls der im Kochbuch gelöschten Rezepte entfernen"""
+        with self._lock:
+            self._db().executemany("DELETE FROM urls WHERE recipe_id = ?", [(recipe_id,) for recipe_id in recipe_ids])
+            self._db().commit()
+
+    def _db(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(self._path, check_same_thread=False)
+            self._connection.execute("CREATE TABLE IF NOT EXISTS urls (recipe_id TEXT PRIMARY KEY, url TEXT NOT NULL)")
+            self._connection.commit()
+        return self._connection
@@ -4,13 +4,36 @@ import os
 import re
 import urllib
 import urllib.parse
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Optional, Tuple
 
 from recipe_agent.recipe import Recipe
-from recipe_agent.utils import get_link_preview_image, download_image_to_tempfile, resize_and_crop_image
+from recipe_agent.utils import get_link_preview_image, download_image, create_image_derivatives, IMAGE_FORMAT_EXTENSIONS
 
 IMAGE_ATTR = {"full": 1024, "thumb": 256, "thumb16": 16, }
+# Pillow format and quality of the preview images, JPEG, PNG or WEBP
+IMAGE_FORMAT = os.getenv("NEXTCLOUD_IMAGE_FORMAT", "JPEG").upper()
+IMAGE_QUALITY = int(os.getenv("NEXTCLOUD_IMAGE_QUALITY", 85))
+
+
+@dataclass
+class PreviewImage:
+    """ Source url and encoded sizes of IMAGE_ATTR of a recipe preview image, empty if there is none """
+    url: Optional[str] = None
+    derivatives: Dict[str, bytes] = field(default_factory=dict)
+
+
+def derive_preview_image(url: str, image_data: bytes) -> PreviewImage:
+    """ Decode once in memory and derive all sizes from the largest one
+
+    CPU-bound and picklable, async callers run it in the process pool of EXECUTORS.
+    """
+    try:
+        return PreviewImage(url, create_image_derivatives(image_data, IMAGE_ATTR, IMAGE_FORMAT, IMAGE_QUALITY))
+    except Exception as e:
+        logging.error(f"Could not create preview images from {url}: {e}")
+        return PreviewImage()
 
 
 class NextcloudRecipe(Recipe):
@@ -21,13 +44,19 @@ class NextcloudRecipe(Recipe):
     def get_recipe_folder(self, overwrite_recipe_dir: Optional[Path] = None) -> Optional[Path]:
         return self._create_recipe_folder(overwrite_recipe_dir)
 
-    def create_recipe(self, overwrite_recipe_dir: Optional[Path] = None):
+    def create_recipe(self, overwrite_recipe_dir: Optional[Path] = None, preview_image: Optional[PreviewImage] = None):
+        """
+        Args:
+            preview_image: Prepared preview image, downloaded and derived in the calling thread if not given
+        """
         self._directory = self.get_recipe_folder(overwrite_recipe_dir)
         if not self._directory:
             logging.error(f"Could not create a recipe folder at {os.getenv("NEXTCLOUD_RECIPE_FOLDER", "NaN")}")
             return
 
-        self._create_recipe_preview_image()
+        if preview_image is None:
+            preview_image = self.create_preview_image()
+        self._save_preview_image(preview_image)
         self._create_recipe_data()
         logging.debug(f"Created Nextcloud Cookbook recipe files {self.name} at {self._directory}")
 
@@ -48,30 +77,41 @@ class NextcloudRecipe(Recipe):
         directory.mkdir(exist_ok=True)
         return directory
 
-    def _create_recipe_preview_image(self):
+    def download_preview_image(self) -> Optional[Tuple[str, bytes]]:
+        """ Url and content of the link preview image of the recipe page """
         if not self.url:
-            return
+            return None
 
         link_preview_image = get_link_preview_image(self.url)
         if not link_preview_image:
-            return
+            return None
 
         if link_preview_image.startswith("/"):
             url = urllib.parse.urlparse(self.url)
             link_preview_image = f"{url.scheme}://{url.netloc}{link_preview_image}"
 
-        temp_file = download_image_to_tempfile(link_preview_image)
-        if not temp_file:
+        image_data = download_image(link_preview_image)
+        if not image_data:
+            return None
+        return link_preview_image, image_data
+
+    def create_preview_image(self) -> PreviewImage:
+        source = self.download_preview_image()
+        return derive_preview_image(*source) if source else PreviewImage()
+
+    def _save_preview_image(self, preview_image: PreviewImage):
+        if not preview_image.derivatives:
             return
 
-        # Resize
-        for name, max_size in IMAGE_ATTR.items():
-            img_name = f"{name}{temp_file.suffix}"
-            recipe_img = self._directory.joinpath(img_name)
-            resize_and_crop_image(temp_file, recipe_img, max_size)
+        extension = IMAGE_FORMAT_EXTENSIONS.get(IMAGE_FORMAT, f".{IMAGE_FORMAT.lower()}")
+        for name, image_bytes in preview_image.derivatives.items():
+            # Remove images of a previously used format, the upload takes the first one it finds
+            for other_extension in {".jpeg", *IMAGE_FORMAT_EXTENSIONS.values()} - {extension}:
+                self._directory.joinpath(f"{name}{other_extension}").unlink(missing_ok=True)
+            self._directory.joinpath(f"{name}{extension}").write_bytes(image_bytes)
 
         # Set cookbook image url
-        self.image = link_preview_image
+        self.image = preview_image.url
         self.image_url = f"/apps/cookbook/webapp/recipes/{self.id}/image?size=full"
 
     def _create_recipe_data(self):
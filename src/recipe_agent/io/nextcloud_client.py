@@ -0,0 +1,97 @@
+"""Geteilte HTTP-Clients für Nextcloud
+
+Cookbook API und WebDAV verwenden pro Nextcloud-Instanz einen langlebigen httpx.AsyncClient mit
+Keep-Alive und optional HTTP/2, statt für jede Anfrage neu zu verbinden und zu authentifizieren.
+Für Tests kann ein Transport, zB. httpx.MockTransport, übergeben werden.
+"""
+
+import asyncio
+import importlib.util
+import logging
+import os
+from typing import Dict, Set, Tuple
+
+import httpx
+
+NEXTCLOUD_HTTP2 = os.getenv("NEXTCLOUD_HTTP2", "true").lower() in ("1", "true", "yes")
+NEXTCLOUD_MAX_CONNECTIONS = int(os.getenv("NEXTCLOUD_MAX_CONNECTIONS", 10))
+NEXTCLOUD_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("NEXTCLOUD_MAX_KEEPALIVE_CONNECTIONS", 5))
+NEXTCLOUD_KEEPALIVE_EXPIRY = float(os.getenv("NEXTCLOUD_KEEPALIVE_EXPIRY", 60.0))
+NEXTCLOUD_TIMEOUT = float(os.getenv("NEXTCLOUD_TIMEOUT", 30.0))
+NEXTCLOUD_CONNECT_TIMEOUT = float(os.getenv("NEXTCLOUD_CONNECT_TIMEOUT", 10.0))
+
+
+class NextcloudClients:
+    """Ein httpx.AsyncClient pro Nextcloud-Instanz und Benutzer"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport = None, http2: bool = NEXTCLOUD_HTTP2,
+                 max_connections: int = NEXTCLOUD_MAX_CONNECTIONS,
+                 max_keepalive_connections: int = NEXTCLOUD_MAX_KEEPALIVE_CONNECTIONS,
+                 keepalive_expiry: float = NEXTCLOUD_KEEPALIVE_EXPIRY,
+                 timeout: float = NEXTCLOUD_TIMEOUT, connect_timeout: float = NEXTCLOUD_CONNECT_TIMEOUT):
+        """
+        Args:
+            transport: Ersetzt die Netzwerkverbindung, zB. durch httpx.MockTransport in Tests
+            http2: Anfragen über HTTP/2 bündeln, benötigt das Paket h2
+        """
+        self.transport = transport
+        self.http2 = http2
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_keepalive_connections,
+                                   keepalive_expiry=keepalive_expiry)
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        # (base_url, username, app_password) -> Client und Event-Loop, in dem er erstellt wurde
+        self._clients: Dict[Tuple[str, str, str], Tuple[httpx.AsyncClient, asyncio.AbstractEventLoop]] = dict()
+        self._closing: Set[asyncio.Future] = set()
+
+    def get(self, base_url: str, username: str, app_password: str) -> httpx.AsyncClient:
+        """Geteilten Client der Nextcloud-Instanz zurückgeben, wird beim ersten Zugriff erstellt"""
+        key = (base_url, username, app_password)
+        loop = asyncio.get_running_loop()
+        client, client_loop = self._clients.get(key, (None, None))
+        # -- Verbindungen sind an den Event-Loop gebunden, in dem sie geöffnet wurden
+        if client is None or client.is_closed or client_loop is not loop:
+            if client is not None:
+                self._close_replaced(client, client_loop)
+            # -- Nach einem Wechsel des App-Passworts wird der Client mit dem alten nicht mehr verwendet
+            for old_key in [k for k in self._clients if k[:2] == key[:2] and k != key]:
+                self._close_replaced(*self._clients.pop(old_key))
+            client = httpx.AsyncClient(auth=(username, app_password), http2=self._use_http2(),
+                                       limits=self.limits, timeout=self.timeout, transport=self.transport)
+            self._clients[key] = (client, loop)
+        return client
+
+    async def close(self):
+        """Schließt alle Clients beim Herunterfahren"""
+        clients, self._clients = self._clients, dict()
+        for client, _ in clients.values():
+            await self._aclose(client)
+        if self._closing:
+            await asyncio.gather(*self._closing, return_exceptions=True)
+
+    def _close_replaced(self, client: httpx.AsyncClient, client_loop: asyncio.AbstractEventLoop):
+        """Ersetzten Client im Hintergrund schließen, möglichst im Event-Loop, in dem er erstellt wurde"""
+        if client.is_closed:
+            return
+        if client_loop is asyncio.get_running_loop() or client_loop.is_closed():
+            closing = asyncio.ensure_future(self._aclose(client))
+            self._closing.add(closing)
+            closing.add_done_callback(self._closing.discard)
+        else:
+            asyncio.run_coroutine_threadsafe(self._aclose(client), client_loop)
+
+    @staticmethod
+    async def _aclose(client: httpx.AsyncClient):
+        try:
+            await client.aclose()
+        except Exception as e:
+            logging.warning(f"Nextcloud-Client konnte nicht geschlossen werden: {e}")
+
+    def _use_http2(self) -> bool:
+        if self.http2 and importlib.util.find_spec("h2") is None:
+            logging.info("HTTP/2 für Nextcloud deaktiviert, das Paket h2 ist nicht installiert")
+            self.http2 = False
+        return self.http2
+
+
+NEXTCLOUD_CLIENTS = NextcloudClients()
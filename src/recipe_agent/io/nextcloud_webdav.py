@@ -4,15 +4,22 @@ Dieses Modul stellt Funktionen bereit, um mit der Nextcloud WebDAV API zu intera
 Es ermöglicht das Abrufen und Hochladen von Rezepten über die WebDAV-Schnittstelle.
 """
 
+import asyncio
 import logging
 import os
+import time
 import xml.etree.ElementTree as ET
-from typing import List
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+from urllib.parse import unquote
 
 import httpx
 from pydantic import ValidationError
 
+from recipe_agent.executors import EXECUTORS
 from recipe_agent.io import nextcloud
+from recipe_agent.io.nextcloud_client import NEXTCLOUD_CLIENTS
+from recipe_agent.io.recipe_mirror import RECIPE_MIRROR, RecipeMirror, Version
 from recipe_agent.recipe import Recipe
 from recipe_agent.utils import generate_recipe_uid
 
@@ -21,6 +28,12 @@ NEXTCLOUD_URL = os.getenv("NEXTCLOUD_URL")
 NEXTCLOUD_USERNAME = os.getenv("NEXTCLOUD_USERNAME")
 NEXTCLOUD_APP_PASSWORD = os.getenv("NEXTCLOUD_APP_PASSWORD")
 NEXTCLOUD_REMOTE_RECIPE_FOLDER = os.getenv("NEXTCLOUD_REMOTE_RECIPE_FOLDER", "Recipes")
+# Gleichzeitige Downloads und Wiederholungen pro Datei beim Abrufen aller Rezepte
+NEXTCLOUD_SYNC_CONCURRENCY = int(os.getenv("NEXTCLOUD_SYNC_CONCURRENCY", 8))
+NEXTCLOUD_SYNC_RETRIES = int(os.getenv("NEXTCLOUD_SYNC_RETRIES", 2))
+NEXTCLOUD_SYNC_RETRY_DELAY = float(os.getenv("NEXTCLOUD_SYNC_RETRY_DELAY", 0.5))
+# 'infinity' sucht mit einer PROPFIND-Anfrage, '1' durchsucht die Rezeptordner einzeln
+NEXTCLOUD_PROPFIND_DEPTH = os.getenv("NEXTCLOUD_PROPFIND_DEPTH", "infinity")
 
 # WebDAV Basis-URL für den Benutzer
 WEBDAV_BASE_URL = f"{NEXTCLOUD_URL}/remote.php/dav/files/{NEXTCLOUD_USERNAME}/" if NEXTCLOUD_URL and NEXTCLOUD_USERNAME else ""
@@ -29,96 +42,428 @@ WEBDAV_BASE_URL = f"{NEXTCLOUD_URL}/remote.php/dav/files/{NEXTCLOUD_USERNAME}/"
 DAV_NS = {'d': 'DAV:'}
 
 
-async def get_all_recipes() -> List[Recipe]:
-    """Ruft alle Rezepte von Nextcloud ab
+def _client() -> httpx.AsyncClient:
+    """Geteilter Client der Nextcloud-Instanz, Verbindungen bleiben zwischen den Aufrufen offen"""
+    return NEXTCLOUD_CLIENTS.get(NEXTCLOUD_URL, NEXTCLOUD_USERNAME, NEXTCLOUD_APP_PASSWORD)
 
-    Diese Funktion verwendet die WebDAV API, um alle recipe.json Dateien aus den Unterordnern des
-    NEXTCLOUD_REMOTE_RECIPE_FOLDER zu finden und herunterzuladen. Dabei wird PROPFIND verwendet,
-    um zunächst die verfügbaren Dateien zu finden, und anschließend werden sie per GET heruntergeladen.
-    Die Größe der Dateien wird während des PROPFIND-Schritts ebenfalls abgefragt und protokolliert.
 
-    Returns:
-        Eine Liste von Dictionaries mit den Rezeptdaten
-    """
-    if not all([NEXTCLOUD_URL, NEXTCLOUD_USERNAME, NEXTCLOUD_APP_PASSWORD]):
-        logging.error("Nextcloud-Konfiguration ist unvollständig. Bitte prüfen Sie Ihre .env-Datei.")
-        return []
+@dataclass
+class RemoteRecipeFile:
+    """Per PROPFIND gefundene recipe.json Datei"""
+    href: str
+    url: str
+    size: int = -1
+    last_modified: Optional[str] = None
+    etag: Optional[str] = None
+
+    @property
+    def version(self) -> Version:
+        return self.etag, self.last_modified, self.size
+
+
+@dataclass
+class SyncProgress:
+    """Fortschritt eines Downloads aller Rezepte, wird nach jeder Datei an den Callback übergeben"""
+    total: int = 0
+    downloaded: int = 0
+    failed: int = 0
+    retries: int = 0
+    bytes: int = 0
+    started: float = field(default_factory=time.monotonic)
 
-    recipes: List[Recipe] = list()
-    async with httpx.AsyncClient(auth=(NEXTCLOUD_USERNAME, NEXTCLOUD_APP_PASSWORD)) as client:
-        # Die URL für den PROPFIND-Request (der übergeordnete Ordner, der die Rezeptordner enthält)
-        propfind_url = f"{WEBDAV_BASE_URL}{NEXTCLOUD_REMOTE_RECIPE_FOLDER}/"
+    @property
+    def done(self) -> int:
+        return self.downloaded + self.failed
 
-        # PROPFIND Body, um spezifische Eigenschaften zu erhalten, inklusive der Dateigröße
-        # Depth: infinity ist notwendig, um rekursiv in Unterordnern nach recipe.json zu suchen
-        propfind_body = """<?xml version="1.0" encoding="utf-8" ?>
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+
+# PROPFIND Body, um spezifische Eigenschaften zu erhalten, inklusive der Dateigröße
+PROPFIND_BODY = """<?xml version="1.0" encoding="utf-8" ?>
 <d:propfind xmlns:d="DAV:">
   <d:prop>
     <d:getcontentlength/>
     <d:getlastmodified/>
+    <d:getetag/>
     <d:resourcetype/>
   </d:prop>
 </d:propfind>"""
 
-        logging.info(f"Sende PROPFIND-Anfrage an {propfind_url} auf Nextcloud...")
-        try:
-            response = await client.request(
-                "PROPFIND",
-                propfind_url,
-                headers={"Depth": "infinity", "Content-Type": "application/xml"},
-                content=propfind_body
-            )
-            response.raise_for_status()
-
-            # PROPFIND-Antwort parsen
-            root = ET.fromstring(response.text)
-            for response_elem in root.findall('d:response', DAV_NS):
-                href_elem = response_elem.find('d:href', DAV_NS)
-                propstat_elem = response_elem.find('d:propstat', DAV_NS)
-
-                if href_elem is None or propstat_elem is None:
+
+@dataclass
+class DavEntry:
+    """Eintrag einer PROPFIND-Antwort"""
+    href: str
+    is_collection: bool
+    size: int = -1
+    last_modified: Optional[str] = None
+    etag: Optional[str] = None
+
+
+def _parse_response_elem(response_elem: ET.Element) -> Optional[DavEntry]:
+    href_elem = response_elem.find('d:href', DAV_NS)
+    prop_elem = response_elem.find('d:propstat/d:prop', DAV_NS)
+    if href_elem is None or prop_elem is None:
+        return None
+
+    resource_type_elem = prop_elem.find('d:resourcetype', DAV_NS)
+    content_length_elem = prop_elem.find('d:getcontentlength', DAV_NS)
+    last_modified_elem = prop_elem.find('d:getlastmodified', DAV_NS)
+    etag_elem = prop_elem.find('d:getetag', DAV_NS)
+    return DavEntry(
+        href=href_elem.text,
+        is_collection=resource_type_elem is not None and resource_type_elem.find('d:collection', DAV_NS) is not None,
+        size=int(content_length_elem.text) if content_length_elem is not None and content_length_elem.text else -1,
+        last_modified=last_modified_elem.text if last_modified_elem is not None else None,
+        etag=etag_elem.text if etag_elem is not None else None,
+    )
+
+
+async def propfind(client: httpx.AsyncClient, url: str, depth: str) -> AsyncIterator[DavEntry]:
+    """Sendet PROPFIND und parst die Multistatus-Antwort beim Empfang
+
+    Die Antwort wird nie vollständig als Text oder Baum gehalten, jedes d:response Element wird nach
+    dem Parsen wieder entfernt. Fehler werden an den Aufrufer weitergereicht.
+    """
+    async with client.stream("PROPFIND", url, headers={"Depth": depth, "Content-Type": "application/xml"},
+                             content=PROPFIND_BODY) as response:
+        if response.is_error:
+            # -- Für die Fehlermeldung
+            await response.aread()
+        response.raise_for_status()
+
+        parser = ET.XMLPullParser(events=("start", "end"))
+        root: Optional[ET.Element] = None
+        async for chunk in response.aiter_bytes():
+            parser.feed(chunk)
+            for event, elem in parser.read_events():
+                if event == "start":
+                    if root is None:
+                        root = elem
+                    continue
+                if elem.tag != "{DAV:}response":
                     continue
+                entry = _parse_response_elem(elem)
+                # -- Verarbeitete Elemente freigeben, der Speicher bleibt unabhängig von der Anzahl der Dateien
+                elem.clear()
+                if root is not None and len(root) and root[-1] is elem:
+                    root.remove(elem)
+                if entry is not None:
+                    yield entry
+        parser.close()
+
+
+def _to_recipe_file(entry: DavEntry) -> Optional[RemoteRecipeFile]:
+    # Prüfen, ob es sich um eine Datei namens 'recipe.json' handelt und kein Ordner ist
+    if entry.is_collection or not entry.href.endswith('/recipe.json'):
+        return None
+    # Nextcloud WebDAV gibt HREFs oft als absoluten Pfad vom dav-Root zurück (z.B. /remote.php/dav/files/user/path/to/file.json)
+    # Wir müssen sicherstellen, dass wir eine vollständige, korrekte URL zum Herunterladen haben.
+    return RemoteRecipeFile(href=entry.href, url=f"{NEXTCLOUD_URL}{entry.href}", size=entry.size,
+                            last_modified=entry.last_modified, etag=entry.etag)
+
+
+async def _crawl_folders(client: httpx.AsyncClient, root_url: str, concurrency: int = NEXTCLOUD_SYNC_CONCURRENCY,
+                         failed_folders: Optional[List[str]] = None) -> AsyncIterator[RemoteRecipeFile]:
+    """Durchsucht die Ordner einzeln mit Depth: 1, für Server ohne Depth: infinity
 
-                href = href_elem.text
-                # Prüfen, ob es sich um eine Datei namens 'recipe.json' handelt und kein Ordner ist
-                resource_type_elem = propstat_elem.find('d:prop', DAV_NS).find('d:resourcetype', DAV_NS)
-                is_collection = resource_type_elem is not None and resource_type_elem.find('d:collection',
-                                                                                           DAV_NS) is not None
-
-                # Nextcloud WebDAV gibt HREFs oft als absoluten Pfad vom dav-Root zurück (z.B. /remote.php/dav/files/user/path/to/file.json)
-                # Wir müssen sicherstellen, dass wir eine vollständige, korrekte URL zum Herunterladen haben.
-                if href.endswith('/recipe.json') and not is_collection:
-                    # Nextcloud's hrefs beginnen oft mit '/remote.php/dav/...'
-                    full_file_url = f"{NEXTCLOUD_URL}{href}"
-
-                    content_length_elem = propstat_elem.find('d:prop', DAV_NS).find('d:getcontentlength', DAV_NS)
-                    file_size = int(content_length_elem.text) if content_length_elem is not None else -1
-                    logging.info(f"  Gefunden: {href} (Größe: {file_size} Bytes)")
-
-                    # Datei herunterladen
-                    try:
-                        file_response = await client.get(full_file_url)
-                        file_response.raise_for_status()
-                        recipes.append(Recipe.model_validate_json(file_response.text, by_alias=True, strict=False))
-                    except httpx.HTTPStatusError as exc:
-                        logging.error(
-                            f"  Fehler beim Herunterladen von {full_file_url}: HTTP {exc.response.status_code} - {exc.response.text.strip()}")
-                    except httpx.RequestError as exc:
-                        logging.error(f"  Fehler bei der Anfrage für {full_file_url}: {exc}")
-                    except ValidationError as exc:
-                        logging.error(f"  Fehler beim Validieren von JSON aus {full_file_url}: {exc}")
+    Args:
+        failed_folders: Erhält die Pfade der Unterordner, die nicht gelesen werden konnten
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    # Gefundene Dateien, None markiert einen fertig durchsuchten Ordner
+    results: asyncio.Queue = asyncio.Queue()
+    tasks, root_errors = list(), list()
+    open_folders = 0
+
+    def _visit(url: str):
+        nonlocal open_folders
+        open_folders += 1
+        tasks.append(asyncio.create_task(_list_folder(url)))
+
+    async def _list_folder(url: str):
+        own_path = unquote(httpx.URL(url).path).rstrip('/')
+        try:
+            async with semaphore:
+                entries = [entry async for entry in propfind(client, url, "1")]
+            for entry in entries:
+                if entry.is_collection:
+                    # -- Der Ordner selbst ist Teil der Antwort
+                    if unquote(entry.href).rstrip('/') != own_path:
+                        _visit(f"{NEXTCLOUD_URL}{entry.href}")
+                elif (remote_file := _to_recipe_file(entry)) is not None:
+                    await results.put(remote_file)
+        except (httpx.HTTPStatusError, httpx.RequestError, ET.ParseError) as e:
+            if url == root_url:
+                root_errors.append(e)
+            else:
+                logging.error(f"Fehler beim Durchsuchen von {url}: {e}")
+                if failed_folders is not None:
+                    failed_folders.append(own_path)
+        finally:
+            await results.put(None)
 
+    _visit(root_url)
+    try:
+        while open_folders:
+            remote_file = await results.get()
+            if remote_file is None:
+                open_folders -= 1
+                continue
+            yield remote_file
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    if root_errors:
+        raise root_errors[0]
+
+
+async def iter_recipe_files(client: httpx.AsyncClient, depth: str = NEXTCLOUD_PROPFIND_DEPTH,
+                            failed_folders: Optional[List[str]] = None) -> AsyncIterator[RemoteRecipeFile]:
+    """Liefert alle recipe.json Dateien in den Unterordnern des NEXTCLOUD_REMOTE_RECIPE_FOLDER
+
+    Args:
+        depth: 'infinity' für eine einzige PROPFIND-Anfrage, '1' um die Ordner einzeln zu durchsuchen.
+               Lehnt der Server Depth: infinity ab, werden die Ordner ebenfalls einzeln durchsucht.
+        failed_folders: Erhält die Pfade der Unterordner, die beim einzelnen Durchsuchen nicht gelesen
+                        werden konnten. Ihre Rezepte fehlen in der Liste, ohne gelöscht zu sein.
+    """
+    # Die URL für den PROPFIND-Request (der übergeordnete Ordner, der die Rezeptordner enthält)
+    propfind_url = f"{WEBDAV_BASE_URL}{NEXTCLOUD_REMOTE_RECIPE_FOLDER}/"
+    logging.info(f"Sende PROPFIND-Anfrage an {propfind_url} auf Nextcloud...")
+
+    if depth == "infinity":
+        try:
+            async for entry in propfind(client, propfind_url, "infinity"):
+                if (remote_file := _to_recipe_file(entry)) is not None:
+                    yield remote_file
+            return
         except httpx.HTTPStatusError as exc:
+            if exc.response.status_code not in (400, 403, 501):
+                raise
+            logging.warning(f"Depth: infinity abgelehnt (HTTP {exc.response.status_code}), "
+                            f"durchsuche die Rezeptordner einzeln")
+
+    async for remote_file in _crawl_folders(client, propfind_url, failed_folders=failed_folders):
+        yield remote_file
+
+
+async def find_recipe_files(client: httpx.AsyncClient,
+                            failed_folders: Optional[List[str]] = None) -> List[RemoteRecipeFile]:
+    """Sucht per PROPFIND alle recipe.json Dateien in den Unterordnern des NEXTCLOUD_REMOTE_RECIPE_FOLDER
+
+    Fehler werden an den Aufrufer weitergereicht, nicht lesbare Unterordner in failed_folders gemeldet.
+    """
+    files = [remote_file async for remote_file in iter_recipe_files(client, failed_folders=failed_folders)]
+    logging.info(f"{len(files)} Rezepte auf Nextcloud gefunden")
+    return files
+
+
+async def download_recipe(client: httpx.AsyncClient, remote_file: RemoteRecipeFile,
+                          retries: int = NEXTCLOUD_SYNC_RETRIES, progress: SyncProgress = None) -> Optional[Recipe]:
+    """Lädt eine recipe.json herunter, Netzwerkfehler und Serverfehler werden mit Backoff wiederholt
+
+    Returns:
+        Das Rezept oder None, wenn die Datei nicht geladen oder validiert werden konnte
+    """
+    for attempt in range(retries + 1):
+        try:
+            file_response = await client.get(remote_file.url)
+            file_response.raise_for_status()
+            if progress is not None:
+                progress.bytes += len(file_response.content)
+            return Recipe.model_validate_json(file_response.text, by_alias=True, strict=False)
+        except httpx.HTTPStatusError as exc:
+            status = exc.response.status_code
+            if attempt < retries and (status == 429 or status >= 500):
+                await _backoff(attempt, progress)
+                continue
             logging.error(
-                f"HTTP Fehler bei PROPFIND für {exc.request.url}: HTTP {exc.response.status_code} - {exc.response.text.strip()}")
+                f"  Fehler beim Herunterladen von {remote_file.url}: HTTP {status} - {exc.response.text.strip()}")
         except httpx.RequestError as exc:
-            logging.error(f"Fehler bei PROPFIND-Anfrage für {exc.request.url}: {exc}")
-        except ET.ParseError as exc:
-            logging.error(f"Fehler beim Parsen der PROPFIND XML-Antwort: {exc}")
-        except Exception as e:
-            logging.error(f"Ein unerwarteter Fehler ist aufgetreten: {e}")
+            if attempt < retries:
+                await _backoff(attempt, progress)
+                continue
+            logging.error(f"  Fehler bei der Anfrage für {remote_file.url}: {exc}")
+        except ValidationError as exc:
+            logging.error(f"  Fehler beim Validieren von JSON aus {remote_file.url}: {exc}")
+        return None
+    return None
+
+
+async def _backoff(attempt: int, progress: Optional[SyncProgress]):
+    if progress is not None:
+        progress.retries += 1
+    await asyncio.sleep(NEXTCLOUD_SYNC_RETRY_DELAY * 2 ** attempt)
+
+
+@dataclass
+class SyncResult:
+    """Ergebnis eines inkrementellen Abgleichs mit dem lokalen Spiegel"""
+    changed: List[Recipe] = field(default_factory=list)
+    deleted: List[str] = field(default_factory=list)
+    unchanged: int = 0
+    failed: int = 0
+    # Nicht lesbare Ordner, ihre Rezepte werden nicht als gelöscht markiert
+    incomplete_folders: List[str] = field(default_factory=list)
+
+
+async def _find_recipe_files_logged(client: httpx.AsyncClient,
+                                    failed_folders: Optional[List[str]] = None) -> Optional[List[RemoteRecipeFile]]:
+    try:
+        return await find_recipe_files(client, failed_folders)
+    except httpx.HTTPStatusError as exc:
+        logging.error(
+            f"HTTP Fehler bei PROPFIND für {exc.request.url}: HTTP {exc.response.status_code} - {exc.response.text.strip()}")
+    except httpx.RequestError as exc:
+        logging.error(f"Fehler bei PROPFIND-Anfrage für {exc.request.url}: {exc}")
+    except ET.ParseError as exc:
+        logging.error(f"Fehler beim Parsen der PROPFIND XML-Antwort: {exc}")
+    return None
+
+
+async def _download_all(client: httpx.AsyncClient, remote_files: List[RemoteRecipeFile], concurrency: int,
+                        on_progress: Optional[Callable[[SyncProgress], None]]
+                        ) -> AsyncIterator[Tuple[RemoteRecipeFile, Optional[Recipe]]]:
+    """Lädt die Dateien mit höchstens concurrency Anfragen gleichzeitig und liefert sie bei Ankunft"""
+    progress = SyncProgress(total=len(remote_files))
+    pending = iter(remote_files)
+    results: asyncio.Queue = asyncio.Queue()
+
+    async def _worker():
+        for remote_file in pending:
+            try:
+                recipe = await download_recipe(client, remote_file, progress=progress)
+            except Exception as e:
+                logging.error(f"Ein unerwarteter Fehler ist aufgetreten: {e}")
+                recipe = None
+            if recipe is None:
+                progress.failed += 1
+            else:
+                progress.downloaded += 1
+            if on_progress is not None:
+                try:
+                    on_progress(progress)
+                except Exception as e:
+                    logging.error(f"Fehler beim Melden des Fortschritts: {e}")
+            results.put_nowait((remote_file, recipe))
+
+    def _worker_done(worker: asyncio.Task):
+        # -- Ein abgebrochener Worker liefert keine Ergebnisse mehr, der Aufrufer darf nicht ewig warten
+        if not worker.cancelled() and worker.exception() is not None:
+            results.put_nowait(worker.exception())
+
+    workers = [asyncio.create_task(_worker()) for _ in range(min(max(1, concurrency), len(remote_files)))]
+    for worker in workers:
+        worker.add_done_callback(_worker_done)
+    try:
+        for _ in range(len(remote_files)):
+            result = await results.get()
+            if isinstance(result, BaseException):
+                raise result
+            yield result
+    finally:
+        for worker in workers:
+            worker.cancel()
+
+    logging.info(f"{progress.downloaded} von {progress.total} Rezepten in {progress.elapsed:.1f}s geladen, "
+                 f"{progress.failed} fehlgeschlagen, {progress.retries} Wiederholungen, {progress.bytes} Bytes")
+
+
+async def iter_all_recipes(concurrency: int = NEXTCLOUD_SYNC_CONCURRENCY,
+                           on_progress: Callable[[SyncProgress], None] = None) -> AsyncIterator[Recipe]:
+    """Lädt alle Rezepte von Nextcloud gleichzeitig herunter und liefert sie in der Reihenfolge ihrer Ankunft
+
+    Nach dem PROPFIND laden höchstens concurrency Anfragen gleichzeitig, die Rezepte können
+    verwendet werden, bevor alle Dateien geladen sind.
+
+    Args:
+        concurrency: Maximale Anzahl gleichzeitiger Downloads
+        on_progress: Wird nach jeder geladenen oder fehlgeschlagenen Datei mit dem Fortschritt aufgerufen
+    """
+    if not all([NEXTCLOUD_URL, NEXTCLOUD_USERNAME, NEXTCLOUD_APP_PASSWORD]):
+        logging.error("Nextcloud-Konfiguration ist unvollständig. Bitte prüfen Sie Ihre .env-Datei.")
+        return
 
-    return recipes
+    client = _client()
+    remote_files = await _find_recipe_files_logged(client)
+    if not remote_files:
+        return
+
+    async for _, recipe in _download_all(client, remote_files, concurrency, on_progress):
+        if recipe is not None:
+            yield recipe
+
+
+async def sync_recipes(mirror: RecipeMirror = RECIPE_MIRROR, concurrency: int = NEXTCLOUD_SYNC_CONCURRENCY,
+                       on_progress: Callable[[SyncProgress], None] = None) -> Optional[SyncResult]:
+    """Gleicht den lokalen Spiegel inkrementell mit Nextcloud ab
+
+    Nach dem PROPFIND werden nur neue und geänderte recipe.json Dateien heruntergeladen, erkannt an
+    ETag, Änderungsdatum und Größe. Auf Nextcloud fehlende Rezepte werden als gelöscht markiert.
+
+    Returns:
+        Geänderte und gelöschte Rezepte oder None, wenn der Ordner nicht gelesen werden konnte
+    """
+    if not all([NEXTCLOUD_URL, NEXTCLOUD_USERNAME, NEXTCLOUD_APP_PASSWORD]):
+        logging.error("Nextcloud-Konfiguration ist unvollständig. Bitte prüfen Sie Ihre .env-Datei.")
+        return None
+
+    client = _client()
+    failed_folders = list()
+    remote_files = await _find_recipe_files_logged(client, failed_folders)
+    if remote_files is None:
+        return None
+
+    known = await EXECUTORS.run_io(mirror.versions)
+    changed_files = [f for f in remote_files if known.get(f.href) != f.version]
+    result = SyncResult(unchanged=len(remote_files) - len(changed_files), incomplete_folders=failed_folders)
+
+    downloaded = list()
+    async for remote_file, recipe in _download_all(client, changed_files, concurrency, on_progress):
+        if recipe is None:
+            # -- Beim nächsten Abgleich erneut versuchen
+            result.failed += 1
+            continue
+        downloaded.append((remote_file.href, remote_file.version, recipe))
+        result.changed.append(recipe)
+    await EXECUTORS.run_io(mirror.put_many, downloaded)
+
+    missing = known.keys() - {f.href for f in remote_files}
+    # -- Rezepte in nicht lesbaren Ordnern fehlen nur in der Liste, etwa nach einem vorübergehenden Serverfehler
+    result.deleted = sorted(href for href in missing if not _in_folders(href, failed_folders))
+    if len(result.deleted) < len(missing):
+        logging.warning(f"{len(missing) - len(result.deleted)} Rezepte in {len(failed_folders)} nicht lesbaren "
+                        f"Ordnern bleiben bis zum nächsten Abgleich erhalten")
+    await EXECUTORS.run_io(mirror.tombstone, result.deleted)
+
+    logging.info(f"Rezepte abgeglichen: {len(result.changed)} geändert, {len(result.deleted)} gelöscht, "
+                 f"{result.unchanged} unverändert, {result.failed} fehlgeschlagen")
+    return result
+
+
+def _in_folders(href: str, folders: List[str]) -> bool:
+    path = unquote(href)
+    return any(path.startswith(f"{folder}/") for folder in folders)
+
+
+async def get_all_recipes() -> List[Recipe]:
+    """Ruft alle Rezepte von Nextcloud ab
+
+    Diese Funktion verwendet die WebDAV API, um alle recipe.json Dateien aus den Unterordnern des
+    NEXTCLOUD_REMOTE_RECIPE_FOLDER zu finden. Über den lokalen Spiegel werden nur neue und geänderte
+    Dateien heruntergeladen, siehe sync_recipes.
+
+    Returns:
+        Eine Liste der Rezepte
+    """
+    if await sync_recipes() is None:
+        return []
+    # Die Validierung vieler Rezepte würde den Event-Loop blockieren
+    return await EXECUTORS.run_io(RECIPE_MIRROR.recipes)
 
 
 async def create_put_recipe(recipe_instance: Recipe) -> nextcloud.NextcloudRecipe:
@@ -140,7 +485,12 @@ async def create_put_recipe(recipe_instance: Recipe) -> nextcloud.NextcloudRecip
 
     # Recipe in NextcloudRecipe umwandeln und lokale Dateien erstellen
     nextcloud_recipe = nextcloud.NextcloudRecipe(**recipe_instance.model_dump())
-    nextcloud_recipe.create_recipe()
+    # Linkvorschau, Bilddownload und Dateizugriffe blockieren und laufen im Thread-Pool, die Vorschaubilder
+    # werden im Prozess-Pool berechnet. Ein Thread des Pools wartet dabei nie auf einen anderen Pool
+    source = await EXECUTORS.run_io(nextcloud_recipe.download_preview_image)
+    preview_image = (await EXECUTORS.run_cpu(nextcloud.derive_preview_image, *source) if source
+                     else nextcloud.PreviewImage())
+    await EXECUTORS.run_io(nextcloud_recipe.create_recipe, None, preview_image)
 
     # 2. WebDAV-Upload unabhängig von der lokalen Speicherung durchführen
     recipe_dir = nextcloud_recipe.get_recipe_folder()
@@ -158,43 +508,43 @@ async def create_put_recipe(recipe_instance: Recipe) -> nextcloud.NextcloudRecip
 
     logging.info(f"Versuche, Rezept '{nextcloud_recipe.name}' nach {upload_url} hochzuladen/zu aktualisieren...")
 
-    async with httpx.AsyncClient(auth=(NEXTCLOUD_USERNAME, NEXTCLOUD_APP_PASSWORD)) as client:
-        try:
-            # 1. Erst den Rezeptordner erstellen mit MKCOL (Make Collection)
-            logging.info(f"Erstelle Ordner: {folder_url}")
-            folder_response = await client.request(
-                "MKCOL",
-                folder_url,
-                headers={'Content-Type': 'application/xml; charset=utf-8'},
-            )
-            # 207 (Multi-Status) oder 201 (Created) bedeuten Erfolg, 405 (Method Not Allowed) bedeutet, der Ordner existiert bereits
-            if folder_response.status_code not in [201, 204, 207, 405]:
-                logging.warning(f"Unerwarteter Status beim Erstellen des Ordners: {folder_response.status_code}")
-                folder_response.raise_for_status()
-
-            # 2. Datei in den erstellten Ordner hochladen
-            response = await client.put(
-                upload_url,
-                content=recipe_json_content.encode('utf-8'),  # JSON-String muss als Bytes gesendet werden
-                headers={'Content-Type': 'application/json; charset=utf-8'},  # Wichtiger Header
-            )
-            response.raise_for_status()  # Löst einen HTTPStatusError für schlechte Antworten (4xx oder 5xx) aus
-
-            if response.status_code == 201:  # 201 Created (für neue Datei)
-                logging.info(f"Rezept '{recipe_instance.name}' erfolgreich erstellt.")
-                await upload_recipe_images(nextcloud_recipe, client)
-            elif response.status_code == 204:  # 204 No Content (für erfolgreiches Update)
-                logging.info(f"Rezept '{recipe_instance.name}' erfolgreich aktualisiert.")
-            else:
-                logging.info(
-                    f"Upload für Rezept '{recipe_instance.name}' beendet mit unerwartetem Status {response.status_code}.")
-        except httpx.HTTPStatusError as exc:
-            logging.error(
-                f"HTTP Fehler aufgetreten für {exc.request.url}: HTTP {exc.response.status_code} - {exc.response.text.strip()}")
-        except httpx.RequestError as exc:
-            logging.error(f"Ein Fehler während der Anfrage aufgetreten für {exc.request.url}: {exc}")
-        except Exception as e:
-            logging.error(f"Ein unerwarteter Fehler ist aufgetreten: {e}")
+    client = _client()
+    try:
+        # 1. Erst den Rezeptordner erstellen mit MKCOL (Make Collection)
+        logging.info(f"Erstelle Ordner: {folder_url}")
+        folder_response = await client.request(
+            "MKCOL",
+            folder_url,
+            headers={'Content-Type': 'application/xml; charset=utf-8'},
+        )
+        # 207 (Multi-Status) oder 201 (Created) bedeuten Erfolg, 405 (Method Not Allowed) bedeutet, der Ordner existiert bereits
+        if folder_response.status_code not in [201, 204, 207, 405]:
+            logging.warning(f"Unerwarteter Status beim Erstellen des Ordners: {folder_response.status_code}")
+            folder_response.raise_for_status()
+
+        # 2. Datei in den erstellten Ordner hochladen
+        response = await client.put(
+            upload_url,
+            content=recipe_json_content.encode('utf-8'),  # JSON-String muss als Bytes gesendet werden
+            headers={'Content-Type': 'application/json; charset=utf-8'},  # Wichtiger Header
+        )
+        response.raise_for_status()  # Löst einen HTTPStatusError für schlechte Antworten (4xx oder 5xx) aus
+
+        if response.status_code == 201:  # 201 Created (für neue Datei)
+            logging.info(f"Rezept '{recipe_instance.name}' erfolgreich erstellt.")
+            await upload_recipe_images(nextcloud_recipe, client)
+        elif response.status_code == 204:  # 204 No Content (für erfolgreiches Update)
+            logging.info(f"Rezept '{recipe_instance.name}' erfolgreich aktualisiert.")
+        else:
+            logging.info(
+                f"Upload für Rezept '{recipe_instance.name}' beendet mit unerwartetem Status {response.status_code}.")
+    except httpx.HTTPStatusError as exc:
+        logging.error(
+            f"HTTP Fehler aufgetreten für {exc.request.url}: HTTP {exc.response.status_code} - {exc.response.text.strip()}")
+    except httpx.RequestError as exc:
+        logging.error(f"Ein Fehler während der Anfrage aufgetreten für {exc.request.url}: {exc}")
+    except Exception as e:
+        logging.error(f"Ein unerwarteter Fehler ist aufgetreten: {e}")
 
     return nextcloud_recipe
 
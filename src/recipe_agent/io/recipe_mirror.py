@@ -0,0 +1,89 @@
+"""Lokaler Spiegel des Nextcloud Rezeptordners
+
+Speichert pro recipe.json die Version (ETag, Änderungsdatum, Größe) und das Rezept in einer SQLite
+Datenbank. Ein inkrementeller Abgleich lädt so nur neue und geänderte Dateien herunter. Auf Nextcloud
+gelöschte Rezepte bleiben als Tombstone erhalten, bis sie älter als tombstone_ttl sind.
+"""
+
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from recipe_agent.recipe import Recipe
+from recipe_agent.recipe_config import RECIPE_MIRROR_PATH, RECIPE_MIRROR_TOMBSTONE_TTL
+
+# (etag, last_modified, size) einer Datei auf Nextcloud
+Version = Tuple[Optional[str], Optional[str], int]
+
+
+class RecipeMirror:
+    def __init__(self, path: Path = RECIPE_MIRROR_PATH, tombstone_ttl: float = RECIPE_MIRROR_TOMBSTONE_TTL):
+        """
+        Args:
+            path: Location of the SQLite database file
+            tombstone_ttl: Seconds after which deleted recipes are forgotten
+        """
+        self._path = Path(path)
+        self.tombstone_ttl = tombstone_ttl
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+
+    def versions(self) -> Dict[str, Version]:
+        """Versionen aller nicht gelöschten Rezepte nach href"""
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT href, etag, last_modified, size FROM recipes WHERE deleted IS NULL").fetchall()
+        return {href: (etag, last_modified, size) for href, etag, last_modified, size in rows}
+
+    def put_many(self, entries: Iterable[Tuple[str, Version, Recipe]]):
+        """Heruntergeladene Rezepte mit ihrer Version in einer Transaktion speichern"""
+        now = time.time()
+        rows = [(href, etag, last_modified, size, recipe.model_dump_json(by_alias=True), now)
+                for href, (etag, last_modified, size), recipe in entries]
+        with self._lock:
+            self._db().executemany(
+                "INSERT OR REPLACE INTO recipes (href, etag, last_modified, size, data, synced, deleted) "
+                "VALUES (?, ?, ?, ?, ?, ?, NULL)", rows)
+            self._db().commit()
+
+    def tombstone(self, hrefs: Iterable[str]):
+        """Auf Nextcloud gelöschte Rezepte markieren und alte Tombstones entfernen"""
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            db.executemany("UPDATE recipes SET deleted = ?, data = NULL WHERE href = ?",
+                           [(now, href) for href in hrefs])
+            db.execute("DELETE FROM recipes WHERE deleted < ?", (now - self.tombstone_ttl,))
+            db.commit()
+
+    def deleted_since(self, timestamp: float) -> List[str]:
+        with self._lock:
+            rows = self._db().execute("SELECT href FROM recipes WHERE deleted >= ?", (timestamp,)).fetchall()
+        return [href for href, in rows]
+
+    def recipes(self) -> List[Recipe]:
+        """Alle nicht gelöschten Rezepte des Spiegels"""
+        with self._lock:
+            rows = self._db().execute("SELECT data FROM recipes WHERE deleted IS NULL ORDER BY href").fetchall()
+        return [Recipe.model_validate_json(data, by_alias=True, strict=False) for data, in rows]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db().execute("SELECT COUNT(*) FROM recipes WHERE deleted IS NULL").fetchone()[0]
+
+    def _db(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(self._path, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS recipes ("
+                "href TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, size INTEGER NOT NULL, "
+                "data TEXT, synced REAL NOT NULL, deleted REAL)"
+            )
+            self._connection.commit()
+        return self._connection
+
+
+RECIPE_MIRROR = RecipeMirror()
@@ -0,0 +1,217 @@
+""" Scheduler for all LLM requests
+
+Chat replies, recipe extractions and search agent loops share the rate limits of the same free
+model. Requests wait in a priority queue for a free concurrency slot and for the requests/min and
+tokens/min buckets, so short interactive chat answers overtake long extractions. Rate limit
+responses (HTTP 429) pause the whole queue for the duration given by the Retry-After header.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from enum import IntEnum
+from typing import Awaitable, Callable, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 4))
+# 0 disables the respective limit
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", 20))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", 0))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 3))
+RETRY_BASE_DELAY = 2.0
+
+
+class Priority(IntEnum):
+    """ Lower values are scheduled first """
+    CHAT = 0
+    EXTRACTION = 1
+    SEARCH = 2
+    BACKGROUND = 3
+
+
+class TokenBucket:
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self._tokens = self.capacity
+        self._rate = self.capacity / 60.0
+        self._updated = time.monotonic()
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def delay(self, amount: float) -> float:
+        """ Seconds until amount can be taken from the bucket """
+        if not self.enabled:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self._tokens) / self._rate)
+
+    def take(self, amount: float):
+        if not self.enabled:
+            return
+        self._refill()
+        self._tokens -= min(amount, self.capacity)
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+
+class LLMScheduler:
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 requests_per_minute: int = LLM_REQUESTS_PER_MINUTE,
+                 tokens_per_minute: int = LLM_TOKENS_PER_MINUTE,
+                 max_retries: int = LLM_MAX_RETRIES):
+        self._max_concurrency = max(1, max_concurrency)
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+
+        self._queue: List[Tuple[int, int, float, asyncio.Future]] = list()
+        self._counter = itertools.count()
+        self._active = 0
+        self._paused_until = 0.0
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def queue_length(self) -> int:
+        return len(self._queue)
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def paused(self) -> bool:
+        return time.monotonic() < self._paused_until
+
+    @asynccontextmanager
+    async def slot(self, priority: Priority = Priority.BACKGROUND, tokens: int = 0,
+                   on_slot: Callable[[], None] = None):
+        """ Wait for a concurrency slot and rate limit budget for one request
+
+        Args:
+            on_slot: Called once the slot is granted, eg. to measure latencies without the time spent in the queue
+        """
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (int(priority), next(self._counter), float(tokens), future))
+        self._dispatch()
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # -- Slot was granted while being cancelled
+                self._release()
+            else:
+                self._queue = [q for q in self._queue if q[3] is not future]
+                heapq.heapify(self._queue)
+            raise
+
+        if on_slot is not None:
+            on_slot()
+        try:
+            yield
+        finally:
+            self._release()
+
+    def charge_tokens(self, tokens: int):
+        """ Account for tokens only known after the response, eg. completion tokens """
+        self._tokens.take(tokens)
+
+    def pause(self, seconds: float):
+        """ Hold back all queued requests, eg. after a rate limit response """
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        logging.warning(f"LLM requests paused for {seconds:.1f}s")
+
+    async def run(self, func: Callable[[], Awaitable[T]], priority: Priority = Priority.BACKGROUND,
+                  tokens: int = 0, on_slot: Callable[[], None] = None) -> T:
+        """ Run func inside a slot, retrying rate limited requests after their Retry-After delay """
+        attempt = 0
+        while True:
+            async with self.slot(priority, tokens, on_slot):
+                try:
+                    return await func()
+                except Exception as e:
+                    if not self.backoff(e, attempt):
+                        raise
+            attempt += 1
+
+    def backoff(self, e: Exception, attempt: int) -> bool:
+        """ Pause the queue after a rate limit error
+
+        Returns:
+            True if the request should be retried
+        """
+        if not is_rate_limit_error(e) or attempt >= self.max_retries:
+            return False
+
+        self.pause(retry_after(e) or RETRY_BASE_DELAY * 2 ** attempt)
+        logging.warning(f"LLM request rate limited, retry {attempt + 1}/{self.max_retries}")
+        return True
+
+    def _release(self):
+        self._active -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        """ Grant slots to the queued requests in priority order while budget is available """
+        if self._wakeup is not None:
+            self._wakeup.cancel()
+            self._wakeup = None
+
+        while self._queue and self._active < self._max_concurrency:
+            priority, _, tokens, future = self._queue[0]
+            if future.done():
+                heapq.heappop(self._queue)
+                continue
+
+            delay = max(self._paused_until - time.monotonic(), self._requests.delay(1), self._tokens.delay(tokens))
+            if delay > 0:
+                self._wakeup = asyncio.get_running_loop().call_later(delay, self._dispatch)
+                return
+
+            heapq.heappop(self._queue)
+            self._requests.take(1)
+            self._tokens.take(tokens)
+            self._active += 1
+            future.set_result(None)
+
+
+def is_rate_limit_error(e: Exception) -> bool:
+    return getattr(e, "status_code", None) == 429
+
+
+def retry_after(e: Exception) -> Optional[float]:
+    """ Seconds to wait according to the Retry-After header of a rate limit error """
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None) or getattr(e, "litellm_response_headers", None) or dict()
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def estimate_tokens(messages: list) -> int:
+    """ Rough token estimate of ~4 characters per token """
+    return sum(len(str(m.get("content") or "")) for m in messages) // 4
+
+
+LLM_SCHEDULER = LLMScheduler()
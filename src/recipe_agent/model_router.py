@@ -0,0 +1,298 @@
+""" Routing of LLM requests across ordered fallback chains of models
+
+Every task (chat, extraction, search refinement, summarization, chat history summaries) has its
+own chain of models. The router tracks the rolling latency and error rate of every model, demotes
+models that keep failing to the end of the chains for a while and falls back to the next model on errors or schema-invalid
+answers. With hedging enabled a request to the next model is fired once the current one exceeds
+the latency threshold, the first valid answer wins and the slower request is cancelled. Latencies
+and the hedging threshold count from the moment the LLM scheduler sends the request, time spent
+waiting for a slot is not the model's fault, and no hedge is fired while the scheduler is
+throttling.
+
+Configuration:
+    LLM_ROUTE_EXTRACTION=openrouter/mistralai/mistral-nemo:free,openrouter/meta-llama/llama-3.3-8b-instruct:free
+    LLM_HEDGE_AFTER_EXTRACTION=20
+"""
+import asyncio
+import logging
+import os
+import statistics
+import time
+from collections import deque
+from contextlib import aclosing
+from enum import Enum
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from recipe_agent.llm_scheduler import LLM_SCHEDULER, Priority
+from recipe_agent.openrouter_chat import openrouter_chat_request, openrouter_chat_stream
+from recipe_agent.recipe_config import LLM_PROVIDER
+
+# Demote a model once this share of its recent requests failed
+LLM_DEMOTE_ERROR_RATE = float(os.getenv("LLM_DEMOTE_ERROR_RATE", 0.5))
+LLM_DEMOTE_MIN_SAMPLES = int(os.getenv("LLM_DEMOTE_MIN_SAMPLES", 4))
+LLM_DEMOTE_SECONDS = float(os.getenv("LLM_DEMOTE_SECONDS", 300))
+LLM_HEALTH_WINDOW = int(os.getenv("LLM_HEALTH_WINDOW", 50))
+
+
+class Task(str, Enum):
+    CHAT = "chat"
+    EXTRACTION = "extraction"
+    SEARCH = "search"
+    SUMMARY = "summary"
+    HISTORY = "history"
+
+
+TASK_PRIORITY = {
+    Task.CHAT: Priority.CHAT,
+    Task.EXTRACTION: Priority.EXTRACTION,
+    Task.SEARCH: Priority.SEARCH,
+    Task.SUMMARY: Priority.SEARCH,
+    # Rolling summaries of chat histories are computed off the hot path
+    Task.HISTORY: Priority.BACKGROUND,
+}
+
+
+class Route(BaseModel):
+    models: List[str]
+    # Seconds until the next model of the chain is raced against the running request, 0 disables hedging
+    hedge_after: float = 0.0
+
+    @property
+    def name(self) -> str:
+        return ",".join(self.models)
+
+
+def route_from_env(task: Task) -> Route:
+    models = [m.strip() for m in os.getenv(f"LLM_ROUTE_{task.name}", LLM_PROVIDER).split(",") if m.strip()]
+    return Route(models=models or [LLM_PROVIDER],
+                 hedge_after=float(os.getenv(f"LLM_HEDGE_AFTER_{task.name}", 0)))
+
+
+class ModelHealth:
+    """ Rolling latency and error statistics of a single model """
+
+    def __init__(self, window: int = LLM_HEALTH_WINDOW):
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._errors: Deque[bool] = deque(maxlen=window)
+        self.demoted_until = 0.0
+
+    def record(self, latency: Optional[float], ok: bool):
+        if latency is not None:
+            self._latencies.append(latency)
+        self._errors.append(not ok)
+
+    @property
+    def samples(self) -> int:
+        return len(self._errors)
+
+    @property
+    def error_rate(self) -> float:
+        return sum(self._errors) / len(self._errors) if self._errors else 0.0
+
+    @property
+    def p50(self) -> Optional[float]:
+        return statistics.median(self._latencies) if self._latencies else None
+
+    @property
+    def p95(self) -> Optional[float]:
+        if len(self._latencies) < 2:
+            return self.p50
+        return statistics.quantiles(self._latencies, n=20, method="inclusive")[-1]
+
+    @property
+    def demoted(self) -> bool:
+        return time.monotonic() < self.demoted_until
+
+    def demote(self, seconds: float):
+        """ Demote for seconds and start over with a clean window afterwards """
+        self.demoted_until = time.monotonic() + seconds
+        self._errors.clear()
+
+    def stats(self) -> dict:
+        return {"samples": self.samples, "error_rate": round(self.error_rate, 3), "p50": self.p50,
+                "p95": self.p95, "demoted": self.demoted}
+
+
+class ModelRouter:
+    def __init__(self, routes: Optional[Dict[Task, Route]] = None,
+                 demote_error_rate: float = LLM_DEMOTE_ERROR_RATE,
+                 demote_min_samples: int = LLM_DEMOTE_MIN_SAMPLES,
+                 demote_seconds: float = LLM_DEMOTE_SECONDS):
+        self.routes = routes or {task: route_from_env(task) for task in Task}
+        self.demote_error_rate = demote_error_rate
+        self.demote_min_samples = demote_min_samples
+        self.demote_seconds = demote_seconds
+        self._health: Dict[str, ModelHealth] = dict()
+
+    def health(self, model: str) -> ModelHealth:
+        if model not in self._health:
+            self._health[model] = ModelHealth()
+        return self._health[model]
+
+    def models(self, task: Task) -> List[str]:
+        """ Models of the task's chain in configured order, demoted models are only tried last """
+        models = self.routes[task].models
+        return [m for m in models if not self.health(m).demoted] + [m for m in models if self.health(m).demoted]
+
+    def stats(self) -> Dict[str, dict]:
+        return {model: health.stats() for model, health in self._health.items()}
+
+    def record(self, model: str, latency: Optional[float], ok: bool):
+        health = self.health(model)
+        health.record(latency, ok)
+
+        if (not ok and health.samples >= self.demote_min_samples
+                and health.error_rate >= self.demote_error_rate):
+            logging.warning(f"Demoting LLM {model} for {self.demote_seconds:.0f}s: {health.stats()}")
+            health.demote(self.demote_seconds)
+
+    async def request(self, task: Task, messages: list, res_format: dict = None, options: dict = None,
+                      validate: Callable[[str], Any] = None) -> str:
+        """ Send the request along the task's fallback chain
+
+        Args:
+            validate: Raises if an answer is not usable, eg. does not match the response schema.
+                      Invalid answers count as errors of the model and fall back to the next one.
+
+        Returns:
+            The first valid answer
+        """
+        response, _ = await self.request_with_model(task, messages, res_format, options, validate)
+        return response
+
+    async def request_with_model(self, task: Task, messages: list, res_format: dict = None,
+                                 options: dict = None, validate: Callable[[str], Any] = None) -> Tuple[str, str]:
+        """ Like request
+
+        Returns:
+            The first valid answer and the model that gave it, after fallbacks or hedging not
+            necessarily the first model of the chain
+        """
+        route = self.routes[task]
+        candidates = iter(self.models(task))
+        running: Dict[asyncio.Task, str] = dict()
+        # model -> time the scheduler sent its request
+        sent: Dict[str, float] = dict()
+        last_error: Optional[Exception] = None
+        latest: Optional[str] = None
+
+        def _launch() -> bool:
+            nonlocal latest
+            model = next(candidates, None)
+            if model is None:
+                return False
+            latest = model
+            running[asyncio.create_task(
+                self._attempt(model, task, messages, res_format, options, validate, sent))] = model
+            return True
+
+        def _hedge_timeout() -> Optional[float]:
+            if route.hedge_after <= 0:
+                return None
+            # -- Until the request was sent check again after hedge_after
+            if latest not in sent:
+                return route.hedge_after
+            return max(0.0, sent[latest] + route.hedge_after - time.monotonic())
+
+        def _may_hedge() -> bool:
+            # -- More requests would only wait in the throttled queue as well
+            if latest not in sent or LLM_SCHEDULER.paused or LLM_SCHEDULER.queue_length > 0:
+                return False
+            return time.monotonic() - sent[latest] >= route.hedge_after
+
+        _launch()
+        try:
+            while running:
+                done, _ = await asyncio.wait(running, timeout=_hedge_timeout(),
+                                             return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    if not _may_hedge():
+                        continue
+                    # -- Hedge: race the next model against the slow request(s)
+                    if _launch():
+                        logging.info(f"Hedging {task.value} request after {route.hedge_after:.1f}s "
+                                     f"with {list(running.values())[-1]}")
+                        continue
+                    # -- Chain exhausted, keep waiting without a timeout
+                    done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+
+                for finished in done:
+                    model = running.pop(finished)
+                    try:
+                        return finished.result(), model
+                    except Exception as e:
+                        logging.warning(f"LLM {model} failed for {task.value} request: {e}")
+                        last_error = e
+
+                if not running:
+                    _launch()
+        finally:
+            for pending in running:
+                pending.cancel()
+
+        raise last_error or RuntimeError(f"No LLM configured for {task.value}")
+
+    async def stream(self, task: Task, messages: list, res_format: dict = None,
+                     options: dict = None) -> AsyncIterator[str]:
+        """ Stream the answer of the first model of the chain that starts answering
+
+        Falls back to the next model only before the first delta was delivered.
+        """
+        last_error: Optional[Exception] = None
+        for model in self.models(task):
+            start, started = time.monotonic(), False
+
+            def _sent():
+                nonlocal start
+                start = time.monotonic()
+
+            try:
+                async with aclosing(openrouter_chat_stream(model, messages, res_format, options,
+                                                           priority=TASK_PRIORITY[task], on_slot=_sent)) as deltas:
+                    async for delta in deltas:
+                        started = True
+                        yield delta
+            except Exception as e:
+                self.record(model, None, False)
+                if started:
+                    raise
+                logging.warning(f"LLM {model} failed for {task.value} stream: {e}")
+                last_error = e
+                continue
+
+            self.record(model, time.monotonic() - start, True)
+            return
+
+        raise last_error or RuntimeError(f"No LLM configured for {task.value}")
+
+    async def _attempt(self, model: str, task: Task, messages: list, res_format: Optional[dict],
+                       options: Optional[dict], validate: Optional[Callable[[str], Any]],
+                       sent: Dict[str, float]) -> str:
+        def _sent():
+            sent[model] = time.monotonic()
+
+        try:
+            response = await openrouter_chat_request(model, messages, res_format, options,
+                                                     priority=TASK_PRIORITY[task], on_slot=_sent)
+            if validate is not None:
+                validate(response)
+        except asyncio.CancelledError:
+            # -- Lost a hedged race, says nothing about the health of the model
+            raise
+        except Exception:
+            self.record(model, self._latency(model, sent), False)
+            raise
+
+        self.record(model, self._latency(model, sent), True)
+        return response
+
+    @staticmethod
+    def _latency(model: str, sent: Dict[str, float]) -> Optional[float]:
+        """ Seconds since the scheduler sent the request, None if it failed before """
+        return time.monotonic() - sent[model] if model in sent else None
+
+
+LLM_ROUTER = ModelRouter()
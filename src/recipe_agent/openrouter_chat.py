@@ -1,86 +1,164 @@
 import logging
 import os
-from litellm import completion
+from contextlib import aclosing
+from typing import AsyncIterator, Callable, Optional, Tuple
 
+import httpx
+import litellm
+from litellm import acompletion
+
+from recipe_agent.llm_scheduler import LLM_SCHEDULER, Priority, estimate_tokens
 from recipe_agent.utils import exception_and_traceback
 
+# Geteilter Connection-Pool für alle LLM-Anfragen
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 20))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 600.0))
+_HTTP_CLIENT: Optional[httpx.AsyncClient] = None
 
-async def openrouter_chat_request(model: str, messages: list, res_format: dict=None, options: dict=None) -> str:
-    """
-    Sendet eine Anfrage an litellm und gibt die Antwort zurück
 
-    :param model: Modellname in litellm-Format (z.B. 'openai/gpt-4o')
-    :param messages: Liste von Nachrichten im Format [{"role": "user", "content": "..."}]
-    :param res_format: JSON-Schema für die strukturierte Ausgabe
-    :param options: Zusätzliche Optionen für die Anfrage
-    :return: Die Antwort des Modells als String
+def _get_http_client() -> httpx.AsyncClient:
+    """ Geteilter httpx-Client, litellm übergibt ihn als litellm.aclient_session an das OpenAI SDK
+
+    Über den Parameter client ginge das nicht: OpenAI-kompatible Provider erwarten dort einen AsyncOpenAI-Client.
     """
-    logging.info(f"Sende Anfrage an litellm: Modell={model}, Nachrichtenlänge={len(messages)}")
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is None or _HTTP_CLIENT.is_closed:
+        _HTTP_CLIENT = httpx.AsyncClient(timeout=LLM_TIMEOUT,
+                                         limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS,
+                                                             max_keepalive_connections=LLM_MAX_CONNECTIONS))
+        litellm.aclient_session = _HTTP_CLIENT
+    return _HTTP_CLIENT
+
 
+async def close_http_client():
+    """ Schließt den geteilten Connection-Pool beim Herunterfahren """
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is not None:
+        if litellm.aclient_session is _HTTP_CLIENT:
+            litellm.aclient_session = None
+        await _HTTP_CLIENT.aclose()
+        _HTTP_CLIENT = None
+
+
+def _prepare_request(model: str, messages: list, res_format: dict = None,
+                     options: dict = None) -> Tuple[dict, bool]:
+    """ Erstellt die Parameter für litellm und gibt zurück, ob Streaming gewünscht ist """
     # Parameter für die Anfrage vorbereiten
     params = {
         "model": model,
         "messages": messages,
+        # Extra Header für litellm
+        "headers": {"HTTP-Referer": os.environ.get('SITE_URL', 'https://yourwebsite.com')},
+        "input_cost_per_token": 0.0,
+        "output_cost_per_token": 0.0,
     }
-
-    # Extra Header für litellm
-    extra_headers = {
-        "HTTP-Referer": os.environ.get('SITE_URL', 'https://yourwebsite.com')
-    }
+    _get_http_client()
 
     # Wenn Formatierung gewünscht ist
     if res_format:
         params["response_format"] = res_format
 
-    # Prüfen ob Streaming aktiviert werden soll
-    stream = False
-    if options and 'stream' in options:
-        stream = options['stream']
-        # Entfernen, da wir es separat übergeben
-        if 'stream' in options:
-            del options['stream']
+    # Prüfen ob Streaming aktiviert werden soll, ohne die Optionen des Aufrufers zu verändern
+    options = dict(options or dict())
+    stream = bool(options.pop('stream', False))
 
     # Zusätzliche Optionen hinzufügen
-    if options:
-        for key, value in options.items():
-            if key not in params:
-                params[key] = value
+    for key, value in options.items():
+        if key not in params:
+            params[key] = value
+
+    return params, stream
+
+
+async def openrouter_chat_stream(model: str, messages: list, res_format: dict = None,
+                                 options: dict = None, priority: Priority = Priority.BACKGROUND,
+                                 on_slot: Callable[[], None] = None) -> AsyncIterator[str]:
+    """
+    Sendet eine Streaming-Anfrage an litellm und liefert die Antwort in Teilen, sobald sie eintreffen
+
+    :param model: Modellname in litellm-Format (z.B. 'openai/gpt-4o')
+    :param messages: Liste von Nachrichten im Format [{"role": "user", "content": "..."}]
+    :param res_format: JSON-Schema für die strukturierte Ausgabe
+    :param options: Zusätzliche Optionen für die Anfrage
+    :param priority: Priorität der Anfrage im LLM-Scheduler
+    :param on_slot: Wird aufgerufen, sobald der Scheduler die Anfrage losschickt
+    :return: Async-Iterator über die Text-Deltas der Antwort
+    """
+    logging.info(f"Sende Streaming-Anfrage an litellm: Modell={model}, Nachrichtenlänge={len(messages)}")
+    params, _ = _prepare_request(model, messages, res_format, options)
+    # -- Gibt den Slot im Scheduler sofort frei, wenn der Aufrufer den Stream abbricht
+    async with aclosing(_stream(params, priority, on_slot)) as contents:
+        async for content in contents:
+            yield content
+
+
+async def _stream(params: dict, priority: Priority, on_slot: Callable[[], None] = None) -> AsyncIterator[str]:
+    attempt = 0
+    while True:
+        # Der Slot im Scheduler bleibt belegt, bis die Antwort vollständig gestreamt wurde
+        async with LLM_SCHEDULER.slot(priority, estimate_tokens(params["messages"]), on_slot):
+            try:
+                stream_response = await acompletion(**params, stream=True)
+            except Exception as e:
+                if LLM_SCHEDULER.backoff(e, attempt):
+                    attempt += 1
+                    continue
+                logging.error(f"Fehler bei litellm-Anfrage: {exception_and_traceback(e)}")
+                raise
+
+            try:
+                async for chunk in stream_response:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            except Exception as e:
+                logging.error(f"Fehler bei litellm-Anfrage: {exception_and_traceback(e)}")
+                raise
+            return
+
+
+async def openrouter_chat_request(model: str, messages: list, res_format: dict=None, options: dict=None,
+                                  priority: Priority = Priority.BACKGROUND, on_slot: Callable[[], None] = None) -> str:
+    """
+    Sendet eine Anfrage an litellm und gibt die Antwort zurück
+
+    :param model: Modellname in litellm-Format (z.B. 'openai/gpt-4o')
+    :param messages: Liste von Nachrichten im Format [{"role": "user", "content": "..."}]
+    :param res_format: JSON-Schema für die strukturierte Ausgabe
+    :param options: Zusätzliche Optionen für die Anfrage
+    :param priority: Priorität der Anfrage im LLM-Scheduler
+    :param on_slot: Wird aufgerufen, sobald der Scheduler die Anfrage losschickt
+    :return: Die Antwort des Modells als String
+    """
+    logging.info(f"Sende Anfrage an litellm: Modell={model}, Nachrichtenlänge={len(messages)}")
+    params, stream = _prepare_request(model, messages, res_format, options)
+
+    if stream:
+        # Bei Streaming sammeln wir die Teile
+        full_response = ""
+        async with aclosing(_stream(params, priority, on_slot)) as contents:
+            async for content in contents:
+                full_response += content
+        return full_response
 
     try:
-        if stream:
-            # Bei Streaming sammeln wir die Teile
-            full_response = ""
-            stream_response = completion(
-                **params,
-                stream=True,
-                headers=extra_headers, input_cost_per_token=0.0, output_cost_per_token=0.0
-            )
-
-            for chunk in stream_response:
-                if chunk.choices and chunk.choices[0].delta.content:
-                    content = chunk.choices[0].delta.content
-                    full_response += content
-
-            return full_response
+        # Ohne Streaming erhalten wir die vollständige Antwort auf einmal
+        response = await LLM_SCHEDULER.run(lambda: acompletion(**params), priority,
+                                           estimate_tokens(messages), on_slot)
+        if getattr(response, "usage", None):
+            LLM_SCHEDULER.charge_tokens(response.usage.completion_tokens or 0)
+
+        # Prüfen, ob wir eine Tool-Call-Antwort haben
+        if hasattr(response.choices[0].message, 'tool_calls') and response.choices[0].message.tool_calls:
+            # Extrahieren des JSON aus dem Tool-Call
+            tool_call = response.choices[0].message.tool_calls[0]
+            response_text = tool_call.function.arguments
+            logging.info(f"Tool-Call Antwort erhalten: {response_text[:100]}...")
         else:
-            # Ohne Streaming erhalten wir die vollständige Antwort auf einmal
-            response = completion(
-                **params,
-                headers=extra_headers, input_cost_per_token=0.0, output_cost_per_token=0.0
-            )
-
-            # Prüfen, ob wir eine Tool-Call-Antwort haben
-            if hasattr(response.choices[0].message, 'tool_calls') and response.choices[0].message.tool_calls:
-                # Extrahieren des JSON aus dem Tool-Call
-                tool_call = response.choices[0].message.tool_calls[0]
-                response_text = tool_call.function.arguments
-                logging.info(f"Tool-Call Antwort erhalten: {response_text[:100]}...")
-            else:
-                # Andernfalls die normale Antwort verwenden
-                response_text = response.choices[0].message.content
-                logging.info(f"Standard-Antwort erhalten: {response_text[:100]}...")
-
-            return response_text
+            # Andernfalls die normale Antwort verwenden
+            response_text = response.choices[0].message.content
+            logging.info(f"Standard-Antwort erhalten: {response_text[:100]}...")
+
+        return response_text
     except Exception as e:
         logging.error(f"Fehler bei litellm-Anfrage: {exception_and_traceback(e)}")
         raise
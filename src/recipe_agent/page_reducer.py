@@ -0,0 +1,189 @@
+""" Token budget aware reduction of crawled pages before they are sent to the LLM
+
+Pages are split into markdown sections which are scored for recipe relevance: ingredient lines
+with amounts and units, numbered steps and typical headings. Only the best sections that fit into
+the token budget of the target model are kept, in their original order. Pages whose relevant
+content exceeds the budget are split into chunks for a map-reduce extraction whose partial
+RecipeLLM results are merged by merge_recipe_llms.
+"""
+import logging
+import re
+from dataclasses import dataclass
+from typing import List
+
+from litellm import token_counter
+
+from recipe_agent.llm_scheduler import estimate_tokens
+from recipe_agent.recipe import RecipeLLM
+
+HEADING_PATTERN = re.compile(r"^#{1,6}\s", re.MULTILINE)
+# -- Units named in the extraction instruction plus common kitchen units, numbers followed by "." or ")"
+#    are numbered steps
+INGREDIENT_LINE = re.compile(
+    r"^\W*(?:(?:\d+(?:[.,/]\d+)?|½|¼|¾)(?![.)\d])|ein(?:e|en)?|etwas|prise)\s*"
+    r"(?:g|kg|mg|l|ml|cl|dl|el|tl|stück|stk|prise|prisen|pck|päckchen|dose|bund|zehe|zehen|becher|tasse|"
+    r"cup|cups|tbsp|tsp|oz|lb)?\b",
+    re.IGNORECASE | re.MULTILINE
+)
+STEP_LINE = re.compile(r"^\s*(?:\d+[.)]|schritt\s+\d+|step\s+\d+)\s+\w", re.IGNORECASE | re.MULTILINE)
+RECIPE_KEYWORDS = re.compile(
+    r"\b(?:zutaten|zubereitung|anleitung|arbeitszeit|kochzeit|backzeit|portionen|personen|"
+    r"ingredients|instructions|directions|method|servings)\b",
+    re.IGNORECASE
+)
+LINK_PATTERN = re.compile(r"https?://\S+")
+# -- Oversize sections are split at paragraphs, then lines, then words: (pattern, joiner)
+SPLIT_LEVELS = ((r"\n\s*\n", "\n\n"), (r"\n", "\n"), (r"[ \t]+", " "))
+
+
+@dataclass
+class Section:
+    index: int
+    text: str
+    tokens: int
+    score: float
+
+
+def count_tokens(text: str, model: str) -> int:
+    """ Tokens of text for the model's tokenizer, estimated if litellm does not know the model """
+    try:
+        return token_counter(model=model, text=text)
+    except Exception as e:
+        logging.debug(f"Estimating tokens for {model}: {e}")
+        return estimate_tokens([{"content": text}])
+
+
+def score_section(text: str) -> float:
+    """ Recipe relevance of a markdown section, 0 for navigation, comments and other clutter """
+    lines = [line for line in text.splitlines() if line.strip()]
+    if not lines:
+        return 0.0
+
+    score = 3.0 * len(INGREDIENT_LINE.findall(text))
+    score += 3.0 * len(STEP_LINE.findall(text))
+    score += 5.0 * len(RECIPE_KEYWORDS.findall(text))
+    # -- Link lists and menus
+    score -= 2.0 * len(LINK_PATTERN.findall(text))
+    return max(0.0, score / len(lines) ** 0.5)
+
+
+def split_sections(markdown: str, model: str, max_tokens: int) -> List[Section]:
+    """ Split at headings, sections above max_tokens are further split at paragraphs """
+    starts = [m.start() for m in HEADING_PATTERN.finditer(markdown)]
+    bounds = ([0] if not starts or starts[0] != 0 else list()) + starts + [len(markdown)]
+    parts = [markdown[a:b] for a, b in zip(bounds, bounds[1:]) if markdown[a:b].strip()]
+
+    sections: List[Section] = list()
+    for part in parts:
+        tokens = count_tokens(part, model)
+        if tokens <= max_tokens:
+            sections.append(Section(len(sections), part, tokens, score_section(part)))
+            continue
+
+        for paragraph in _split_paragraphs(part, model, max_tokens):
+            sections.append(Section(len(sections), paragraph, count_tokens(paragraph, model),
+                                    score_section(paragraph)))
+    return sections
+
+
+def _split_paragraphs(text: str, model: str, max_tokens: int, level: int = 0) -> List[str]:
+    """ Pack paragraphs into chunks of at most max_tokens, paragraphs above it are split at lines, then words """
+    pattern, joiner = SPLIT_LEVELS[level]
+    chunks, current, used = list(), list(), 0
+    for part in re.split(pattern, text):
+        if not part.strip():
+            continue
+        tokens = count_tokens(part, model)
+        if tokens > max_tokens and level + 1 < len(SPLIT_LEVELS):
+            if current:
+                chunks.append(joiner.join(current))
+                current, used = list(), 0
+            chunks += _split_paragraphs(part, model, max_tokens, level + 1)
+            continue
+
+        # -- Token counts of the parts add up, one more token for each joiner
+        if current and used + 1 + tokens > max_tokens:
+            chunks.append(joiner.join(current))
+            current, used = list(), 0
+        used += tokens + (1 if current else 0)
+        current.append(part)
+    if current:
+        chunks.append(joiner.join(current))
+    return chunks
+
+
+def reduce_page(markdown: str, model: str, budget: int) -> str:
+    """ Keep the most recipe relevant sections of markdown that fit into budget tokens """
+    if count_tokens(markdown, model) <= budget:
+        return markdown
+
+    sections = split_sections(markdown, model, budget)
+    kept, used = list(), 0
+    for section in sorted(sections, key=lambda s: s.score, reverse=True):
+        if used + section.tokens <= budget:
+            kept.append(section)
+            used += section.tokens
+
+    logging.info(f"Reduced page to {len(kept)}/{len(sections)} sections, {used}/{budget} tokens")
+    return "\n".join(s.text.strip("\n") for s in sorted(kept, key=lambda s: s.index))
+
+
+def chunk_page(markdown: str, model: str, budget: int, max_chunks: int) -> List[str]:
+    """ Split the recipe relevant sections of markdown into chunks of at most budget tokens
+
+    Returns:
+        A single reduced page if the relevant content fits into the budget, otherwise up to
+        max_chunks chunks in page order for a map-reduce extraction
+    """
+    if count_tokens(markdown, model) <= budget:
+        return [markdown]
+
+    sections = split_sections(markdown, model, budget)
+    # -- The first section holds the title and introduction of the recipe
+    relevant = [s for s in sections if s.score > 0 or s.index == 0]
+    if sum(s.tokens for s in relevant) <= budget or max_chunks <= 1:
+        return [reduce_page(markdown, model, budget)]
+
+    # -- Drop the least relevant sections until the chunks fit
+    total_budget = budget * max_chunks
+    while sum(s.tokens for s in relevant) > total_budget:
+        relevant.remove(min(relevant[1:], key=lambda s: s.score))
+
+    chunks, current, used = list(), list(), 0
+    for section in relevant:
+        if current and used + section.tokens > budget:
+            chunks.append(current)
+            current, used = list(), 0
+        current.append(section)
+        used += section.tokens
+    if current:
+        chunks.append(current)
+
+    return ["\n".join(s.text.strip("\n") for s in chunk) for chunk in chunks[:max_chunks]]
+
+
+def merge_recipe_llms(parts: List[RecipeLLM]) -> RecipeLLM:
+    """ Merge partial extractions of the chunks of one page
+
+    Scalar fields are taken from the first chunk that found them, ingredients, instructions and
+    keywords are concatenated in chunk order without duplicates.
+    """
+    def _first(field: str) -> str:
+        return next((getattr(p, field) for p in parts if getattr(p, field)), "")
+
+    def _union(field: str) -> List[str]:
+        merged, seen = list(), set()
+        for part in parts:
+            for item in getattr(part, field):
+                key = item.strip().lower()
+                if key and key not in seen:
+                    seen.add(key)
+                    merged.append(item)
+        return merged
+
+    return RecipeLLM(
+        name=_first("name"), url=_first("url"), image_url=_first("image_url"), description=_first("description"),
+        recipeIngredient=_union("recipe_ingredient"), recipeInstructions=_union("recipe_instructions"),
+        prepTime=_first("prep_time"), cookTime=_first("cook_time"), totalTime=_first("total_time"),
+        keywords=_union("keywords"),
+    )
@@ -1,3 +1,6 @@
+import os
+from pathlib import Path
+
 from crawl4ai import BrowserConfig, CrawlerRunConfig, CacheMode, LLMExtractionStrategy
 
 from recipe_agent.recipe import RecipeLLM
@@ -11,6 +14,53 @@ BASE_BROWSER = BrowserConfig(
     text_mode=True
 )
 
+# -- Shared Chromium crawler pool
+CRAWLER_POOL_MAX_CONCURRENCY = int(os.getenv("CRAWLER_POOL_MAX_CONCURRENCY", 4))
+# Recycle the browser after this many pages or once its processes exceed the RSS ceiling, 0 disables
+CRAWLER_POOL_MAX_PAGES = int(os.getenv("CRAWLER_POOL_MAX_PAGES", 100))
+CRAWLER_POOL_MAX_RSS_MB = int(os.getenv("CRAWLER_POOL_MAX_RSS_MB", 1024))
+
+# -- Persistent crawl cache, TTL in seconds
+CRAWL_CACHE_PATH = Path(os.getenv("CRAWL_CACHE_PATH", Path(__file__).parents[2].joinpath("data/cache/crawl_cache.sqlite")))
+CRAWL_CACHE_TTL = float(os.getenv("CRAWL_CACHE_TTL", 24 * 60 * 60))
+CRAWL_CACHE_MAX_BYTES = int(os.getenv("CRAWL_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+# -- Download pages without browser for their structured recipe data before crawling them. Saves the
+#    crawl on recipe sites, costs an extra request of up to 10 seconds on all others
+STRUCTURED_RECIPE_PROBE = os.getenv("STRUCTURED_RECIPE_PROBE", "false").lower() in ("1", "true", "yes")
+
+# -- Content-addressed cache of LLM recipe extractions
+EXTRACTION_CACHE_PATH = Path(os.getenv("EXTRACTION_CACHE_PATH", Path(__file__).parents[2].joinpath("data/cache/extraction_cache.sqlite")))
+EXTRACTION_CACHE_MAX_ENTRIES = int(os.getenv("EXTRACTION_CACHE_MAX_ENTRIES", 5000))
+# -- Reads of both caches collect their LRU updates and write them at most every n seconds
+CACHE_TOUCH_INTERVAL = float(os.getenv("CACHE_TOUCH_INTERVAL", 60.0))
+
+# -- Token budgets of the page content sent to the LLM, oversized pages are extracted in up to n chunks
+EXTRACTION_TOKEN_BUDGET = int(os.getenv("EXTRACTION_TOKEN_BUDGET", 6000))
+EXTRACTION_MAX_CHUNKS = int(os.getenv("EXTRACTION_MAX_CHUNKS", 4))
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", 2500))
+
+# -- Persistent chat histories, 'sqlite' or 'memory', written behind every n seconds, max age in seconds
+CHAT_HISTORY_BACKEND = os.getenv("CHAT_HISTORY_BACKEND", "sqlite")
+CHAT_HISTORY_PATH = Path(os.getenv("CHAT_HISTORY_PATH", Path(__file__).parents[2].joinpath("data/state/chat_history.sqlite")))
+CHAT_HISTORY_FLUSH_INTERVAL = float(os.getenv("CHAT_HISTORY_FLUSH_INTERVAL", 2.0))
+CHAT_HISTORY_MAX_AGE = float(os.getenv("CHAT_HISTORY_MAX_AGE", 30 * 24 * 60 * 60))
+
+# -- Local mirror of the Nextcloud recipe folder for incremental syncs, tombstones of deleted recipes expire
+RECIPE_MIRROR_PATH = Path(os.getenv("RECIPE_MIRROR_PATH", Path(__file__).parents[2].joinpath("data/state/recipe_mirror.sqlite")))
+RECIPE_MIRROR_TOMBSTONE_TTL = float(os.getenv("RECIPE_MIRROR_TOMBSTONE_TTL", 30 * 24 * 60 * 60))
+# -- Source urls of the saved recipes, the cookbook's recipe list does not contain them
+COOKBOOK_URLS_PATH = Path(os.getenv("COOKBOOK_URLS_PATH", Path(__file__).parents[2].joinpath("data/state/cookbook_urls.sqlite")))
+
+# -- Shared executors: processes for CPU-bound work (0 runs it in threads), threads for blocking I/O
+EXECUTOR_CPU_WORKERS = int(os.getenv("EXECUTOR_CPU_WORKERS", max(1, min(4, (os.cpu_count() or 2) - 1))))
+EXECUTOR_IO_WORKERS = int(os.getenv("EXECUTOR_IO_WORKERS", min(32, (os.cpu_count() or 1) + 4)))
+
+# -- Concurrent recipe scrapes, results are delivered in 'arrival' or 'completion' order
+RECIPE_MAX_CONCURRENCY = int(os.getenv("RECIPE_MAX_CONCURRENCY", 8))
+RECIPE_MAX_CONCURRENCY_PER_USER = int(os.getenv("RECIPE_MAX_CONCURRENCY_PER_USER", 3))
+RECIPE_DELIVERY_ORDER = os.getenv("RECIPE_DELIVERY_ORDER", "arrival")
+
 LLM_PROVIDER="openrouter/mistralai/mistral-nemo:free"
 # LLM_PROVIDER="meta-llama/llama-3.3-8b-instruct:free"
 
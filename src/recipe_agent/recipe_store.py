@@ -0,0 +1,54 @@
+""" Small in-memory store of recently sent recipes
+
+Chat histories only keep a reference to a sent recipe together with a one-line summary for the
+LLM. The full recipe is looked up here when the user asks for it again.
+"""
+import os
+from collections import OrderedDict
+from typing import Optional
+
+from recipe_agent.recipe import Recipe
+from recipe_agent.utils import normalize_url
+
+RECIPE_STORE_MAX_ENTRIES = int(os.getenv("RECIPE_STORE_MAX_ENTRIES", 256))
+
+
+def recipe_ref(recipe: Recipe) -> str:
+    return normalize_url(recipe.url) if recipe.url else f"id:{recipe.id}"
+
+
+def recipe_summary(recipe: Recipe) -> str:
+    """ One-line summary of a sent recipe for the LLM messages """
+    summary = f"[Rezept gesendet: {recipe.name}"
+    if recipe.url:
+        summary += f" ({recipe.url})"
+    summary += f", {len(recipe.recipe_ingredient)} Zutaten, {len(recipe.recipe_instructions)} Schritte"
+    if recipe.total_time:
+        summary += f", Gesamtzeit {recipe.total_time}"
+    return summary + "]"
+
+
+class RecipeStore:
+    def __init__(self, max_entries: int = RECIPE_STORE_MAX_ENTRIES):
+        self._recipes: OrderedDict[str, Recipe] = OrderedDict()
+        self.max_entries = max(1, max_entries)
+
+    def __len__(self) -> int:
+        return len(self._recipes)
+
+    def put(self, recipe: Recipe) -> str:
+        ref = recipe_ref(recipe)
+        self._recipes[ref] = recipe
+        self._recipes.move_to_end(ref)
+        if len(self._recipes) > self.max_entries:
+            self._recipes.popitem(last=False)
+        return ref
+
+    def get(self, ref: str) -> Optional[Recipe]:
+        recipe = self._recipes.get(ref)
+        if recipe is not None:
+            self._recipes.move_to_end(ref)
+        return recipe
+
+
+RECIPE_STORE = RecipeStore()
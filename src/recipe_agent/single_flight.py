@@ -0,0 +1,43 @@
+""" Single-flight de-duplication of concurrent async calls
+
+Concurrent calls with the same key share one in-flight task instead of doing the same work twice.
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    def __init__(self, name: str = ""):
+        self._name = name
+        self._tasks: Dict[Hashable, asyncio.Task] = dict()
+        self.shared_calls = 0
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._tasks
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        """ Await the in-flight call for key or start func if there is none
+
+        A caller being cancelled does not cancel the shared call for the remaining callers.
+        Exceptions are raised to every caller.
+        """
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._tasks[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            self.shared_calls += 1
+            logging.info(f"{self._name} joined in-flight call for {key}")
+
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._tasks.get(key) is task:
+            self._tasks.pop(key)
+        # -- Retrieve the exception so a call without remaining callers does not log it as never retrieved
+        if not task.cancelled():
+            task.exception()
@@ -0,0 +1,239 @@
+""" Browserless recipe extraction from schema.org structured data
+
+Most recipe sites embed a complete schema.org Recipe as JSON-LD or microdata. Parsing it locally
+is much faster than extracting the recipe with an LLM. The data is parsed from the html of every
+crawl; the optional probe downloads the page without a browser before crawling it.
+"""
+import html
+import json
+import logging
+import re
+from datetime import datetime
+from typing import Optional, List, Any, Union
+
+import httpx
+from bs4 import BeautifulSoup, Tag
+
+from recipe_agent.recipe import Recipe
+from recipe_agent.utils import generate_recipe_uid, exception_and_traceback
+
+HTTP_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/132.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'de-DE,de;q=0.9,en;q=0.8',
+}
+HTTP_TIMEOUT = 10.0
+
+ISO_DURATION_PATTERN = re.compile(r'P(?:(\d+)D)?T?(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?')
+TAG_PATTERN = re.compile(r'<[^>]+>')
+MICRODATA_LIST_PROPS = {"recipeIngredient", "ingredients", "recipeInstructions", "tool", "keywords"}
+
+
+async def fetch_structured_recipe(url: str) -> Optional[Recipe]:
+    """ Download the page without a browser and parse its structured recipe data
+
+    Returns:
+        The Recipe or None if the page could not be fetched or contains no usable recipe
+    """
+    try:
+        async with httpx.AsyncClient(headers=HTTP_HEADERS, timeout=HTTP_TIMEOUT, follow_redirects=True) as client:
+            response = await client.get(url)
+            response.raise_for_status()
+    except httpx.HTTPError as e:
+        logging.info(f"Could not fetch {url} without browser: {e}")
+        return None
+
+    try:
+        return recipe_from_html(response.text, url)
+    except Exception as e:
+        logging.error(f"Error parsing structured data of {url}: {exception_and_traceback(e)}")
+        return None
+
+
+def recipe_from_html(page_html: str, url: str) -> Optional[Recipe]:
+    """ Extract a usable Recipe from JSON-LD or microdata in the given html """
+    data = structured_data_from_html(page_html)
+    if not data:
+        return None
+
+    return usable_recipe(data, url)
+
+
+def structured_data_from_html(page_html: str) -> Optional[dict]:
+    """ The schema.org Recipe node of the html, crawled pages keep it instead of the whole html """
+    soup = BeautifulSoup(page_html, 'html.parser')
+    return find_json_ld_recipe(soup) or find_microdata_recipe(soup)
+
+
+def usable_recipe(data: dict, url: str) -> Optional[Recipe]:
+    """ The Recipe of the structured data or None if it lacks name, ingredients or instructions """
+    recipe = recipe_from_structured_data(data, url)
+    if not recipe.name or not recipe.recipe_ingredient or not recipe.recipe_instructions:
+        logging.info(f"Structured data of {url} is incomplete, falling back to browser extraction")
+        return None
+
+    return recipe
+
+
+def find_json_ld_recipe(soup: BeautifulSoup) -> Optional[dict]:
+    for script in soup.find_all('script', attrs={'type': 'application/ld+json'}):
+        try:
+            data = json.loads(script.string or script.get_text() or "", strict=False)
+        except json.JSONDecodeError:
+            continue
+
+        recipe_data = _find_recipe_node(data)
+        if recipe_data:
+            return recipe_data
+
+    return None
+
+
+def find_microdata_recipe(soup: BeautifulSoup) -> Optional[dict]:
+    root = soup.find(attrs={'itemtype': re.compile(r'schema\.org/Recipe', re.IGNORECASE)})
+    if root is None:
+        return None
+
+    data = {"@type": "Recipe"}
+    for el in root.find_all(attrs={'itemprop': True}):
+        # -- Skip properties of nested items like NutritionInformation or HowToStep containers
+        if el.find_parent(attrs={'itemscope': True}) is not root:
+            continue
+
+        for prop in el['itemprop'].split():
+            value = _microdata_value(el)
+            if prop in MICRODATA_LIST_PROPS:
+                data.setdefault(prop, list()).append(value)
+            else:
+                data.setdefault(prop, value)
+
+    return data
+
+
+def recipe_from_structured_data(data: dict, url: str) -> Recipe:
+    """ Map a schema.org Recipe onto our Recipe model """
+    image = _first_url(data.get("image"))
+    now = datetime.now().isoformat()
+
+    return Recipe(
+        id=str(generate_recipe_uid()),
+        name=_text(data.get("name")),
+        description=_text(data.get("description")),
+        url=url,
+        image=image,
+        imageUrl=image,
+        prepTime=_duration(data.get("prepTime")),
+        cookTime=_duration(data.get("cookTime")),
+        totalTime=_duration(data.get("totalTime")),
+        recipeCategory=",".join(_text_list(data.get("recipeCategory"))),
+        keywords=",".join(_keywords(data.get("keywords"))),
+        recipeYield=_recipe_yield(data.get("recipeYield")),
+        tool=_text_list(data.get("tool")),
+        recipeIngredient=_text_list(data.get("recipeIngredient") or data.get("ingredients")),
+        recipeInstructions=_instructions(data.get("recipeInstructions")),
+        dateCreated=now,
+        dateModified=now,
+    )
+
+
+def _find_recipe_node(data: Any) -> Optional[dict]:
+    """ Search JSON-LD documents, lists and @graph containers for a node of @type Recipe """
+    if isinstance(data, list):
+        for item in data:
+            node = _find_recipe_node(item)
+            if node:
+                return node
+    elif isinstance(data, dict):
+        node_type = data.get("@type")
+        node_types = node_type if isinstance(node_type, list) else [node_type]
+        if "Recipe" in node_types:
+            return data
+        for key in ("@graph", "mainEntity", "mainEntityOfPage"):
+            node = _find_recipe_node(data.get(key))
+            if node:
+                return node
+
+    return None
+
+
+def _microdata_value(el: Tag) -> Union[str, dict]:
+    if el.has_attr('itemscope'):
+        return {"text": el.get_text(" ", strip=True)}
+    for attr in ('content', 'datetime', 'href', 'src'):
+        if el.has_attr(attr):
+            return el[attr]
+    return el.get_text(" ", strip=True)
+
+
+def _text(value: Any) -> str:
+    if isinstance(value, list):
+        value = value[0] if value else ""
+    if isinstance(value, dict):
+        value = value.get("text") or value.get("name") or ""
+    if value is None:
+        return ""
+    value = html.unescape(TAG_PATTERN.sub(" ", str(value)))
+    value = re.sub(r'\s+', ' ', value)
+    return re.sub(r'\s+([.,;:!?])', r'\1', value).strip()
+
+
+def _text_list(value: Any) -> List[str]:
+    if value is None:
+        return list()
+    if not isinstance(value, list):
+        value = [value]
+    return [t for t in (_text(v) for v in value) if t]
+
+
+def _keywords(value: Any) -> List[str]:
+    keywords = list()
+    for keyword in _text_list(value):
+        keywords += [k.strip() for k in keyword.split(",") if k.strip()]
+    return keywords
+
+
+def _first_url(value: Any) -> str:
+    if isinstance(value, list):
+        value = value[0] if value else ""
+    if isinstance(value, dict):
+        value = value.get("url") or value.get("contentUrl") or ""
+    return str(value or "")
+
+
+def _duration(value: Any) -> Optional[str]:
+    """ Normalize ISO 8601 durations like PT20M or P0DT1H to the PT0H20M0S format used by the cookbook """
+    value = _text(value)
+    if not value:
+        return None
+
+    match = ISO_DURATION_PATTERN.fullmatch(value)
+    if not match:
+        return None
+
+    days, hours, minutes, seconds = (int(g or 0) for g in match.groups())
+    return f"PT{days * 24 + hours}H{minutes}M{seconds}S"
+
+
+def _recipe_yield(value: Any) -> int:
+    for text in _text_list(value):
+        match = re.search(r'\d+', text)
+        if match:
+            return max(1, int(match.group()))
+    return 1
+
+
+def _instructions(value: Any) -> List[str]:
+    """ Flatten plain text, HowToStep and HowToSection instructions into a list of steps """
+    if value is None:
+        return list()
+    if isinstance(value, str):
+        return [t for t in (_text(s) for s in re.split(r'\n+', html.unescape(value))) if t]
+    if isinstance(value, dict):
+        if "itemListElement" in value:
+            return _instructions(value["itemListElement"])
+        return _text_list(value)
+
+    steps = list()
+    for item in value:
+        steps += _instructions(item)
+    return steps
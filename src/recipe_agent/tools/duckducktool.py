@@ -6,6 +6,7 @@ from bs4 import BeautifulSoup
 from urllib.parse import urlparse, parse_qs
 from pydantic import BaseModel
 
+from recipe_agent.executors import EXECUTORS
 from recipe_agent.utils import exception_and_traceback
 
 
@@ -65,20 +66,21 @@ def extract_url_parameter(url: str, parameter_name="uddg") -> str:
     return query_params.get(parameter_name, [''])[0]
 
 
-def duckduckgo_search_local(query: str) -> DuckDuckGoSearchResults:
-    results = DuckDuckGoSearchResults()
+DDG_URL = 'https://duckduckgo.com/html/'
+DDG_HEADERS = {
+    'Content-Type': 'application/x-www-form-urlencoded',
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/132.0.0.0 Safari/537.36 OPR/117.0.0.0',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
+}
 
-    headers = {
-        'Content-Type': 'application/x-www-form-urlencoded',
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/132.0.0.0 Safari/537.36 OPR/117.0.0.0',
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
-    }
-    ddg_url = 'https://duckduckgo.com/html/'
-    try:
-        soup = BeautifulSoup(httpx.get(ddg_url, params={'q': query}, headers=headers).content, 'html.parser')
-    except Exception as e:
-        logging.error(f"Error trying to request search query at {ddg_url}: {exception_and_traceback(e)}")
-        return results
+
+def parse_search_results(html: bytes) -> DuckDuckGoSearchResults:
+    """ Extract the organic results from a DuckDuckGo HTML result page
+
+    Module level and free of I/O, so it can run in the process pool of EXECUTORS.
+    """
+    results = DuckDuckGoSearchResults()
+    soup = BeautifulSoup(html, 'html.parser')
 
     for el in soup.select('.links_main.result__body'):
         # -- Get result Link element
@@ -87,7 +89,7 @@ def duckduckgo_search_local(query: str) -> DuckDuckGoSearchResults:
         snippet = el.select_one('.result__snippet')
 
         # -- Skip if not found
-        if not a or not snippet:
+        if not a or not snippet or a.string is None:
             continue
 
         # -- Extract result url
@@ -102,10 +104,29 @@ def duckduckgo_search_local(query: str) -> DuckDuckGoSearchResults:
         # -- Add result
         if ddg_urld and url:
             # -- Create Result
-            results.append(DuckDuckGoSearchResult(title=a.string, url=url, snippet=snippet.text))
+            results.append(DuckDuckGoSearchResult(title=str(a.string), url=url, snippet=snippet.text))
 
     return results
 
 
+def duckduckgo_search_local(query: str) -> DuckDuckGoSearchResults:
+    try:
+        html = httpx.get(DDG_URL, params={'q': query}, headers=DDG_HEADERS).content
+    except Exception as e:
+        logging.error(f"Error trying to request search query at {DDG_URL}: {exception_and_traceback(e)}")
+        return DuckDuckGoSearchResults()
+    return parse_search_results(html)
+
+
+async def duckduckgo_search(query: str) -> DuckDuckGoSearchResults:
+    """ Like duckduckgo_search_local without blocking the event loop, the page is parsed in the process pool """
+    try:
+        response = await EXECUTORS.run_io(httpx.get, DDG_URL, params={'q': query}, headers=DDG_HEADERS)
+    except Exception as e:
+        logging.error(f"Error trying to request search query at {DDG_URL}: {exception_and_traceback(e)}")
+        return DuckDuckGoSearchResults()
+    return await EXECUTORS.run_cpu(parse_search_results, response.content)
+
+
 def search_tool(query: str):
     return str(duckduckgo_search_local(query))
@@ -1,20 +1,29 @@
+import io
 import json
 import logging
+import math
 import os
 import random
 import re
-import tempfile
 import traceback
 import urllib
 from pathlib import Path
-from typing import Optional, Tuple, Set, Union
-from urllib.parse import urlparse
+from typing import Dict, List, Optional, Set, Union
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
 
 import requests
 from linkpreview import link_preview
 from PIL import Image
 
+# File extension of the image formats used for recipe images
+IMAGE_FORMAT_EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp"}
+
 ISO_8601_TIME_PATTERN = re.compile(r'PT(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?')
+TRACKING_QUERY_PARAMS = ("utm_", "fbclid", "gclid", "mc_cid", "mc_eid")
+URL_PATTERN = re.compile(r'https?://\S+')
+MARKDOWN_NOISE_PATTERN = re.compile(r"\s\||(?:\(http.*\)|(?:\[|]))")
+# Seconds until an image download is aborted
+IMAGE_DOWNLOAD_TIMEOUT = float(os.getenv("IMAGE_DOWNLOAD_TIMEOUT", 15.0))
 
 
 def get_link_preview_image(url) -> str:
@@ -42,104 +51,91 @@ def get_link_preview_image_url(url) -> str:
     return link_preview_image
 
 
-def download_image_to_tempfile(url: str) -> Optional[Path]:
-    """
-    Downloads an image from the given URL and writes it to a temporary file.
-    Returns the name of the temporary file and its extension.
+def find_urls(text: str) -> List[str]:
+    return URL_PATTERN.findall(text)
 
-    Args:
-        url (str): The URL of the image to download.
 
-    Returns:
-        Optional[Path]: A tuple containing the path to the temporary file and its extension.
-    """
-    response = requests.get(url)
-    if not response.ok:
-        return None
+def clean_markdown(markdown: str) -> str:
+    """ Remove table pipes, link targets and brackets from crawled markdown before the extraction """
+    return MARKDOWN_NOISE_PATTERN.sub("", markdown)
 
-    # Parse the URL to get the file extension
-    parsed_url = urlparse(url)
-    file_extension = parsed_url.path.split('.')[-1]
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{file_extension}', mode='wb') as tmp_file:
-        tmp_file.write(response.content)
-        temp_file_name = tmp_file.name
+def normalize_url(url: str) -> str:
+    """ Normalize a url so links to the same page shared by different users compare equal
 
-    return Path(temp_file_name)
-
-
-def open_and_resize_image(image_path: Path, max_size: int = 1024) -> Tuple[Image, int, int]:
-    img = Image.open(image_path)
-    original_width, original_height = img.size
-
-    # Determine the scaling factor
-    if original_width > max_size or original_height > max_size:
-        if original_width > original_height:
-            new_width = max_size
-            new_height = int((max_size / original_width) * original_height)
-        else:
-            new_height = max_size
-            new_width = int((max_size / original_height) * original_width)
+    Lower-cases scheme and host, drops fragments, tracking parameters and trailing slashes and sorts the query.
+    """
+    parsed = urlparse(url.strip())
+    query = sorted((k, v) for k, v in parse_qsl(parsed.query, keep_blank_values=True)
+                   if not k.lower().startswith(TRACKING_QUERY_PARAMS))
+    path = parsed.path.rstrip("/") or "/"
+    return urlunparse((parsed.scheme.lower(), parsed.netloc.lower(), path, parsed.params, urlencode(query), ""))
 
-        # Resize the image
-        return img.resize((new_width, new_height), Image.Resampling.LANCZOS), new_width, new_height
 
-    return img, original_width, original_height
+def download_image(url: str) -> Optional[bytes]:
+    """ Downloads an image into memory, returns None if the download failed """
+    try:
+        response = requests.get(url, timeout=IMAGE_DOWNLOAD_TIMEOUT)
+    except requests.RequestException as e:
+        logging.warning(f"Image download of {url} failed: {e}")
+        return None
+    if not response.ok:
+        return None
+    return response.content
 
 
-def resize_and_crop_image(image_path: Path, output_path: Optional[Path] = None, max_size: int = 172) -> Tuple[
-    Path, int, int]:
+def create_image_derivatives(data: bytes, sizes: Dict[str, int], image_format: str = "JPEG",
+                             quality: int = 85) -> Dict[str, bytes]:
     """
-    Resizes an image such that the longest side is no longer than max_size pixels and then crops it to a square shape from the center.
+    Decodes an image once and derives square center crops whose side is at most the given size.
+
+    JPEGs are decoded at a reduced scale if they are much larger than the largest derivative (draft mode).
+    Each smaller derivative is resized from the previous one instead of the original image.
 
     Args:
-        image_path (Path): The path to the input image file.
-        output_path (Path): Optional output path to write result to
-        max_size (int): The maximum size for the longest side of the image. Default is 172.
+        data (bytes): The encoded input image.
+        sizes (Dict[str, int]): Name and maximum size of the longest side of every derivative.
+        image_format (str): Pillow format to encode the derivatives with, eg. JPEG, PNG or WEBP.
+        quality (int): Encoder quality for lossy formats.
 
     Returns:
-        Tuple[str, int, int]: A tuple containing the path to the cropped image,
-                              the new width, and the new height.
+        Dict[str, bytes]: The encoded derivatives by name.
     """
-    # Read the image
-    resized_img, new_width, new_height = open_and_resize_image(image_path, max_size)
-
-    # Crop to a square shape from the center
-    min_dimension = min(new_width, new_height)
-    left = (new_width - min_dimension) // 2
-    top = (new_height - min_dimension) // 2
-    right = (new_width + min_dimension) // 2
-    bottom = (new_height + min_dimension) // 2
-    cropped_img = resized_img.crop((left, top, right, bottom))
-
-    # Save the cropped image to a new file
-    output_path = output_path or image_path.with_name(f"Resized_{image_path.name}")
-    cropped_img.save(output_path)
-
-    return output_path, min_dimension, min_dimension
+    with Image.open(io.BytesIO(data)) as img:
+        largest = max(sizes.values())
+        scale = largest / max(img.size)
+        if scale < 1:
+            # -- JPEG only: decode at the smallest 1/n scale that is still at least as large as needed
+            img.draft("RGB", (math.ceil(img.width * scale), math.ceil(img.height * scale)))
+        img.load()
+        if image_format.upper() == "JPEG" and img.mode not in ("RGB", "L"):
+            current = img.convert("RGB")
+        else:
+            current = img.copy()
 
+    derivatives = dict()
+    for name, max_size in sorted(sizes.items(), key=lambda item: item[1], reverse=True):
+        if max(current.size) > max_size:
+            current = _scale_to(current, max_size)
 
-def resize_image(image_path: Path, output_path: Optional[Path] = None, max_size: int = 1024) -> Tuple[Path, int, int]:
-    """
-    Resizes an image such that the longest side is no longer than max_size pixels.
+        # Crop to a square shape from the center
+        width, height = current.size
+        min_dimension = min(width, height)
+        left, top = (width - min_dimension) // 2, (height - min_dimension) // 2
+        cropped = current.crop((left, top, left + min_dimension, top + min_dimension))
 
-    Args:
-        image_path (Path): The path to the input image file.
-        output_path (Path): Optional output path to write result to
-        max_size (int): The maximum size for the longest side of the image. Default is 1024.
+        buffer = io.BytesIO()
+        cropped.save(buffer, format=image_format, quality=quality)
+        derivatives[name] = buffer.getvalue()
 
-    Returns:
-        Tuple[Path, int, int]: A tuple containing the path to the resized image,
-                              the new width, and the new height.
-    """
-    # Read the image
-    resized_img, new_width, new_height = open_and_resize_image(image_path, max_size)
+    return derivatives
 
-    # Save the resized image to a new file
-    output_path = output_path or image_path.with_name(f"Resized_{image_path.name}")
-    resized_img.save(output_path)
 
-    return output_path, new_width, new_height
+def _scale_to(img: Image, max_size: int) -> Image:
+    width, height = img.size
+    if width > height:
+        return img.resize((max_size, max(1, int(max_size / width * height))), Image.Resampling.LANCZOS)
+    return img.resize((max(1, int(max_size / height * width)), max_size), Image.Resampling.LANCZOS)
 
 
 def convert_time_str(time_str: str):
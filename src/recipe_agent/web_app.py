@@ -1,8 +1,8 @@
 import json
 import logging
 import os
-import re
 from pathlib import Path
+from typing import Optional
 
 import tornado.httpserver
 from jinja2 import Environment, FileSystemLoader
@@ -11,12 +11,20 @@ from tornado.web import RequestHandler, Application, StaticFileHandler
 
 from recipe_agent.agents import chat_agent, recipe_agent
 from recipe_agent.chat_history import ChatHistory
-from recipe_agent.recipe_config import SAVE_RECIPE_TERM
-from recipe_agent.utils import to_md_recipe, exception_and_traceback
+from recipe_agent.crawl_cache import CRAWL_CACHE
+from recipe_agent.crawler_pool import CRAWLER_POOL
+from recipe_agent.executors import EXECUTORS
+from recipe_agent.extraction_cache import EXTRACTION_CACHE
+from recipe_agent.history_backend import HISTORY_BACKEND
+from recipe_agent.io.cookbook_api import COOKBOOK_REINDEX
+from recipe_agent.io.nextcloud_client import NEXTCLOUD_CLIENTS
+from recipe_agent.utils import to_md_recipe, exception_and_traceback, find_urls
 
 # Chat-Historie für Web-Nutzer
-WEB_CHAT_HISTORIES = ChatHistory(max_history_length=10)
+WEB_CHAT_HISTORIES = ChatHistory(max_history_length=10, summarizer=chat_agent.summarize_history,
+                                 backend=HISTORY_BACKEND, namespace="web")
 BASE_PATH = Path(__file__).parents[2]
+WEB_SERVER: Optional[tornado.httpserver.HTTPServer] = None
 
 
 class MainHandler(RequestHandler):
@@ -31,33 +39,46 @@ class ChatHandler(RequestHandler):
     async def post(self):
         message = self.get_argument("message", "")
         username = self.get_argument("username", "Web-Nutzer")
+        await WEB_CHAT_HISTORIES.load(username)
 
         # URL aus der Nachricht extrahieren
-        urls = re.findall(r'https?://\S+', message)
+        urls = find_urls(message)
 
-        save: bool = True if SAVE_RECIPE_TERM in message else False
+        save: bool = chat_agent.is_save_request(message)
         just_save = False
         if save and not urls:
             urls = WEB_CHAT_HISTORIES.get_last_message_with_url(username)
             just_save = True
 
         if urls:
-            # Verarbeite Rezept-URL
-            try:
-                recipe_obj = await recipe_agent.scrape_recipe(urls[0], save=save)
+            # Verarbeite alle Rezept-URLs gleichzeitig
+            # Bereits gesendete Rezepte werden ohne erneuten Abruf gespeichert
+            known_recipes = WEB_CHAT_HISTORIES.get_recipes_for_urls(username, urls) if just_save else None
+            responses, user_message_added = list(), False
+            async for result in recipe_agent.scrape_recipes(urls, save, f"web:{username}",
+                                                            known_recipes=known_recipes):
+                if result.recipe is None:
+                    responses.append(f"Fehler beim Abrufen des Rezepts {result.url}: {result.error}")
+                    continue
+
                 if just_save:
-                    response = f"{recipe_obj.name} gespeichert."
-                    WEB_CHAT_HISTORIES.add_assistant_response(username, response)
+                    recipe_response = f"{result.recipe.name} gespeichert."
+                    WEB_CHAT_HISTORIES.add_assistant_response(username, recipe_response)
                 else:
-                    markdown_recipe = to_md_recipe(recipe_obj)
-                    WEB_CHAT_HISTORIES.add_user_message(username, message)
-                    WEB_CHAT_HISTORIES.add_assistant_response(username, markdown_recipe)
-
-                    # Formatiere die Antwort für das Web
-                    response = markdown_recipe
-            except Exception as e:
-                logging.error(f"Error while scraping {urls[0]}: {exception_and_traceback(e)}")
-                response = f"Fehler beim Abrufen des Rezepts: {str(e)}"
+                    recipe_response = to_md_recipe(result.recipe)
+                    if not user_message_added:
+                        WEB_CHAT_HISTORIES.add_user_message(username, message)
+                        user_message_added = True
+                    # Im Verlauf nur eine Referenz auf das Rezept speichern
+                    WEB_CHAT_HISTORIES.add_recipe(username, result.recipe, result.url)
+
+                responses.append(recipe_response)
+
+            # Formatiere die Antwort für das Web
+            response = "\n\n".join(responses)
+        elif (last_recipe := chat_agent.requested_recipe(username, message, WEB_CHAT_HISTORIES)) is not None:
+            # Vollständiges Rezept nur auf Nachfrage erneut senden
+            response = to_md_recipe(last_recipe)
         else:
             # Normale Chat-Nachricht verarbeiten
             response = await chat_agent.answer_message(username, message, WEB_CHAT_HISTORIES)
@@ -76,16 +97,36 @@ def make_app():
     ])
 
 
-def start_web_app():
-    """Startet den Web-Server in einem separaten Thread"""
+def start_web_server() -> tornado.httpserver.HTTPServer:
+    """Startet den Web-Server im aktuell laufenden Event-Loop"""
+    global WEB_SERVER
+    if WEB_SERVER is not None:
+        return WEB_SERVER
+
+    # Gespräche von vor dem Neustart laden
+    WEB_CHAT_HISTORIES.restore()
+
     app = make_app()
-    server = tornado.httpserver.HTTPServer(app)
+    WEB_SERVER = tornado.httpserver.HTTPServer(app)
 
     port = os.getenv("WEB_APP_PORT")
     port = int(port) if port else 8888
 
-    server.listen(port)
+    WEB_SERVER.listen(port)
     logging.info(f"Web-Server läuft auf http://localhost:{port}")
+    return WEB_SERVER
+
+
+def stop_web_server():
+    global WEB_SERVER
+    if WEB_SERVER is not None:
+        WEB_SERVER.stop()
+        WEB_SERVER = None
+
+
+def start_web_app():
+    """Startet den Web-Server eigenständig ohne Telegram-Bot"""
+    start_web_server()
 
     try:
         IOLoop.current().start()
@@ -93,6 +134,15 @@ def start_web_app():
         logging.info("Web application stopped.")
     except Exception as e:
         logging.exception(f"Web application failed: {exception_and_traceback(e)}")
+    finally:
+        stop_web_server()
+        IOLoop.current().run_sync(CRAWLER_POOL.close)
+        IOLoop.current().run_sync(COOKBOOK_REINDEX.flush)
+        IOLoop.current().run_sync(NEXTCLOUD_CLIENTS.close)
+        EXECUTORS.shutdown()
+        HISTORY_BACKEND.close()
+        CRAWL_CACHE.flush()
+        EXTRACTION_CACHE.flush()
 
 
 if __name__ == "__main__":
@@ -1,7 +1,13 @@
+import os
 from pathlib import Path
 
 import pytest
 
+# Chat histories of the tests are not persisted into data/state
+os.environ.setdefault("CHAT_HISTORY_BACKEND", "memory")
+# CPU-bound work runs in threads, the tests do not start worker processes
+os.environ.setdefault("EXECUTOR_CPU_WORKERS", "0")
+
 OUTPUT_DIR = Path(__file__).parent.joinpath("data/output")
 
 # Example usage:
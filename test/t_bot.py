@@ -1,6 +1,14 @@
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import patch, AsyncMock
+
 import pytest
+from recipe_agent import bot
 from recipe_agent.agents import chat_agent
+from recipe_agent.agents.recipe_agent import ScrapeResult
 from recipe_agent.chat_history import ChatHistory
+from recipe_agent.page_reducer import count_tokens
+from recipe_agent.recipe import Recipe
 
 
 @pytest.mark.asyncio
@@ -82,3 +90,186 @@ def test_get_last_urls():
 
     # Both URLs should be found
     assert history.get_last_message_with_url(user) == urls
+
+
+def test_chat_history_evicts_least_recently_used_user():
+    history = ChatHistory(max_users=2)
+    history.add_user_message("a", "Hallo")
+    history.add_user_message("b", "Hallo")
+    history.get_messages("a")
+    history.add_user_message("c", "Hallo")
+
+    assert len(history.get_messages("a")) == 2
+    assert len(history.get_messages("c")) == 2
+    # -- b was the least recently used user
+    assert len(history.get_messages("b")) == 1
+
+
+@pytest.mark.asyncio
+async def test_chat_history_keeps_locked_conversations():
+    history = ChatHistory(max_users=1)
+    history.add_user_message("a", "Hallo")
+
+    async with history.lock("a"):
+        history.add_user_message("b", "Hallo")
+        assert len(history.get_messages("a")) == 2
+
+    assert history.lock("a") is history.lock("a")
+
+
+def _update():
+    return SimpleNamespace(effective_user=SimpleNamespace(first_name="Tester", id=1),
+                           message=SimpleNamespace(reply_text=AsyncMock(), reply_markdown_v2=AsyncMock()))
+
+
+@pytest.mark.asyncio
+async def test_process_recipe_cancels_slow_acknowledgement():
+    url, update, acknowledgement_cancelled = "https://example.com/gulasch", _update(), asyncio.Event()
+
+    async def _slow_acknowledgement(username, message, history):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            acknowledgement_cancelled.set()
+            raise
+
+    async def _scrape_recipes(urls, save, user, known_recipes=None):
+        yield ScrapeResult(url=url, recipe=Recipe(name="Gulasch", url=url))
+
+    with patch.object(bot.chat_agent, "answer_message_with_link", _slow_acknowledgement), \
+            patch.object(bot.recipe_agent, "scrape_recipes", _scrape_recipes), \
+            patch.object(bot, "to_telegram_md_recipe", lambda r: r.name):
+        await bot._process_recipe(update, [url], f"Schau mal {url}", just_save=False)
+
+    await asyncio.wait_for(acknowledgement_cancelled.wait(), 1.0)
+    update.message.reply_text.assert_not_awaited()
+    update.message.reply_markdown_v2.assert_awaited_once_with("Gulasch")
+
+
+@pytest.mark.asyncio
+async def test_process_recipe_templated_acknowledgement_when_llm_busy():
+    url, update, history = "https://example.com/gulasch", _update(), ChatHistory()
+    scraped = asyncio.Event()
+
+    async def _scrape_recipes(urls, save, user, known_recipes=None):
+        await scraped.wait()
+        yield ScrapeResult(url=url, error="Fehler")
+
+    with patch.object(bot, "BOT_AI_CHAT_HISTORY", history), \
+            patch.object(bot, "ACK_TEMPLATE_QUEUE_LENGTH", 0), \
+            patch.object(bot.recipe_agent, "scrape_recipes", _scrape_recipes):
+        task = asyncio.create_task(bot._process_recipe(update, [url], f"{url} !save", just_save=False))
+        await asyncio.sleep(0.01)
+        scraped.set()
+        await task
+
+    assert update.message.reply_text.await_args_list[0].args[0] == chat_agent.LINK_ACK_SAVE_RESPONSE
+    assert history.get_last_message_with_url("Tester") == [url]
+
+
+@pytest.mark.asyncio
+async def test_chat_history_token_budget_and_rolling_summary():
+    summarized, done = list(), asyncio.Event()
+
+    async def _summarizer(summary, messages):
+        summarized.extend(m["content"] for m in messages)
+        done.set()
+        return f"{summary} {len(messages)} Nachrichten".strip()
+
+    history = ChatHistory(max_tokens=30, summarizer=_summarizer, summary_batch_tokens=20)
+    history.add_user_message("Tester", "Gulasch " * 20)
+    history.add_assistant_response("Tester", "Lecker!")
+
+    await asyncio.wait_for(done.wait(), 1.0)
+    await asyncio.sleep(0)
+    messages = history.get_messages("Tester")
+
+    assert summarized == ["Gulasch " * 20]
+    assert messages[1] == {"role": "system", "content": "Bisheriger Gesprächsverlauf: 1 Nachrichten"}
+    assert messages[2:] == [{"role": "assistant", "content": "Lecker!"}]
+
+    # -- The newest message is always kept
+    history.add_user_message("Tester", "Kartoffel " * 50)
+    assert history.get_messages("Tester")[-1]["role"] == "user"
+
+
+@pytest.mark.asyncio
+async def test_chat_history_summarizes_in_batches():
+    calls = list()
+
+    async def _summarizer(summary, messages):
+        calls.append([m["content"] for m in messages])
+        return "Zusammenfassung"
+
+    history = ChatHistory(max_history_length=2, summarizer=_summarizer, summary_batch_tokens=10)
+    for i in range(8):
+        history.add_user_message("Tester", f"Nachricht {i}")
+        await asyncio.sleep(0)
+
+    # -- Every message evicts one from the window, the summarizer is called once per batch of evictions
+    assert 0 < len(calls) < 6
+    assert all(sum(count_tokens(m, history._model) for m in batch) >= 10 for batch in calls)
+
+
+@pytest.mark.asyncio
+async def test_chat_history_counts_tokens_off_the_event_loop():
+    history = ChatHistory(max_tokens=1000)
+    message = "Gulasch mit Spätzle und Rotkohl " * 10
+
+    with patch("recipe_agent.chat_history.count_tokens", wraps=count_tokens) as counter, \
+            patch("recipe_agent.chat_history.EXECUTORS.run_cpu", wraps=bot.EXECUTORS.run_cpu) as run_cpu:
+        history.add_user_message("Tester", message)
+        # -- Estimated until the executor has counted the message
+        assert counter.call_count == 0
+        await history._conversation("Tester").count_task
+
+    assert run_cpu.call_count == 1
+    assert list(history._conversation("Tester").tokens) == [count_tokens(message, history._model)]
+
+
+@pytest.mark.asyncio
+async def test_answer_message_with_dots_releases_stream_when_edit_fails():
+    from recipe_agent import openrouter_chat
+    from recipe_agent.llm_scheduler import LLM_SCHEDULER
+
+    async def _chunks():
+        for word in ("Kartoffeln ", "mit ", "Lauch"):
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=word))])
+
+    update = _update()
+    answer = SimpleNamespace(edit_text=AsyncMock(side_effect=RuntimeError("Message to edit not found")))
+    update.message.reply_text = AsyncMock(return_value=answer)
+
+    with patch.object(openrouter_chat, "acompletion", AsyncMock(return_value=_chunks())), \
+            patch.object(chat_agent.INTENT_ROUTER, "answer", return_value=None):
+        with pytest.raises(RuntimeError):
+            await bot.answer_message_with_dots(update, "Tester", "Was koche ich heute?", "Moment")
+
+        # -- Released without waiting for the garbage collector
+        assert not bot.BOT_AI_CHAT_HISTORY.lock("Tester").locked()
+        assert LLM_SCHEDULER.active == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_link_acknowledgement_completes_the_turn():
+    url, update, history = "https://example.com/gulasch", _update(), ChatHistory()
+
+    async def _slow_request(*args, **kwargs):
+        await asyncio.sleep(10)
+
+    async def _scrape_recipes(urls, save, user, known_recipes=None):
+        await asyncio.sleep(0.01)
+        yield ScrapeResult(url=url, recipe=Recipe(name="Gulasch", url=url))
+
+    with patch.object(bot, "BOT_AI_CHAT_HISTORY", history), \
+            patch.object(chat_agent.LLM_ROUTER, "request", _slow_request), \
+            patch.object(bot.recipe_agent, "scrape_recipes", _scrape_recipes), \
+            patch.object(bot, "to_telegram_md_recipe", lambda r: r.name):
+        await bot._process_recipe(update, [url], f"Schau mal {url} an", just_save=False)
+        await asyncio.sleep(0.01)
+
+    # -- The template acknowledgement answers the link message, the recipe follows
+    roles = [(m["role"], m["content"]) for m in history.get_messages("Tester")[1:]]
+    assert [role for role, _ in roles] == ["user", "assistant", "assistant"]
+    assert roles[1][1] == chat_agent.LINK_ACK_RESPONSE
+    assert history.get_last_message_with_url("Tester") == [url]
@@ -8,14 +8,18 @@ import asyncio
 import os
 import json
 from datetime import datetime
+from typing import Dict, List
 import pytest
-from unittest.mock import patch, AsyncMock, MagicMock
+from unittest.mock import patch, AsyncMock
 
 import httpx
 import dotenv
 
 from recipe_agent.io.nextcloud import NextcloudRecipe
-from recipe_agent.io.cookbook_api import NextcloudCookbookAPI, upload_recipe
+from recipe_agent.io.nextcloud_client import NextcloudClients
+from recipe_agent.io.cookbook_urls import CookbookUrls
+from recipe_agent.io.cookbook_api import (NextcloudCookbookAPI, CookbookIndex, IndexEntry, ReindexCoordinator,
+                                          upload_recipe)
 from recipe_agent.recipe import Recipe
 
 
@@ -102,28 +106,29 @@ def sample_recipe(sample_recipe_data):
 
 
 @pytest.fixture
-def api_client(mock_env_vars):
+def api_client(mock_env_vars, nextcloud):
     """Fixture, das eine Instanz des API-Clients zurückgibt"""
-    return NextcloudCookbookAPI()
+    return NextcloudCookbookAPI(clients=NextcloudClients(transport=httpx.MockTransport(nextcloud.handler)))
 
 
-class MockResponse:
-    """Mock für httpx.Response Objekte"""
-    def __init__(self, status_code, json_data=None, text=None):
-        self.status_code = status_code
-        self._json_data = json_data
-        self.text = text or json.dumps(json_data) if json_data else ""
+class MockNextcloud:
+    """Beantwortet die Anfragen der geteilten Clients ohne Netzwerk"""
+    def __init__(self):
+        self.requests: List[httpx.Request] = list()
+        self.responses: Dict[str, httpx.Response] = dict()
 
-    def json(self):
-        return self._json_data
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        return self.responses.get(request.method, httpx.Response(404, text="Not Found"))
 
-    def raise_for_status(self):
-        if self.status_code >= 400:
-            raise httpx.HTTPStatusError(
-                "Mock HTTP error",
-                request=httpx.Request("GET", "https://example.com"),
-                response=self
-            )
+    def posted_json(self, index: int = -1):
+        return json.loads(self.requests[index].content)
+
+
+@pytest.fixture
+def nextcloud():
+    """Fixture für einen Transport, der Nextcloud ersetzt"""
+    return MockNextcloud()
 
 
 @pytest.mark.asyncio
@@ -147,158 +152,137 @@ async def test_init(mock_env_vars):
 
 
 @pytest.mark.asyncio
-async def test_get_all_recipes(api_client):
+async def test_get_all_recipes(api_client, nextcloud):
     """Test für die get_all_recipes Methode"""
     mock_recipes = [
         {"id": 1, "name": "Rezept 1"},
         {"id": 2, "name": "Rezept 2"}
     ]
+    nextcloud.responses["GET"] = httpx.Response(200, json=mock_recipes)
 
-    with patch("httpx.AsyncClient") as mock_client:
-        mock_instance = AsyncMock()
-        mock_instance.get.return_value = MockResponse(200, mock_recipes)
-        mock_client.return_value.__aenter__.return_value = mock_instance
+    result = await api_client.get_all_recipes()
 
-        result = await api_client.get_all_recipes()
+    # Überprüfen, ob die Methode die erwarteten Daten zurückgibt
+    assert result == mock_recipes
 
-        # Überprüfen, ob die Methode die erwarteten Daten zurückgibt
-        assert result == mock_recipes
-
-        # Überprüfen, ob die richtige URL aufgerufen wurde
-        mock_instance.get.assert_called_once_with(api_client.recipes_endpoint)
+    # Überprüfen, ob die richtige URL aufgerufen wurde
+    assert len(nextcloud.requests) == 1
+    assert str(nextcloud.requests[0].url) == api_client.recipes_endpoint
 
 
 @pytest.mark.asyncio
-async def test_get_recipe(api_client, sample_recipe_data):
+async def test_get_recipe(api_client, nextcloud, sample_recipe_data):
     """Test für die get_recipe Methode"""
     recipe_id = 123
+    nextcloud.responses["GET"] = httpx.Response(200, json=sample_recipe_data)
 
-    with patch("httpx.AsyncClient") as mock_client:
-        mock_instance = AsyncMock()
-        mock_instance.get.return_value = MockResponse(200, sample_recipe_data)
-        mock_client.return_value.__aenter__.return_value = mock_instance
-
-        result = await api_client.get_recipe(recipe_id)
+    result = await api_client.get_recipe(recipe_id)
 
-        # Überprüfen, ob die Methode die erwarteten Daten zurückgibt
-        assert result == sample_recipe_data
+    # Überprüfen, ob die Methode die erwarteten Daten zurückgibt
+    assert result == sample_recipe_data
 
-        # Überprüfen, ob die richtige URL aufgerufen wurde
-        mock_instance.get.assert_called_once_with(f"{api_client.recipes_endpoint}/{recipe_id}")
+    # Überprüfen, ob die richtige URL aufgerufen wurde
+    assert len(nextcloud.requests) == 1
+    assert str(nextcloud.requests[0].url) == f"{api_client.recipes_endpoint}/{recipe_id}"
 
 
 @pytest.mark.asyncio
-async def test_get_recipe_not_found(api_client):
+async def test_get_recipe_not_found(api_client, nextcloud):
     """Test für die get_recipe Methode, wenn das Rezept nicht gefunden wird"""
-    recipe_id = 999
+    result = await api_client.get_recipe(999)
 
-    with patch("httpx.AsyncClient") as mock_client:
-        mock_instance = AsyncMock()
-        mock_response = MockResponse(404)
-        mock_instance.get.return_value = mock_response
-        mock_response.raise_for_status = MagicMock(side_effect=httpx.HTTPStatusError(
-            "Not Found",
-            request=httpx.Request("GET", f"{api_client.recipes_endpoint}/{recipe_id}"),
-            response=mock_response
-        ))
-        mock_client.return_value.__aenter__.return_value = mock_instance
-
-        result = await api_client.get_recipe(recipe_id)
-
-        # Überprüfen, ob die Methode None zurückgibt
-        assert result is None
+    # Überprüfen, ob die Methode None zurückgibt
+    assert result is None
 
 
 @pytest.mark.asyncio
-async def test_create_recipe(api_client, sample_recipe, sample_recipe_data):
+async def test_create_recipe(api_client, nextcloud, sample_recipe, sample_recipe_data):
     """Test für die create_recipe Methode mit einem Recipe-Objekt"""
-    with patch("httpx.AsyncClient") as mock_client:
-        mock_instance = AsyncMock()
-        mock_instance.post.return_value = MockResponse(201, sample_recipe_data)
-        mock_client.return_value.__aenter__.return_value = mock_instance
+    nextcloud.responses["POST"] = httpx.Response(201, json=sample_recipe_data)
 
-        result = await api_client.create_recipe(sample_recipe)
+    result = await api_client.create_recipe(sample_recipe)
 
-        # Überprüfen, ob die Methode die erwarteten Daten zurückgibt
-        assert result == sample_recipe_data
+    # Überprüfen, ob die Methode die erwarteten Daten zurückgibt
+    assert result == sample_recipe_data
 
-        # Überprüfen, ob post mit den richtigen Daten aufgerufen wurde
-        mock_instance.post.assert_called_once()
-        # Extrahiere die Argumente des ersten Aufrufs
-        call_args = mock_instance.post.call_args
-        assert call_args[0][0] == api_client.recipes_endpoint
+    # Überprüfen, ob post mit den richtigen Daten aufgerufen wurde
+    assert len(nextcloud.requests) == 1
+    assert str(nextcloud.requests[0].url) == api_client.recipes_endpoint
 
-        # Überprüfen, ob die JSON-Daten korrekt sind
-        # Die Daten könnten in einer anderen Reihenfolge sein, daher vergleichen wir den Inhalt
-        posted_data = call_args[1]['json']
-        assert posted_data["name"] == sample_recipe.name
-        assert posted_data["id"] == sample_recipe.id
-        assert posted_data["recipeIngredient"] == sample_recipe.recipe_ingredient
+    # Überprüfen, ob die JSON-Daten korrekt sind
+    # Die Daten könnten in einer anderen Reihenfolge sein, daher vergleichen wir den Inhalt
+    posted_data = nextcloud.posted_json()
+    assert posted_data["name"] == sample_recipe.name
+    assert posted_data["id"] == sample_recipe.id
+    assert posted_data["recipeIngredient"] == sample_recipe.recipe_ingredient
 
 
 @pytest.mark.asyncio
-async def test_create_recipe_with_dict(api_client, sample_recipe_data):
+async def test_create_recipe_with_dict(api_client, nextcloud, sample_recipe_data):
     """Test für die create_recipe Methode mit einem Dictionary"""
-    with patch("httpx.AsyncClient") as mock_client:
-        mock_instance = AsyncMock()
-        mock_instance.post.return_value = MockResponse(201, sample_recipe_data)
-        mock_client.return_value.__aenter__.return_value = mock_instance
+    expected = dict(sample_recipe_data)
+    nextcloud.responses["POST"] = httpx.Response(201, json=expected)
 
-        result = await api_client.create_recipe(sample_recipe_data)
+    result = await api_client.create_recipe(sample_recipe_data)
 
-        # Überprüfen, ob die Methode die erwarteten Daten zurückgibt
-        assert result == sample_recipe_data
+    # Überprüfen, ob die Methode die erwarteten Daten zurückgibt
+    assert result == expected
 
-        # Überprüfen, ob post mit den richtigen Daten aufgerufen wurde
-        mock_instance.post.assert_called_once_with(api_client.recipes_endpoint, json=sample_recipe_data)
+    # Überprüfen, ob post mit den richtigen Daten aufgerufen wurde
+    assert len(nextcloud.requests) == 1
+    assert nextcloud.posted_json() == sample_recipe_data
 
 
 @pytest.mark.asyncio
-async def test_create_recipe_error(api_client, sample_recipe):
+async def test_create_recipe_error(api_client, nextcloud, sample_recipe):
     """Test für die create_recipe Methode bei einem Fehler"""
-    with patch("httpx.AsyncClient") as mock_client:
-        mock_instance = AsyncMock()
-        mock_response = MockResponse(400, {"error": "Bad Request"})
-        mock_instance.post.return_value = mock_response
-        mock_response.raise_for_status = MagicMock(side_effect=httpx.HTTPStatusError(
-            "Bad Request",
-            request=httpx.Request("POST", api_client.recipes_endpoint),
-            response=mock_response
-        ))
-        mock_client.return_value.__aenter__.return_value = mock_instance
+    nextcloud.responses["POST"] = httpx.Response(400, json={"error": "Bad Request"})
 
-        result = await api_client.create_recipe(sample_recipe)
+    result = await api_client.create_recipe(sample_recipe)
 
-        # Überprüfen, ob die Methode None zurückgibt
-        assert result is None
+    # Überprüfen, ob die Methode None zurückgibt
+    assert result is None
 
 
 @pytest.mark.asyncio
-async def test_update_recipe(api_client, sample_recipe, sample_recipe_data):
+async def test_update_recipe(api_client, nextcloud, sample_recipe, sample_recipe_data):
     """Test für die update_recipe Methode"""
     recipe_id = 123
+    nextcloud.responses["PUT"] = httpx.Response(200, json=sample_recipe_data)
+
+    result = await api_client.update_recipe(recipe_id, sample_recipe)
 
-    with patch("httpx.AsyncClient") as mock_client:
-        mock_instance = AsyncMock()
-        mock_instance.put.return_value = MockResponse(204, sample_recipe_data)
-        mock_client.return_value.__aenter__.return_value = mock_instance
+    # Überprüfen, ob die Methode die erwarteten Daten zurückgibt
+    assert result == sample_recipe_data
 
-        result = await api_client.update_recipe(recipe_id, sample_recipe)
+    # Überprüfen, ob put mit den richtigen Daten aufgerufen wurde
+    assert len(nextcloud.requests) == 1
+    assert str(nextcloud.requests[0].url) == f"{api_client.recipes_endpoint}/{recipe_id}"
 
-        # Überprüfen, ob die Methode die erwarteten Daten zurückgibt
-        assert result == sample_recipe_data
+    # Überprüfen, ob die JSON-Daten korrekt sind und die ID überschrieben wurde
+    posted_data = nextcloud.posted_json()
+    assert posted_data["name"] == sample_recipe.name
+    assert posted_data["id"] == recipe_id  # Die ID sollte auf die angegebene ID gesetzt werden
+    assert posted_data["recipeIngredient"] == sample_recipe.recipe_ingredient
 
-        # Überprüfen, ob put mit den richtigen Daten aufgerufen wurde
-        mock_instance.put.assert_called_once()
-        # Extrahiere die Argumente des ersten Aufrufs
-        call_args = mock_instance.put.call_args
-        assert call_args[0][0] == f"{api_client.recipes_endpoint}/{recipe_id}"
 
-        # Überprüfen, ob die JSON-Daten korrekt sind und die ID überschrieben wurde
-        posted_data = call_args[1]['json']
-        assert posted_data["name"] == sample_recipe.name
-        assert posted_data["id"] == recipe_id  # Die ID sollte auf die angegebene ID gesetzt werden
-        assert posted_data["recipeIngredient"] == sample_recipe.recipe_ingredient
+@pytest.mark.asyncio
+async def test_shared_client(api_client, nextcloud):
+    """Alle Anfragen an eine Nextcloud-Instanz verwenden denselben Client"""
+    nextcloud.responses["GET"] = httpx.Response(200, json=[])
+    other_api = NextcloudCookbookAPI(clients=api_client._clients)
+
+    await api_client.get_all_recipes()
+    await other_api.get_all_recipes()
+
+    assert api_client.client is other_api.client
+    assert nextcloud.requests[0].headers["authorization"] == nextcloud.requests[1].headers["authorization"]
+
+    # -- Nach dem Schließen wird beim nächsten Zugriff ein neuer Client erstellt
+    client = api_client.client
+    await api_client._clients.close()
+    assert client.is_closed
+    assert not api_client.client.is_closed
 
 
 @pytest.mark.asyncio
@@ -393,3 +377,229 @@ async def test_missing_credentials_update_recipe(sample_recipe):
 
     # Überprüfen, ob None zurückgegeben wird
     assert result is None
+
+
+@pytest.fixture
+def cookbook_index(api_client, tmp_path):
+    """Fixture mit einem Rezept-Index über einer API ohne Netzwerk"""
+    api_client._fetch_all_recipes = AsyncMock(return_value=[
+        {"recipe_id": 1, "name": "Testrezept", "dateModified": "2024-07-06T12:00:00"},
+        {"recipe_id": 2, "name": "Gulasch", "dateModified": "2024-07-06T12:00:00"},
+    ])
+    api_client.create_recipe = AsyncMock(return_value=3)
+    api_client.update_recipe = AsyncMock(return_value=1)
+    return CookbookIndex(api_client, urls=CookbookUrls(tmp_path / "cookbook_urls.sqlite"))
+
+
+@pytest.mark.asyncio
+async def test_cookbook_index_updates_existing_recipe(cookbook_index, sample_recipe):
+    """Ein bestehendes Rezept wird ohne erneutes Abrufen der Liste aktualisiert"""
+    sample_recipe.name = "  testREZEPT "
+    assert await cookbook_index.save(sample_recipe)
+    assert await cookbook_index.save(sample_recipe)
+
+    cookbook_index.api._fetch_all_recipes.assert_awaited_once()
+    cookbook_index.api.update_recipe.assert_awaited_with("1", sample_recipe)
+    cookbook_index.api.create_recipe.assert_not_awaited()
+    assert sample_recipe.id == "1"
+
+
+@pytest.mark.asyncio
+async def test_cookbook_index_creates_and_indexes_recipe(cookbook_index, sample_recipe):
+    """Neu angelegte Rezepte werden über ihre Url gefunden, auch nach einer Umbenennung"""
+    sample_recipe.name = "Neues Rezept"
+    assert await cookbook_index.save(sample_recipe)
+    cookbook_index.api.create_recipe.assert_awaited_once()
+
+    renamed = sample_recipe.model_copy(update={"name": "Neues Rezept 2"})
+    assert await cookbook_index.save(renamed)
+    cookbook_index.api.update_recipe.assert_awaited_once_with("3", renamed)
+    assert len(cookbook_index) == 3
+
+
+@pytest.mark.asyncio
+async def test_cookbook_index_refresh_removes_deleted_recipes(cookbook_index, sample_recipe):
+    """Beim Abgleich werden gelöschte Rezepte entfernt, bekannte Urls bleiben erhalten"""
+    await cookbook_index.ensure_loaded()
+    cookbook_index.put(IndexEntry("1", "Testrezept", sample_recipe.url, "2024-07-06T12:00:00"))
+    cookbook_index.api._fetch_all_recipes.return_value = [
+        {"recipe_id": 1, "name": "Testrezept", "dateModified": "2024-07-07T12:00:00"},
+    ]
+
+    assert await cookbook_index.refresh()
+
+    assert len(cookbook_index) == 1
+    assert cookbook_index.lookup(sample_recipe.model_copy(update={"name": "Anderer Name"})).id == "1"
+
+
+@pytest.mark.asyncio
+async def test_cookbook_index_failed_bootstrap_is_retried(cookbook_index, sample_recipe):
+    """Schlägt der Aufbau fehl, wird der Index nicht als geladen markiert"""
+    cookbook_index.api._fetch_all_recipes.side_effect = httpx.ConnectError("offline")
+    assert not await cookbook_index.refresh()
+
+    cookbook_index.api._fetch_all_recipes.side_effect = None
+    await cookbook_index.save(sample_recipe)
+    cookbook_index.api.update_recipe.assert_awaited_once_with("1", sample_recipe)
+
+
+@pytest.mark.asyncio
+async def test_cookbook_index_failed_update_does_not_duplicate(cookbook_index, sample_recipe):
+    """Nach einem fehlgeschlagenen Update wird vor der nächsten Suche abgeglichen statt neu angelegt"""
+    sample_recipe.name = "Gulasch"
+    cookbook_index.api.update_recipe.return_value = None
+    assert not await cookbook_index.save(sample_recipe)
+
+    cookbook_index.api.update_recipe.return_value = 1
+    assert await cookbook_index.save(sample_recipe)
+    cookbook_index.api.create_recipe.assert_not_awaited()
+    assert cookbook_index.api.update_recipe.await_count == 2
+    assert cookbook_index.api._fetch_all_recipes.await_count == 2
+
+    # -- Wurde das Rezept im Kochbuch gelöscht, legt der Abgleich vor dem nächsten Speichern es neu an
+    cookbook_index.api.update_recipe.return_value = None
+    assert not await cookbook_index.save(sample_recipe)
+    cookbook_index.api._fetch_all_recipes.return_value = [
+        {"recipe_id": 1, "name": "Testrezept", "dateModified": "2024-07-06T12:00:00"},
+    ]
+    assert await cookbook_index.save(sample_recipe)
+    cookbook_index.api.create_recipe.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_cookbook_index_refresh_keeps_recipes_saved_meanwhile(cookbook_index, sample_recipe):
+    """Ein während des Abrufs der Liste angelegtes Rezept bleibt im Index"""
+    await cookbook_index.ensure_loaded()
+    listing = cookbook_index.api._fetch_all_recipes.return_value
+    fetching, release = asyncio.Event(), asyncio.Event()
+
+    async def _slow_fetch():
+        fetching.set()
+        await release.wait()
+        return listing
+
+    cookbook_index.api._fetch_all_recipes = _slow_fetch
+    refresh = asyncio.create_task(cookbook_index.refresh())
+    await fetching.wait()
+
+    new_recipe = sample_recipe.model_copy(update={"name": "Neu", "url": "https://example.com/neu"})
+    assert await cookbook_index.save(new_recipe)
+    release.set()
+    assert await refresh
+
+    assert cookbook_index.lookup(new_recipe).id == "3"
+    assert await cookbook_index.save(new_recipe)
+    cookbook_index.api.create_recipe.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_cookbook_index_finds_saved_urls_after_restart(cookbook_index, sample_recipe):
+    """Die Quell-Urls eigener Speicherungen überstehen einen Neustart, gelöschte Rezepte werden vergessen"""
+    sample_recipe.name = "Neues Rezept"
+    assert await cookbook_index.save(sample_recipe)
+
+    restarted = CookbookIndex(cookbook_index.api, urls=CookbookUrls(cookbook_index._urls._path))
+    restarted.api._fetch_all_recipes.return_value = [
+        {"recipe_id": 1, "name": "Testrezept", "dateModified": "2024-07-06T12:00:00"},
+        {"recipe_id": 3, "name": "Umbenannt", "dateModified": "2024-07-06T12:00:00"},
+    ]
+    assert await restarted.save(sample_recipe.model_copy(update={"name": "Anderer Name"}))
+    restarted.api.create_recipe.assert_awaited_once()
+    assert restarted.api.update_recipe.await_args.args[0] == "3"
+
+    restarted.api._fetch_all_recipes.return_value = [
+        {"recipe_id": 1, "name": "Testrezept", "dateModified": "2024-07-06T12:00:00"},
+    ]
+    assert await restarted.refresh()
+    assert CookbookUrls(cookbook_index._urls._path).load() == dict()
+
+
+@pytest.mark.asyncio
+async def test_cookbook_index_saves_different_recipes_concurrently(cookbook_index, sample_recipe):
+    """Nur Speicherungen mit gleichem Namen oder gleicher Url warten aufeinander"""
+    await cookbook_index.ensure_loaded()
+    running, most_running = 0, 0
+
+    async def _slow_create(recipe):
+        nonlocal running, most_running
+        running += 1
+        most_running = max(most_running, running)
+        await asyncio.sleep(0.05)
+        running -= 1
+        return 10 + len(recipe.name)
+
+    cookbook_index.api.create_recipe = _slow_create
+    first = sample_recipe.model_copy(update={"name": "Erstes", "url": "https://example.com/erstes"})
+    second = sample_recipe.model_copy(update={"name": "Zweites Rezept", "url": "https://example.com/zweites"})
+    duplicate = first.model_copy(update={"name": "Erstes umbenannt"})
+    assert all(await asyncio.gather(*[cookbook_index.save(r) for r in (first, second, duplicate)]))
+
+    assert most_running == 2
+    cookbook_index.api.update_recipe.assert_awaited_once_with("16", duplicate)
+
+
+@pytest.fixture
+def reindex(api_client):
+    """Fixture mit einem Reindex-Koordinator über einer API ohne Netzwerk"""
+    api_client.reindex = AsyncMock(return_value=True)
+    return ReindexCoordinator(api_client, quiet_window=0.05, max_delay=0.2)
+
+
+@pytest.mark.asyncio
+async def test_reindex_coalesces_burst(reindex):
+    """Viele Speicherungen innerhalb des Ruhefensters lösen eine Reindexierung aus"""
+    for _ in range(5):
+        reindex.request()
+        await asyncio.sleep(0.01)
+    reindex.api.reindex.assert_not_awaited()
+
+    await asyncio.sleep(0.1)
+    reindex.api.reindex.assert_awaited_once()
+    assert not reindex.pending
+
+
+@pytest.mark.asyncio
+async def test_reindex_max_delay(reindex):
+    """Ununterbrochene Speicherungen werden spätestens nach der maximalen Verzögerung reindexiert"""
+    for _ in range(12):
+        reindex.request()
+        await asyncio.sleep(0.03)
+
+    assert reindex.api.reindex.await_count >= 1
+    assert reindex.runs < reindex.requests
+
+
+@pytest.mark.asyncio
+async def test_reindex_one_at_a_time(reindex):
+    """Anfragen während einer laufenden Reindexierung führen zu genau einer weiteren"""
+    started, release, running = asyncio.Event(), asyncio.Event(), list()
+
+    async def slow_reindex():
+        running.append(1)
+        assert len(running) == 1
+        started.set()
+        await release.wait()
+        running.pop()
+        return True
+
+    reindex.api.reindex = AsyncMock(side_effect=slow_reindex)
+    reindex.request()
+    await asyncio.wait_for(started.wait(), 1.0)
+    reindex.request()
+    reindex.request()
+    release.set()
+
+    await reindex.flush()
+    assert reindex.api.reindex.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_reindex_flush(reindex):
+    """Beim Herunterfahren werden offene Anfragen sofort ausgeführt"""
+    reindex.quiet_window = reindex.max_delay = 60.0
+    reindex.request()
+
+    await asyncio.wait_for(reindex.flush(), 1.0)
+
+    reindex.api.reindex.assert_awaited_once()
+    assert not reindex.pending
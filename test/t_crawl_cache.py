@@ -0,0 +1,89 @@
+import time
+from unittest.mock import patch, AsyncMock, MagicMock
+
+import pytest
+
+from recipe_agent import crawl_cache
+from recipe_agent.crawl_cache import CrawlCache, CrawledPage, crawl_page
+from recipe_agent.recipe_config import CRAWL_CONFIG
+
+
+def _page(url: str, markdown: str = "# Rezept") -> CrawledPage:
+    return CrawledPage(url=url, final_url=url, markdown=markdown)
+
+
+def test_cache_get_put(tmp_path):
+    cache = CrawlCache(tmp_path / "cache.sqlite", ttl=60, max_bytes=1024 * 1024)
+    cache.put("a", _page("https://example.com/a"))
+
+    assert cache.get("a").markdown == "# Rezept"
+    assert cache.get("b") is None
+
+
+def test_cache_ttl(tmp_path):
+    cache = CrawlCache(tmp_path / "cache.sqlite", ttl=60, max_bytes=1024 * 1024)
+    page = _page("https://example.com/a")
+    page.fetched_at = time.time() - 120
+    cache.put("a", page)
+
+    assert cache.get("a") is None
+
+
+def test_cache_lru_eviction(tmp_path):
+    entry_size = len(_page("https://example.com/a", "x" * 500).model_dump_json())
+    cache = CrawlCache(tmp_path / "cache.sqlite", ttl=60, max_bytes=entry_size * 2 + 10)
+
+    cache.put("a", _page("https://example.com/a", "x" * 500))
+    cache.put("b", _page("https://example.com/b", "x" * 500))
+    # -- Touch a so b becomes the least recently used entry
+    assert cache.get("a") is not None
+    cache.put("c", _page("https://example.com/c", "x" * 500))
+
+    assert cache.get("a") is not None
+    assert cache.get("b") is None
+    assert cache.get("c") is not None
+    assert cache.size() <= cache.max_bytes
+
+
+@pytest.mark.asyncio
+async def test_crawl_page_uses_cache(tmp_path):
+    result = MagicMock(success=True, markdown="# Gulasch", media={"images": []}, redirected_url=None,
+                       url="https://example.com/gulasch", html="")
+    arun = AsyncMock(return_value=result)
+
+    with patch.object(crawl_cache, "CRAWL_CACHE", CrawlCache(tmp_path / "cache.sqlite", ttl=60, max_bytes=1024 * 1024)), \
+            patch.object(crawl_cache.CRAWLER_POOL, "arun", arun):
+        first = await crawl_page("https://example.com/gulasch", CRAWL_CONFIG.clone())
+        second = await crawl_page("https://example.com/gulasch", CRAWL_CONFIG.clone())
+
+    assert first.markdown == second.markdown == "# Gulasch"
+    assert first.content_hash == second.content_hash
+    arun.assert_awaited_once()
+
+
+def test_cache_get_does_not_write(tmp_path):
+    cache = CrawlCache(tmp_path / "cache.sqlite", ttl=60, max_bytes=1024 * 1024)
+    cache.put("a", _page("https://example.com/a"))
+
+    with patch.object(cache, "_write_touches", wraps=cache._write_touches) as write_touches:
+        assert cache.get("a") is not None
+        write_touches.assert_not_called()
+
+        # -- Collected access times are written after the interval
+        cache.touch_interval = 0
+        assert cache.get("a") is not None
+        write_touches.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_crawl_page_keeps_structured_data(tmp_path):
+    page_html = '<script type="application/ld+json">{"@type": "Recipe", "name": "Gulasch"}</script>'
+    result = MagicMock(success=True, markdown="# Gulasch", media={"images": []}, redirected_url=None,
+                       url="https://example.com/gulasch", html=page_html)
+
+    with patch.object(crawl_cache, "CRAWL_CACHE", CrawlCache(tmp_path / "cache.sqlite", ttl=60, max_bytes=1024 * 1024)), \
+            patch.object(crawl_cache.CRAWLER_POOL, "arun", AsyncMock(return_value=result)):
+        await crawl_page("https://example.com/gulasch", CRAWL_CONFIG.clone())
+        cached = await crawl_page("https://example.com/gulasch", CRAWL_CONFIG.clone())
+
+    assert cached.structured_data == {"@type": "Recipe", "name": "Gulasch"}
@@ -0,0 +1,92 @@
+import asyncio
+import subprocess
+import sys
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import psutil
+
+import pytest
+
+from recipe_agent.crawler_pool import CrawlerPool, _browser_rss_mb
+
+
+class FakeCrawler:
+    """ Stands in for AsyncWebCrawler so no browser is launched """
+    instances = list()
+
+    def __init__(self, config=None):
+        self.started, self.closed, self.running = False, False, 0
+        self.max_running = 0
+        FakeCrawler.instances.append(self)
+
+    async def start(self):
+        self.started = True
+
+    async def close(self):
+        self.closed = True
+
+    async def arun(self, url, config=None):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        return url
+
+
+@pytest.fixture
+def fake_crawler():
+    FakeCrawler.instances = list()
+    with patch("recipe_agent.crawler_pool.AsyncWebCrawler", FakeCrawler):
+        yield FakeCrawler
+
+
+@pytest.mark.asyncio
+async def test_pool_reuses_browser(fake_crawler):
+    pool = CrawlerPool(max_concurrency=2, max_pages=0, max_rss_mb=0)
+    await pool.start()
+
+    results = await asyncio.gather(*[pool.arun(f"https://example.com/{i}", None) for i in range(6)])
+
+    assert results == [f"https://example.com/{i}" for i in range(6)]
+    assert len(fake_crawler.instances) == 1
+    assert fake_crawler.instances[0].max_running <= 2
+
+    await pool.close()
+    assert fake_crawler.instances[0].closed
+    assert not pool.running
+
+
+@pytest.mark.asyncio
+async def test_pool_recycles_after_max_pages(fake_crawler):
+    pool = CrawlerPool(max_concurrency=1, max_pages=2, max_rss_mb=0)
+
+    for i in range(5):
+        await pool.arun(f"https://example.com/{i}", None)
+
+    assert len(fake_crawler.instances) == 3
+    assert all(c.closed for c in fake_crawler.instances[:2])
+
+    await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_pool_measures_only_the_browser_processes(fake_crawler):
+    sleep = [sys.executable, "-c", "import time; time.sleep(30)"]
+    browser, unrelated = subprocess.Popen(sleep), subprocess.Popen(sleep)
+    await asyncio.sleep(0.5)
+    try:
+        with patch.object(FakeCrawler, "crawler_strategy", SimpleNamespace(browser_manager=SimpleNamespace(
+                playwright=None, managed_browser=SimpleNamespace(browser_process=browser))), create=True):
+            pool = CrawlerPool(max_concurrency=1, max_pages=0, max_rss_mb=100000)
+            await pool.arun("https://example.com/", None)
+
+        # -- Other child processes, eg. process pool workers, are not counted
+        assert pool._browser_pids == [browser.pid]
+        expected = psutil.Process(browser.pid).memory_info().rss / (1024 * 1024)
+        assert _browser_rss_mb(pool._browser_pids) == pytest.approx(expected, rel=0.1)
+        assert len(fake_crawler.instances) == 1
+        await pool.close()
+    finally:
+        browser.kill()
+        unrelated.kill()
@@ -0,0 +1,59 @@
+import math
+import threading
+
+import pytest
+
+from recipe_agent.executors import Executors
+from recipe_agent.utils import clean_markdown
+
+
+@pytest.mark.asyncio
+async def test_run_cpu_in_process_pool():
+    executors = Executors(cpu_workers=1, io_workers=1)
+    try:
+        assert await executors.run_cpu(math.factorial, 20) == math.factorial(20)
+        assert await executors.run_cpu(clean_markdown, "[Gulasch](https://example.com) | 500 g") == "Gulasch 500 g"
+    finally:
+        executors.shutdown()
+    assert executors.stats()["cpu"]["completed"] == 2
+
+
+@pytest.mark.asyncio
+async def test_run_io_and_queue_depth():
+    executors = Executors(cpu_workers=0, io_workers=1)
+    release = threading.Event()
+    try:
+        futures = [executors.submit_io(release.wait) for _ in range(3)]
+        stats = executors.stats()["io"]
+        assert stats["pending"] == 3
+        assert stats["queued"] == 2
+
+        release.set()
+        assert all(future.result(timeout=5) for future in futures)
+        # -- Without processes the CPU-bound work runs in the thread pool
+        assert await executors.run_cpu(sum, [1, 2, 3]) == 6
+    finally:
+        executors.shutdown()
+
+    assert executors.stats() == {
+        "cpu": {"workers": 1, "pending": 0, "queued": 0, "max_pending": 1, "completed": 1},
+        "io": {"workers": 1, "pending": 0, "queued": 0, "max_pending": 3, "completed": 3},
+    }
+
+
+def test_cpu_work_in_threads_is_queued_behind_io():
+    executors = Executors(cpu_workers=0, io_workers=2)
+    release = threading.Event()
+    try:
+        io_futures = [executors.submit_io(release.wait) for _ in range(2)]
+        cpu_futures = [executors.submit_cpu(release.wait) for _ in range(3)]
+        stats = executors.stats()
+        # -- The I/O tasks occupy both threads, all CPU-bound tasks wait for them in the same queue
+        assert stats["cpu"]["workers"] == 2
+        assert stats["cpu"]["queued"] == stats["io"]["queued"] == 3
+
+        release.set()
+        assert all(future.result(timeout=5) for future in io_futures + cpu_futures)
+    finally:
+        executors.shutdown()
+    assert executors.stats()["cpu"]["queued"] == 0
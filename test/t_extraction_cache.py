@@ -0,0 +1,85 @@
+import json
+from unittest.mock import patch, AsyncMock
+
+import pytest
+
+from recipe_agent import model_router
+from recipe_agent.agents import recipe_agent
+from recipe_agent.extraction_cache import ExtractionCache
+from recipe_agent.recipe import RecipeLLM
+
+RECIPE_LLM_DATA = {
+    "name": "Rindergulasch",
+    "url": "https://example.com/gulasch",
+    "image_url": "",
+    "description": "Herzhafter Rindergulasch",
+    "recipeIngredient": ["720g Rinderbraten", "2 Zwiebeln"],
+    "recipeInstructions": ["Anbraten", "Schmoren"],
+    "prepTime": "PT0H30M0S",
+    "cookTime": "PT1H30M0S",
+    "totalTime": "PT2H0M0S",
+    "keywords": ["Gulasch"]
+}
+
+
+def test_extraction_cache_key():
+    key = ExtractionCache.key("model", {"type": "object"}, "instruction", "# Gulasch")
+
+    assert key == ExtractionCache.key("model", {"type": "object"}, "instruction", "# Gulasch")
+    assert key != ExtractionCache.key("other-model", {"type": "object"}, "instruction", "# Gulasch")
+    assert key != ExtractionCache.key("model", {"type": "object"}, "instruction", "# Gulasch!")
+
+
+def test_extraction_cache_get_put_invalidate(tmp_path):
+    cache = ExtractionCache(tmp_path / "cache.sqlite", max_entries=2)
+
+    assert cache.get("a") is None
+    cache.put("a", RecipeLLM(**RECIPE_LLM_DATA), "https://example.com/a", "model")
+    cache.put("b", RecipeLLM(**RECIPE_LLM_DATA), "https://example.com/b", "model")
+
+    assert cache.get("a").recipe_ingredient == RECIPE_LLM_DATA["recipeIngredient"]
+    # -- b is the least recently used entry and evicted
+    cache.put("c", RecipeLLM(**RECIPE_LLM_DATA), "https://example.com/c", "model")
+    assert cache.get("b") is None
+
+    assert cache.stats() == {"entries": 2, "hits": 1, "misses": 2}
+    # -- Counted in the database, eg. for the stats command in another process
+    cache.flush()
+    assert ExtractionCache(tmp_path / "cache.sqlite").stats() == {"entries": 2, "hits": 1, "misses": 2}
+    # -- Urls are compared normalized
+    assert cache.invalidate("https://Example.com/a/?utm_source=newsletter") == 1
+    assert cache.invalidate() == 1
+
+
+@pytest.mark.asyncio
+async def test_process_with_openrouter_uses_cache(tmp_path):
+    chat_request = AsyncMock(return_value=json.dumps(RECIPE_LLM_DATA))
+
+    with patch.object(recipe_agent, "EXTRACTION_CACHE", ExtractionCache(tmp_path / "cache.sqlite")), \
+            patch.object(model_router, "openrouter_chat_request", chat_request):
+        first = await recipe_agent.process_with_openrouter("# Gulasch", "https://example.com/gulasch")
+        second = await recipe_agent.process_with_openrouter("# Gulasch", "https://example.com/gulasch-2")
+
+    chat_request.assert_awaited_once()
+    assert json.loads(first)["name"] == json.loads(second)["name"] == "Rindergulasch"
+    assert json.loads(second)["url"] == "https://example.com/gulasch-2"
+
+
+@pytest.mark.asyncio
+async def test_process_with_openrouter_caches_the_answering_model(tmp_path):
+    async def _chat_request(model, messages, res_format=None, options=None, priority=None, on_slot=None):
+        on_slot()
+        if model == "primary":
+            raise ConnectionError("down")
+        return json.dumps(RECIPE_LLM_DATA)
+
+    cache = ExtractionCache(tmp_path / "cache.sqlite")
+    router = model_router.ModelRouter({task: model_router.Route(models=["primary", "fallback"])
+                                       for task in model_router.Task})
+    with patch.object(recipe_agent, "EXTRACTION_CACHE", cache), patch.object(recipe_agent, "LLM_ROUTER", router), \
+            patch.object(model_router, "openrouter_chat_request", _chat_request):
+        await recipe_agent.process_with_openrouter("# Gulasch", "https://example.com/gulasch?utm_source=x")
+
+    cache.flush()
+    rows = cache._db().execute("SELECT url, model FROM extractions").fetchall()
+    assert rows == [("https://example.com/gulasch", "fallback")]
@@ -0,0 +1,94 @@
+import sqlite3
+from unittest.mock import patch
+
+import pytest
+
+from recipe_agent.chat_history import ChatHistory
+from recipe_agent.history_backend import SQLiteHistoryBackend
+from recipe_agent.recipe import Recipe
+from recipe_agent.recipe_store import RecipeStore
+
+
+def _recipe(name: str, url: str) -> Recipe:
+    return Recipe(name=name, url=url, recipeIngredient=["500g Rindfleisch", "2 Zwiebeln"],
+                  recipeInstructions=["Anbraten", "Schmoren"], totalTime="PT2H0M0S")
+
+
+def test_sqlite_backend_writes_behind(tmp_path):
+    backend = SQLiteHistoryBackend(tmp_path / "history.sqlite", flush_interval=60.0)
+    backend.save("web", "Tester", {"messages": [{"role": "user", "content": "Hallo"}]})
+
+    # -- Pending states are visible before they are written
+    assert backend.load("web", "Tester") == {"messages": [{"role": "user", "content": "Hallo"}]}
+    backend.close()
+
+    reopened = SQLiteHistoryBackend(tmp_path / "history.sqlite")
+    assert reopened.load("web", "Tester") == {"messages": [{"role": "user", "content": "Hallo"}]}
+    assert reopened.load("telegram", "Tester") is None
+    assert list(reopened.load_recent("web", 10)) == ["Tester"]
+    reopened.close()
+
+
+def test_chat_history_survives_restart(tmp_path):
+    recipe = _recipe("Gulasch", "https://example.com/gulasch")
+    backend = SQLiteHistoryBackend(tmp_path / "history.sqlite", flush_interval=60.0)
+    history = ChatHistory(recipe_store=RecipeStore(), backend=backend, namespace="telegram")
+    history.add_user_message("Tester", "Schau mal https://example.com/gulasch")
+    history.add_recipe("Tester", recipe, "https://example.com/gulasch")
+    history.add_user_message("Anna", "Hallo")
+    backend.close()
+
+    # -- New process: empty recipe store, conversations are restored from the database
+    store = RecipeStore()
+    restored = ChatHistory(recipe_store=store, backend=SQLiteHistoryBackend(tmp_path / "history.sqlite"),
+                           namespace="telegram")
+    restored.restore()
+
+    assert restored.get_messages("Tester") == history.get_messages("Tester")
+    assert restored.get_last_message_with_url("Tester") == ["https://example.com/gulasch"]
+    assert restored.get_recipes_for_urls("Tester", ["https://example.com/gulasch"]) == {
+        "https://example.com/gulasch": recipe}
+    assert restored.get_last_recipe("Tester") == recipe
+    assert len(store) == 1
+
+    # -- Other namespaces are kept apart
+    web = ChatHistory(backend=SQLiteHistoryBackend(tmp_path / "history.sqlite"), namespace="web")
+    assert len(web.get_messages("Tester")) == 1
+
+
+@pytest.mark.asyncio
+async def test_chat_history_picks_up_other_processes(tmp_path):
+    first = ChatHistory(recipe_store=RecipeStore(), backend=SQLiteHistoryBackend(tmp_path / "history.sqlite"),
+                        namespace="web")
+    second = ChatHistory(recipe_store=RecipeStore(), backend=SQLiteHistoryBackend(tmp_path / "history.sqlite"),
+                         namespace="web")
+    first.add_user_message("Tester", "Hallo")
+    first.flush()
+
+    await second.load("Tester")
+    lock = second.lock("Tester")
+    second.add_assistant_response("Tester", "Hallo Tester")
+    second.flush()
+
+    # -- Each process sees the turn the other one wrote, its own writes are not read back
+    await first.load("Tester")
+    assert [m["content"] for m in first.get_messages("Tester")[1:]] == ["Hallo", "Hallo Tester"]
+    await second.load("Tester")
+    assert second.lock("Tester") is lock
+    assert first.get_messages("Tester") == second.get_messages("Tester")
+
+
+def test_sqlite_backend_keeps_batch_when_write_fails(tmp_path):
+    backend = SQLiteHistoryBackend(tmp_path / "history.sqlite", flush_interval=60.0)
+    backend.save("web", "Tester", {"messages": [{"role": "user", "content": "Hallo"}]})
+
+    with patch.object(backend, "_db", side_effect=sqlite3.OperationalError("disk I/O error")):
+        with pytest.raises(sqlite3.OperationalError):
+            backend.flush()
+    backend.save("web", "Anna", {"messages": []})
+    backend.close()
+
+    reopened = SQLiteHistoryBackend(tmp_path / "history.sqlite")
+    assert reopened.load("web", "Tester") == {"messages": [{"role": "user", "content": "Hallo"}]}
+    assert reopened.load("web", "Anna") == {"messages": []}
+    reopened.close()
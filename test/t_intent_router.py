@@ -0,0 +1,63 @@
+from unittest.mock import patch
+
+import pytest
+
+from recipe_agent.agents import chat_agent
+from recipe_agent.agents.intent_router import IntentRouter, Intent, TEMPLATES
+from recipe_agent.chat_history import ChatHistory
+
+
+@pytest.mark.parametrize("message, intent", [
+    ("Hallo!", Intent.GREETING),
+    ("Moin moin", Intent.GREETING),
+    ("Danke dir 🙏", Intent.THANKS),
+    ("super, vielen Dank!", Intent.THANKS),
+    ("/start", Intent.HELP),
+    ("Was kannst du?", Intent.HELP),
+    ("Tschüss", Intent.GOODBYE),
+    ("ok", Intent.ACK),
+    ("!save", Intent.SAVE),
+    ("Ja, speichern bitte", Intent.SAVE),
+    ("Zeig mir das Rezept nochmal", Intent.SHOW_RECIPE),
+    ("Rezept bitte nochmal", Intent.SHOW_RECIPE),
+    ("Hallo, was koche ich heute mit Kartoffeln und Quark?", Intent.CHAT),
+    ("Danke, aber kannst du mir auch sagen wie lange das Gulasch schmoren muss?", Intent.CHAT),
+])
+def test_classify(message, intent):
+    assert IntentRouter().classify(message) == intent
+
+
+def test_answer_counts_saved_llm_calls():
+    router, history = IntentRouter(), ChatHistory()
+
+    assert router.answer("Tester", "Danke!", history, "prompt") in TEMPLATES[Intent.THANKS]
+    assert router.answer("Tester", "Wie lange muss Gulasch schmoren?", history, "prompt") is None
+
+    assert router.stats() == {"saved_llm_calls": 1, "escalated": 1, "thanks": 1}
+    assert [m["role"] for m in history.get_messages("Tester")] == ["system", "user", "assistant"]
+
+
+@pytest.mark.asyncio
+async def test_answer_message_skips_llm_for_routine_messages():
+    history = ChatHistory()
+
+    response = await chat_agent.answer_message("Tester", "Hallo", history)
+    streamed = [r async for r in chat_agent.answer_message_stream("Tester", "Danke", history)]
+
+    assert response and len(streamed) == 1
+    assert history.get_messages("Tester")[-1]["content"] == streamed[0]
+
+
+@pytest.mark.asyncio
+async def test_answer_message_stream_escalates_open_ended_messages():
+    history = ChatHistory()
+
+    async def _stream(task, messages):
+        for delta in ("Etwa ", "zwei Stunden"):
+            yield delta
+
+    with patch.object(chat_agent.LLM_ROUTER, "stream", _stream):
+        streamed = [r async for r in chat_agent.answer_message_stream("Tester", "Wie lange schmort Gulasch?", history)]
+
+    assert streamed == ["Etwa ", "Etwa zwei Stunden"]
+    assert history.get_messages("Tester")[-1]["content"] == "Etwa zwei Stunden"
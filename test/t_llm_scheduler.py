@@ -0,0 +1,90 @@
+import asyncio
+
+import httpx
+import pytest
+
+from recipe_agent.llm_scheduler import LLMScheduler, Priority, TokenBucket, retry_after
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+    def __init__(self, retry_after_seconds: str):
+        super().__init__("rate limited")
+        self.response = httpx.Response(429, headers={"Retry-After": retry_after_seconds})
+
+
+def test_token_bucket():
+    bucket = TokenBucket(60)
+    assert bucket.delay(60) == 0
+    bucket.take(60)
+    assert 0.9 < bucket.delay(1) <= 1.0
+
+    assert TokenBucket(0).delay(1000) == 0
+
+
+def test_retry_after():
+    assert retry_after(RateLimitError("3")) == 3.0
+    assert retry_after(ValueError()) is None
+
+
+@pytest.mark.asyncio
+async def test_scheduler_priority_order():
+    scheduler, order = LLMScheduler(max_concurrency=1, requests_per_minute=0), list()
+
+    async def _request(name: str, priority: Priority):
+        async with scheduler.slot(priority):
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    # -- Occupy the only slot, then queue requests in reverse priority
+    first = asyncio.create_task(_request("first", Priority.BACKGROUND))
+    await asyncio.sleep(0)
+    tasks = [asyncio.create_task(_request(n, p)) for n, p in (
+        ("search", Priority.SEARCH), ("extraction", Priority.EXTRACTION), ("chat", Priority.CHAT))]
+    await asyncio.gather(first, *tasks)
+
+    assert order == ["first", "chat", "extraction", "search"]
+    assert scheduler.active == 0 and scheduler.queue_length == 0
+
+
+@pytest.mark.asyncio
+async def test_scheduler_retries_rate_limited_requests():
+    scheduler, calls = LLMScheduler(max_concurrency=2, requests_per_minute=0, max_retries=2), 0
+
+    async def _request():
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            raise RateLimitError("0.05")
+        return "ok"
+
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    assert await scheduler.run(_request, Priority.CHAT) == "ok"
+    assert calls == 2
+    assert loop.time() - start >= 0.04
+
+    async def _always_limited():
+        raise RateLimitError("0")
+
+    with pytest.raises(RateLimitError):
+        await scheduler.run(_always_limited)
+
+
+@pytest.mark.asyncio
+async def test_scheduler_cancelled_waiter():
+    scheduler = LLMScheduler(max_concurrency=1, requests_per_minute=0)
+
+    async def _hold():
+        async with scheduler.slot(Priority.CHAT):
+            await asyncio.sleep(0.02)
+
+    holder = asyncio.create_task(_hold())
+    await asyncio.sleep(0)
+    waiter = asyncio.create_task(_hold())
+    await asyncio.sleep(0)
+    waiter.cancel()
+    await holder
+
+    assert scheduler.active == 0 and scheduler.queue_length == 0
@@ -0,0 +1,191 @@
+import asyncio
+import json
+import time
+from unittest.mock import patch
+
+import httpx
+import litellm
+import pytest
+from litellm.llms.custom_httpx import llm_http_handler
+from litellm.llms.custom_httpx.http_handler import AsyncHTTPHandler
+
+from recipe_agent import model_router, openrouter_chat
+from recipe_agent.model_router import ModelHealth, ModelRouter, Route, Task
+
+
+def _router(*models: str, hedge_after: float = 0.0, **kwargs) -> ModelRouter:
+    return ModelRouter({task: Route(models=list(models), hedge_after=hedge_after) for task in Task}, **kwargs)
+
+
+def test_model_health_percentiles():
+    health = ModelHealth(window=100)
+    for latency in range(1, 121):
+        health.record(float(latency), True)
+    health.record(None, False)
+
+    # -- Only the latest 100 requests are taken into account
+    assert health.p50 == 70.5
+    assert 115 <= health.p95 <= 116
+    assert health.error_rate == pytest.approx(1 / 100)
+
+
+@pytest.mark.asyncio
+async def test_router_falls_back_on_error_and_invalid_answer():
+    calls = list()
+
+    async def _chat_request(model, messages, res_format=None, options=None, priority=None, on_slot=None):
+        on_slot()
+        calls.append(model)
+        if model == "a":
+            raise ConnectionError("down")
+        return "kein json" if model == "b" else json.dumps({"name": "Gulasch"})
+
+    router = _router("a", "b", "c")
+    with patch.object(model_router, "openrouter_chat_request", _chat_request):
+        response = await router.request(Task.EXTRACTION, list(), validate=json.loads)
+
+    assert json.loads(response) == {"name": "Gulasch"}
+    assert calls == ["a", "b", "c"]
+    with patch.object(model_router, "openrouter_chat_request", _chat_request):
+        assert await router.request_with_model(Task.EXTRACTION, list(), validate=json.loads) == (response, "c")
+    assert router.stats()["a"]["error_rate"] == router.stats()["b"]["error_rate"] == 1.0
+
+
+@pytest.mark.asyncio
+async def test_router_demotes_unhealthy_model():
+    async def _chat_request(model, messages, res_format=None, options=None, priority=None, on_slot=None):
+        on_slot()
+        if model == "a":
+            raise ConnectionError("down")
+        return "ok"
+
+    router = _router("a", "b", demote_min_samples=2, demote_error_rate=0.5)
+    with patch.object(model_router, "openrouter_chat_request", _chat_request):
+        for _ in range(2):
+            assert await router.request(Task.CHAT, list()) == "ok"
+
+    assert router.health("a").demoted
+    assert router.models(Task.CHAT) == ["b", "a"]
+
+
+@pytest.mark.asyncio
+async def test_router_hedges_slow_model():
+    cancelled = list()
+
+    async def _chat_request(model, messages, res_format=None, options=None, priority=None, on_slot=None):
+        on_slot()
+        if model == "slow":
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(model)
+                raise
+        return model
+
+    router = _router("slow", "fast", hedge_after=0.01)
+    with patch.object(model_router, "openrouter_chat_request", _chat_request):
+        assert await router.request(Task.EXTRACTION, list()) == "fast"
+        await asyncio.sleep(0)
+
+    assert cancelled == ["slow"]
+    # -- The cancelled request does not count as an error
+    assert router.health("slow").samples == 0
+
+
+@pytest.mark.asyncio
+async def test_router_hedges_and_measures_from_the_scheduler_slot():
+    calls = list()
+
+    async def _chat_request(model, messages, res_format=None, options=None, priority=None, on_slot=None):
+        calls.append(model)
+        # -- Waits in the scheduler queue far longer than hedge_after, then answers fast
+        await asyncio.sleep(0.3)
+        on_slot()
+        await asyncio.sleep(0.01)
+        return model
+
+    router = _router("queued", "other", hedge_after=0.05)
+    with patch.object(model_router, "openrouter_chat_request", _chat_request):
+        assert await router.request(Task.EXTRACTION, list()) == "queued"
+
+    assert calls == ["queued"]
+    assert router.health("queued").p50 < 0.2
+
+
+@pytest.mark.asyncio
+async def test_router_does_not_hedge_while_scheduler_throttles():
+    calls = list()
+
+    async def _chat_request(model, messages, res_format=None, options=None, priority=None, on_slot=None):
+        calls.append(model)
+        on_slot()
+        await asyncio.sleep(0.2)
+        return model
+
+    router = _router("slow", "fast", hedge_after=0.01)
+    with patch.object(model_router, "openrouter_chat_request", _chat_request), \
+            patch.object(model_router.LLM_SCHEDULER, "_paused_until", time.monotonic() + 10):
+        assert await router.request(Task.EXTRACTION, list()) == "slow"
+
+    assert calls == ["slow"]
+
+
+@pytest.mark.asyncio
+async def test_router_stream_falls_back_before_first_delta():
+    async def _chat_stream(model, messages, res_format=None, options=None, priority=None, on_slot=None):
+        on_slot()
+        if model == "a":
+            raise ConnectionError("down")
+        for delta in ("Hal", "lo"):
+            yield delta
+
+    router = _router("a", "b")
+    with patch.object(model_router, "openrouter_chat_stream", _chat_stream):
+        deltas = [d async for d in router.stream(Task.CHAT, list())]
+
+    assert deltas == ["Hal", "lo"]
+
+
+def _provider_transport(failing_model: str, slow_model: str = None) -> httpx.AsyncClient:
+    """ OpenAI-compatible endpoint, requests for failing_model are rejected, slow_model answers late """
+
+    async def _handle(request: httpx.Request) -> httpx.Response:
+        model = json.loads(request.content)["model"]
+        if model == failing_model:
+            return httpx.Response(400, json={"error": {"message": "model down", "type": "invalid_request_error"}})
+        if model == slow_model:
+            await asyncio.sleep(10)
+        return httpx.Response(200, json={
+            "id": "chatcmpl-test", "object": "chat.completion", "created": 0, "model": model,
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": model}}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        })
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(_handle))
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("models,failing_model,slow_model,hedge_after,expected", [
+    # -- Fallback from an OpenRouter model to a model of another provider
+    (["openrouter/mistralai/mistral-nemo", "openai/gpt-4o-mini"], "mistralai/mistral-nemo", None, 0.0,
+     "gpt-4o-mini"),
+    # -- Hedge a slow model of another provider with an OpenRouter model
+    (["openai/gpt-4o-mini", "openrouter/mistralai/mistral-nemo"], None, "gpt-4o-mini", 0.05,
+     "mistralai/mistral-nemo"),
+])
+async def test_router_mixed_providers_end_to_end(models, failing_model, slow_model, hedge_after, expected):
+    client = _provider_transport(failing_model, slow_model)
+    # -- litellm sends some providers through the OpenAI SDK and others through its own HTTP handler
+    handler = AsyncHTTPHandler()
+    handler.client = client
+    router = _router(*models, hedge_after=hedge_after)
+    options = {"api_key": "test", "api_base": "http://llm.test/v1"}
+
+    with patch.object(openrouter_chat, "_HTTP_CLIENT", client), patch.object(litellm, "aclient_session", client), \
+            patch.object(llm_http_handler, "get_async_httpx_client", lambda **kwargs: handler):
+        assert await router.request(Task.EXTRACTION, [{"role": "user", "content": "Hi"}], options=options) == expected
+        await client.aclose()
+
+    assert router.health(models[-1]).error_rate == 0.0
+    if failing_model:
+        assert router.health(models[0]).error_rate == 1.0
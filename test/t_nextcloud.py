@@ -55,7 +55,7 @@ def test_recipe_preview_image(output_path):
     
     # Vorschaubild erstellen
     nextcloud_recipe._directory = recipe_folder
-    nextcloud_recipe._create_recipe_preview_image()
+    nextcloud_recipe._save_preview_image(nextcloud_recipe.create_preview_image())
     
     # Überprüfen, ob die Bilder erstellt wurden
     expected_images = ["full.jpg", "thumb.jpg", "thumb16.jpg"]
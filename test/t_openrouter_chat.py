@@ -0,0 +1,71 @@
+from types import SimpleNamespace
+from unittest.mock import patch, AsyncMock
+
+import httpx
+import litellm
+import pytest
+
+from recipe_agent import openrouter_chat
+from recipe_agent.openrouter_chat import openrouter_chat_request, openrouter_chat_stream
+
+
+def _chunk(content):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])
+
+
+class FakeStream:
+    def __init__(self, parts):
+        self._parts = parts
+
+    def __aiter__(self):
+        return self._iter()
+
+    async def _iter(self):
+        for part in self._parts:
+            yield _chunk(part)
+
+
+@pytest.mark.asyncio
+async def test_chat_stream_yields_deltas():
+    acompletion = AsyncMock(return_value=FakeStream(["Hal", None, "lo"]))
+
+    with patch.object(openrouter_chat, "acompletion", acompletion):
+        deltas = [d async for d in openrouter_chat_stream("test/model", [{"role": "user", "content": "Hi"}])]
+
+    assert deltas == ["Hal", "lo"]
+    assert acompletion.call_args.kwargs["stream"] is True
+
+
+@pytest.mark.asyncio
+async def test_chat_request_does_not_modify_options():
+    acompletion = AsyncMock(return_value=FakeStream(["Hallo", " Welt"]))
+    options = {"stream": True, "temperature": 0.1}
+
+    with patch.object(openrouter_chat, "acompletion", acompletion):
+        response = await openrouter_chat_request("test/model", [{"role": "user", "content": "Hi"}], options=options)
+
+    assert response == "Hallo Welt"
+    assert options == {"stream": True, "temperature": 0.1}
+    assert acompletion.call_args.kwargs["temperature"] == 0.1
+
+
+def _completion_response(request: httpx.Request) -> httpx.Response:
+    return httpx.Response(200, json={
+        "id": "chatcmpl-test", "object": "chat.completion", "created": 0, "model": "test",
+        "choices": [{"index": 0, "finish_reason": "stop",
+                     "message": {"role": "assistant", "content": f"Hallo von {request.url.host}"}}],
+        "usage": {"prompt_tokens": 1, "completion_tokens": 2, "total_tokens": 3},
+    })
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("model", ["openai/gpt-4o-mini", "openrouter/openai/gpt-4o-mini"])
+async def test_chat_request_routes_providers_through_shared_pool(model):
+    client = httpx.AsyncClient(transport=httpx.MockTransport(_completion_response))
+
+    with patch.object(openrouter_chat, "_HTTP_CLIENT", client), patch.object(litellm, "aclient_session", client):
+        response = await openrouter_chat_request(model, [{"role": "user", "content": "Hi"}],
+                                                 options={"api_key": "test", "api_base": "http://llm.test/v1"})
+        await client.aclose()
+
+    assert response == "Hallo von llm.test"
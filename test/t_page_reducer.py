@@ -0,0 +1,86 @@
+from recipe_agent.page_reducer import (INGREDIENT_LINE, chunk_page, count_tokens, merge_recipe_llms, reduce_page,
+                                       score_section, split_sections)
+from recipe_agent.recipe import RecipeLLM
+
+MODEL = "openrouter/mistralai/mistral-nemo:free"
+
+NAVIGATION = "## Menü\n" + "\n".join(f"[Rubrik {i}](https://example.com/rubrik/{i})" for i in range(60))
+COMMENTS = "## Kommentare\n" + "\n\n".join(f"Kommentar {i}: Das hat uns allen sehr gut geschmeckt, danke!"
+                                          for i in range(60))
+INGREDIENTS = "## Zutaten\n500g Rindfleisch\n2 Zwiebeln\n1 EL Tomatenmark\n250ml Brühe\n1 TL Paprika"
+INSTRUCTIONS = "## Zubereitung\n1. Fleisch anbraten\n2. Zwiebeln dazugeben\n3. Mit Brühe ablöschen"
+TITLE = "# Omas Gulasch\nDeftig, würzig und am nächsten Tag noch besser."
+
+
+def _recipe_llm(**kwargs) -> RecipeLLM:
+    data = {"name": "", "url": "", "image_url": "", "description": "", "recipeIngredient": [],
+            "recipeInstructions": [], "prepTime": "", "cookTime": "", "totalTime": "", "keywords": []}
+    data.update(kwargs)
+    return RecipeLLM(**data)
+
+
+def test_score_section():
+    assert score_section(INGREDIENTS) > score_section(COMMENTS)
+    assert score_section(INSTRUCTIONS) > 0
+    assert score_section(NAVIGATION) == 0
+
+
+def test_ingredient_line_skips_numbered_steps():
+    assert len(INGREDIENT_LINE.findall(INGREDIENTS)) == 5
+    assert INGREDIENT_LINE.findall(INSTRUCTIONS) == []
+    assert INGREDIENT_LINE.match("1.5 kg Kartoffeln") and INGREDIENT_LINE.match("- 1/2 TL Salz")
+
+
+def test_reduce_page_keeps_recipe_sections_in_order():
+    page = "\n".join((NAVIGATION, INGREDIENTS, COMMENTS, INSTRUCTIONS))
+    budget = count_tokens(INGREDIENTS + INSTRUCTIONS, MODEL) + 20
+
+    reduced = reduce_page(page, MODEL, budget)
+
+    assert reduced.index("## Zutaten") < reduced.index("## Zubereitung")
+    assert "Rubrik" not in reduced and "Kommentar" not in reduced
+    assert count_tokens(reduced, MODEL) <= budget
+    # -- Pages within budget are not touched
+    assert reduce_page(INGREDIENTS, MODEL, budget) == INGREDIENTS
+
+
+def test_chunk_page_splits_oversized_recipes():
+    steps = "\n".join(f"{i}. Schritt mit 100g Mehl und 1 EL Zucker" for i in range(1, 40))
+    page = "\n".join((TITLE, NAVIGATION, INGREDIENTS, f"## Zubereitung\n{steps}", f"## Tipps\n{steps}"))
+    budget = count_tokens(f"## Zubereitung\n{steps}", MODEL) + 10
+
+    chunks = chunk_page(page, MODEL, budget, max_chunks=4)
+
+    assert len(chunks) > 1
+    assert all(count_tokens(c, MODEL) <= budget for c in chunks)
+    # -- Title and introduction are kept although they do not look like a recipe
+    assert chunks[0].startswith(TITLE)
+    assert "## Zutaten" in chunks[0]
+    assert not any("Rubrik" in c for c in chunks)
+    assert chunk_page(INGREDIENTS, MODEL, budget, max_chunks=4) == [INGREDIENTS]
+
+
+def test_merge_recipe_llms():
+    merged = merge_recipe_llms([
+        _recipe_llm(name="Gulasch", recipeIngredient=["500g Rindfleisch", "2 Zwiebeln"], keywords=["Gulasch"]),
+        _recipe_llm(name="Anderer Name", prepTime="PT0H30M0S", recipeIngredient=["2 zwiebeln", "1 EL Tomatenmark"],
+                    recipeInstructions=["Anbraten"], keywords=["gulasch", "Rind"]),
+    ])
+
+    assert merged.name == "Gulasch"
+    assert merged.prep_time == "PT0H30M0S"
+    assert merged.recipe_ingredient == ["500g Rindfleisch", "2 Zwiebeln", "1 EL Tomatenmark"]
+    assert merged.recipe_instructions == ["Anbraten"]
+    assert merged.keywords == ["Gulasch", "Rind"]
+
+
+def test_split_sections_splits_oversize_paragraphs():
+    # -- One paragraph of many lines and one line of many words, both above the limit
+    lines = "\n".join(f"{i} EL Zucker" for i in range(200))
+    words = " ".join(f"Wort{i}" for i in range(400))
+    sections = split_sections(f"## Zutaten\n{lines}\n\n{words}", MODEL, 50)
+
+    assert len(sections) > 2
+    assert all(s.tokens <= 50 for s in sections)
+    assert "".join(s.text for s in sections).replace(" ", "").replace("\n", "") == \
+        f"## Zutaten{lines}{words}".replace(" ", "").replace("\n", "")
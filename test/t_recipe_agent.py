@@ -0,0 +1,116 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
+
+from recipe_agent.agents import recipe_agent
+from recipe_agent.crawl_cache import CrawledPage
+from recipe_agent.recipe import Recipe
+
+DELAYS = {"https://example.com/slow": 0.05, "https://example.com/fast": 0.0, "https://example.com/broken": 0.01}
+
+
+async def fake_scrape_recipe(url, save=False):
+    await asyncio.sleep(DELAYS[url])
+    if "broken" in url:
+        raise ValueError("Kein Rezept gefunden")
+    return Recipe(name=url.rsplit("/", 1)[-1], url=url)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("order, expected", [
+    ("arrival", ["https://example.com/slow", "https://example.com/fast", "https://example.com/broken"]),
+    ("completion", ["https://example.com/fast", "https://example.com/broken", "https://example.com/slow"]),
+])
+async def test_scrape_recipes_order(order, expected):
+    urls = ["https://example.com/slow", "https://example.com/fast", "https://example.com/broken"]
+
+    with patch.object(recipe_agent, "scrape_recipe", fake_scrape_recipe):
+        results = [r async for r in recipe_agent.scrape_recipes(urls, user="tester", order=order)]
+
+    assert [r.url for r in results] == expected
+    failed = [r for r in results if r.recipe is None]
+    assert len(failed) == 1 and failed[0].error == "Kein Rezept gefunden"
+
+
+@pytest.mark.asyncio
+async def test_scrape_limiter_per_user():
+    limiter = recipe_agent.ScrapeLimiter(max_concurrency=4, max_concurrency_per_user=1)
+    running, max_running = 0, 0
+
+    async def _work():
+        nonlocal running, max_running
+        async with limiter.acquire("tester"):
+            running += 1
+            max_running = max(max_running, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+    await asyncio.gather(*[_work() for _ in range(3)])
+
+    assert max_running == 1
+    # -- Per user semaphores are released once the user has no running scrapes
+    assert not limiter._user_semaphores
+
+
+@pytest.mark.asyncio
+async def test_scrape_recipe_single_flight():
+    calls = 0
+
+    async def fake_extract_recipe(url):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return Recipe(name="Shakshuka", url=url), True
+
+    urls = ["https://shibaskitchen.de/shakshuka-rezept/", "https://shibaskitchen.de/shakshuka-rezept#zutaten"]
+    with patch.object(recipe_agent, "extract_recipe", fake_extract_recipe):
+        results = await asyncio.gather(*[recipe_agent.scrape_recipe(url) for url in urls])
+
+    assert calls == 1
+    assert results[0] == results[1]
+    # -- Callers receive their own copy
+    assert results[0] is not results[1]
+
+
+@pytest.mark.asyncio
+async def test_scrape_recipes_skips_known_recipes():
+    known = Recipe(name="Gulasch", url="https://example.com/gulasch", image="https://example.com/gulasch.jpg")
+    uploaded = list()
+
+    async def _upload_recipe(recipe_obj):
+        uploaded.append(recipe_obj.name)
+
+    with patch.object(recipe_agent, "scrape_recipe", fake_scrape_recipe), \
+            patch.object(recipe_agent, "upload_recipe", _upload_recipe):
+        results = [r async for r in recipe_agent.scrape_recipes(
+            ["https://example.com/gulasch", "https://example.com/fast"], save=True,
+            known_recipes={"https://example.com/gulasch": known})]
+        await asyncio.sleep(0)
+
+    assert results[0].recipe == known and results[0].recipe is not known
+    assert results[1].recipe.url == "https://example.com/fast"
+    assert uploaded == ["Gulasch"]
+
+
+@pytest.mark.asyncio
+async def test_extract_recipe_parses_structured_data_of_the_crawl():
+    url = "https://example.com/gulasch"
+    page = CrawledPage(url=url, final_url=url, markdown="# Gulasch", structured_data={
+        "@type": "Recipe", "name": "Gulasch", "recipeIngredient": ["1 kg Rind"], "recipeInstructions": "Schmoren."})
+
+    async def fake_crawl_page(crawl_url, crawl_config):
+        return page
+
+    async def no_llm(markdown, page_url):
+        raise AssertionError("Die strukturierten Daten reichen aus")
+
+    with patch.object(recipe_agent, "STRUCTURED_RECIPE_PROBE", False), \
+            patch.object(recipe_agent, "fetch_structured_recipe", side_effect=AssertionError("Keine Extra-Anfrage")), \
+            patch.object(recipe_agent, "crawl_page", fake_crawl_page), \
+            patch.object(recipe_agent, "process_with_openrouter", no_llm):
+        recipe_obj, from_structured_data = await recipe_agent.extract_recipe(url)
+
+    assert from_structured_data
+    assert recipe_obj.name == "Gulasch"
+    assert recipe_obj.recipe_ingredient == ["1 kg Rind"]
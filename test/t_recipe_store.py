@@ -0,0 +1,49 @@
+from recipe_agent.chat_history import ChatHistory
+from recipe_agent.recipe import Recipe
+from recipe_agent.recipe_store import RecipeStore, recipe_summary
+
+
+def _recipe(name: str, url: str) -> Recipe:
+    return Recipe(name=name, url=url, recipeIngredient=["500g Rindfleisch", "2 Zwiebeln"],
+                  recipeInstructions=["Anbraten", "Schmoren"], totalTime="PT2H0M0S")
+
+
+def test_recipe_store_lru():
+    store = RecipeStore(max_entries=2)
+    a = store.put(_recipe("A", "https://example.com/a"))
+    b = store.put(_recipe("B", "https://example.com/b"))
+    store.get(a)
+    store.put(_recipe("C", "https://example.com/c"))
+
+    assert store.get(a).name == "A"
+    assert store.get(b) is None
+    assert len(store) == 2
+
+
+def test_chat_history_keeps_recipe_references():
+    store, recipe = RecipeStore(), _recipe("Gulasch", "https://example.com/gulasch")
+    history = ChatHistory(recipe_store=store)
+    history.add_user_message("Tester", "https://example.com/gulasch")
+    history.add_recipe("Tester", recipe)
+    history.add_user_message("Tester", "Danke")
+
+    messages = history.get_messages("Tester")
+
+    assert messages[2] == {"role": "assistant", "content": recipe_summary(recipe)}
+    assert "Gulasch (https://example.com/gulasch), 2 Zutaten, 2 Schritte" in recipe_summary(recipe)
+    assert history.get_last_recipe("Tester") is recipe
+    assert history.get_last_recipe("Unbekannt") is None
+
+
+def test_chat_history_url_index():
+    store, recipe = RecipeStore(), _recipe("Gulasch", "https://example.com/gulasch")
+    history = ChatHistory(max_history_length=2, recipe_store=store)
+    history.add_user_message("Tester", "Schau mal https://Example.com/gulasch/?utm_source=x")
+    history.add_recipe("Tester", recipe, "https://Example.com/gulasch/?utm_source=x")
+    history.add_user_message("Tester", "Danke")
+    history.add_assistant_response("Tester", "Gerne")
+
+    # -- The index outlives the messages that left the window
+    assert history.get_last_message_with_url("Tester") == ["https://Example.com/gulasch/?utm_source=x"]
+    assert history.get_recipes_for_urls("Tester", ["https://example.com/gulasch", "https://example.com/b"]) == {
+        "https://example.com/gulasch": recipe}
@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+from recipe_agent.single_flight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_call():
+    flight, calls = SingleFlight("test"), 0
+
+    async def _work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "Gulasch"
+
+    results = await asyncio.gather(*[flight.do("key", _work) for _ in range(5)])
+
+    assert results == ["Gulasch"] * 5
+    assert calls == 1
+    assert flight.shared_calls == 4
+    assert not flight.in_flight("key")
+
+    # -- Finished calls are not cached
+    await flight.do("key", _work)
+    assert calls == 2
+
+
+@pytest.mark.asyncio
+async def test_single_flight_errors_and_cancellation():
+    flight = SingleFlight("test")
+
+    async def _fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("Kein Rezept")
+
+    results = await asyncio.gather(flight.do("fail", _fail), flight.do("fail", _fail), return_exceptions=True)
+    assert all(isinstance(r, ValueError) for r in results)
+
+    async def _work():
+        await asyncio.sleep(0.02)
+        return "Shakshuka"
+
+    # -- Cancelling one caller keeps the shared call alive for the others
+    first = asyncio.create_task(flight.do("work", _work))
+    second = asyncio.create_task(flight.do("work", _work))
+    await asyncio.sleep(0)
+    first.cancel()
+
+    assert await second == "Shakshuka"
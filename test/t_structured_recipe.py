@@ -0,0 +1,81 @@
+import json
+
+from recipe_agent.recipe import Recipe
+from recipe_agent.structured_recipe import recipe_from_html
+
+JSON_LD_RECIPE = {
+    "@context": "https://schema.org",
+    "@graph": [
+        {"@type": "WebPage", "name": "Shakshuka Rezept"},
+        {
+            "@type": ["Recipe", "NewsArticle"],
+            "name": "Shakshuka",
+            "description": "Eier in W&uuml;rziger Tomatensauce",
+            "image": [{"@type": "ImageObject", "url": "https://example.com/shakshuka.jpg"}],
+            "prepTime": "PT15M",
+            "cookTime": "P0DT1H5M",
+            "recipeYield": ["2", "2 Portionen"],
+            "recipeCategory": "Frühstück",
+            "keywords": "Eier, Tomaten",
+            "recipeIngredient": ["4 Eier", "400 g Tomaten"],
+            "recipeInstructions": [
+                {"@type": "HowToSection", "name": "Sauce", "itemListElement": [
+                    {"@type": "HowToStep", "text": "Tomaten <b>einkochen</b>."},
+                ]},
+                {"@type": "HowToStep", "text": "Eier hineingeben."},
+            ]
+        }
+    ]
+}
+
+MICRODATA_HTML = """
+<div itemscope itemtype="http://schema.org/Recipe">
+  <h1 itemprop="name">Rindergulasch</h1>
+  <meta itemprop="totalTime" content="PT2H">
+  <span itemprop="recipeYield">4 Portionen</span>
+  <ul>
+    <li itemprop="recipeIngredient">720g Rinderbraten</li>
+    <li itemprop="recipeIngredient">2 Zwiebeln</li>
+  </ul>
+  <div itemprop="nutrition" itemscope itemtype="http://schema.org/NutritionInformation">
+    <span itemprop="name">Nicht das Rezept</span>
+  </div>
+  <p itemprop="recipeInstructions">Fleisch anbraten.</p>
+  <p itemprop="recipeInstructions">Schmoren lassen.</p>
+</div>
+"""
+
+
+def test_recipe_from_json_ld():
+    page_html = f'<html><script type="application/ld+json">{json.dumps(JSON_LD_RECIPE)}</script></html>'
+    recipe = recipe_from_html(page_html, "https://example.com/shakshuka")
+
+    assert isinstance(recipe, Recipe)
+    assert recipe.name == "Shakshuka"
+    assert recipe.description == "Eier in Würziger Tomatensauce"
+    assert recipe.image == "https://example.com/shakshuka.jpg"
+    assert recipe.prep_time == "PT0H15M0S"
+    assert recipe.cook_time == "PT1H5M0S"
+    assert recipe.recipe_yield == 2
+    assert recipe.keywords == "Eier,Tomaten"
+    assert recipe.recipe_ingredient == ["4 Eier", "400 g Tomaten"]
+    assert recipe.recipe_instructions == ["Tomaten einkochen.", "Eier hineingeben."]
+    assert recipe.url == "https://example.com/shakshuka"
+
+
+def test_recipe_from_microdata():
+    recipe = recipe_from_html(MICRODATA_HTML, "https://example.com/gulasch")
+
+    assert recipe.name == "Rindergulasch"
+    assert recipe.total_time == "PT2H0M0S"
+    assert recipe.recipe_yield == 4
+    assert recipe.recipe_ingredient == ["720g Rinderbraten", "2 Zwiebeln"]
+    assert recipe.recipe_instructions == ["Fleisch anbraten.", "Schmoren lassen."]
+
+
+def test_recipe_without_structured_data():
+    assert recipe_from_html("<html><body><h1>Kein Rezept</h1></body></html>", "https://example.com") is None
+
+    incomplete = {"@type": "Recipe", "name": "Nur ein Name"}
+    page_html = f'<script type="application/ld+json">{json.dumps(incomplete)}</script>'
+    assert recipe_from_html(page_html, "https://example.com") is None
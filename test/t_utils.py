@@ -1,8 +1,46 @@
+import io
+
+from PIL import Image
+
 from conftest import URLS
 
-from recipe_agent.utils import get_link_preview_image_url
+from recipe_agent.utils import get_link_preview_image_url, normalize_url, create_image_derivatives
 
 
 def test_get_link_preview_image():
     image_url = get_link_preview_image_url(URLS["chilinudeln_in_erdnusssose"])
     assert image_url is not None
+
+
+def test_normalize_url():
+    url = "HTTPS://www.Chefkoch.de/rezepte/1636861271240120/Rinderschmorbraten.html/?utm_source=telegram&b=2&a=1#kommentare"
+    assert normalize_url(url) == "https://www.chefkoch.de/rezepte/1636861271240120/Rinderschmorbraten.html?a=1&b=2"
+    assert normalize_url("https://shibaskitchen.de/shakshuka-rezept/") == normalize_url(
+        "https://shibaskitchen.de/shakshuka-rezept")
+
+
+def _image_bytes(size, image_format="JPEG", mode="RGB") -> bytes:
+    buffer = io.BytesIO()
+    Image.new(mode, size, "orange").save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def test_create_image_derivatives():
+    derivatives = create_image_derivatives(_image_bytes((3000, 2000)), {"full": 1024, "thumb": 256, "thumb16": 16})
+
+    for name, size in {"full": 1024, "thumb": 256, "thumb16": 16}.items():
+        with Image.open(io.BytesIO(derivatives[name])) as img:
+            assert img.format == "JPEG"
+            assert img.size == (int(size / 3000 * 2000), int(size / 3000 * 2000))
+
+
+def test_create_image_derivatives_small_transparent_image():
+    derivatives = create_image_derivatives(_image_bytes((100, 60), "PNG", "RGBA"), {"full": 1024, "thumb16": 16},
+                                           image_format="WEBP", quality=70)
+
+    with Image.open(io.BytesIO(derivatives["full"])) as img:
+        assert img.format == "WEBP"
+        # -- Small images are not scaled up, only cropped
+        assert img.size == (60, 60)
+    with Image.open(io.BytesIO(derivatives["thumb16"])) as img:
+        assert img.size == (9, 9)
@@ -1,11 +1,22 @@
+import asyncio
+import io
 import logging
 import sys
 import os
 from datetime import datetime
+from unittest.mock import patch
+from urllib.parse import unquote
 
+import httpx
 import pytest
+from PIL import Image
 
+from recipe_agent.executors import Executors
 from recipe_agent.recipe import Recipe
+from recipe_agent.io import nextcloud_webdav
+from recipe_agent.io.nextcloud import NextcloudRecipe
+from recipe_agent.io.nextcloud_client import NextcloudClients
+from recipe_agent.io.recipe_mirror import RecipeMirror
 from recipe_agent.io.nextcloud_webdav import get_all_recipes, create_put_recipe, update_all_and_upload_recipe
 
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stdout)
@@ -94,3 +105,222 @@ async def test_sync_recipes(output_path):
     )
 
     await update_all_and_upload_recipe(test_recipe)
+
+
+def _propfind_response(etags, collections=()):
+    responses = "".join(
+        f"<d:response><d:href>{href}</d:href><d:propstat><d:prop><d:resourcetype><d:collection/></d:resourcetype>"
+        f"</d:prop></d:propstat></d:response>"
+        for href in collections
+    )
+    responses += "".join(
+        f"<d:response><d:href>{href}</d:href><d:propstat><d:prop><d:getcontentlength>100</d:getcontentlength>"
+        f"<d:getlastmodified>Sat, 06 Jul 2024 12:00:00 GMT</d:getlastmodified><d:getetag>{etag}</d:getetag>"
+        f"<d:resourcetype/></d:prop></d:propstat></d:response>"
+        for href, etag in etags.items()
+    )
+    return f'<?xml version="1.0"?><d:multistatus xmlns:d="DAV:">{responses}</d:multistatus>'
+
+
+@pytest.fixture
+def mock_webdav():
+    """Ersetzt Nextcloud durch einen Transport mit 20 Rezepten, das dritte schlägt einmal fehl"""
+    base = "/remote.php/dav/files/tester/Recipes"
+    state = {"active": 0, "max_active": 0, "attempts": dict(), "propfinds": list(), "deny_infinity": False,
+             "failing_folders": set(),
+             "etags": {f"{base}/Rezept {i}/recipe.json": '"v1"' for i in range(20)} | {f"{base}/Rezept 0/full.jpg": '"v1"'}}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.method == "PROPFIND":
+            depth, path = request.headers["Depth"], unquote(request.url.path).rstrip("/")
+            state["propfinds"].append((depth, path))
+            if depth == "infinity":
+                if state["deny_infinity"]:
+                    return httpx.Response(403)
+                return httpx.Response(207, text=_propfind_response(state["etags"]))
+            if path == base:
+                folders = sorted({href.rsplit("/", 1)[0] + "/" for href in state["etags"]})
+                return httpx.Response(207, text=_propfind_response(dict(), [f"{base}/"] + folders))
+            if path in state["failing_folders"]:
+                return httpx.Response(503)
+            files = {href: etag for href, etag in state["etags"].items() if href.rsplit("/", 1)[0] == path}
+            return httpx.Response(207, text=_propfind_response(files, [f"{path}/"]))
+
+        name = request.url.path.split("/")[-2]
+        state["attempts"][name] = state["attempts"].get(name, 0) + 1
+        if name == "Rezept 2" and state["attempts"][name] == 1:
+            return httpx.Response(503)
+
+        state["active"] += 1
+        state["max_active"] = max(state["max_active"], state["active"])
+        await asyncio.sleep(0.01)
+        state["active"] -= 1
+        return httpx.Response(200, json={"name": name, "recipeIngredient": [], "recipeInstructions": []})
+
+    clients = NextcloudClients(transport=httpx.MockTransport(handler))
+    with patch.multiple(nextcloud_webdav, NEXTCLOUD_CLIENTS=clients, NEXTCLOUD_URL="https://cloud.example.com",
+                        NEXTCLOUD_USERNAME="tester", NEXTCLOUD_APP_PASSWORD="secret",
+                        WEBDAV_BASE_URL="https://cloud.example.com/remote.php/dav/files/tester/",
+                        NEXTCLOUD_SYNC_RETRY_DELAY=0.0):
+        yield state
+
+
+@pytest.mark.asyncio
+async def test_iter_all_recipes_concurrent(mock_webdav):
+    """Downloads laufen begrenzt gleichzeitig, fehlgeschlagene Dateien werden wiederholt"""
+    progress = list()
+    recipes = [r async for r in nextcloud_webdav.iter_all_recipes(concurrency=4,
+                                                                  on_progress=lambda p: progress.append(p.done))]
+
+    assert sorted(r.name for r in recipes) == sorted(f"Rezept {i}" for i in range(20))
+    assert 1 < mock_webdav["max_active"] <= 4
+    assert mock_webdav["attempts"]["Rezept 2"] == 2
+    assert progress == list(range(1, 21))
+
+
+@pytest.mark.asyncio
+async def test_iter_all_recipes_failing_progress_callback(mock_webdav):
+    """Ein fehlerhafter Fortschritts-Callback beendet den Download nicht"""
+    def _on_progress(progress):
+        raise ValueError("kaputt")
+
+    recipes = await asyncio.wait_for(
+        _collect(nextcloud_webdav.iter_all_recipes(concurrency=4, on_progress=_on_progress)), timeout=5)
+
+    assert len(recipes) == 20
+
+
+@pytest.mark.asyncio
+async def test_download_all_raises_worker_errors(mock_webdav):
+    """Scheitert ein Worker außerhalb der Fehlerbehandlung, wartet der Aufrufer nicht auf fehlende Ergebnisse"""
+    class _WorkerError(BaseException):
+        pass
+
+    async def _download_recipe(client, remote_file, progress=None):
+        raise _WorkerError()
+
+    client = nextcloud_webdav._client()
+    remote_files = await nextcloud_webdav.find_recipe_files(client)
+
+    with patch.object(nextcloud_webdav, "download_recipe", _download_recipe):
+        with pytest.raises(_WorkerError):
+            await asyncio.wait_for(
+                _collect(nextcloud_webdav._download_all(client, remote_files[:5], 2, None)), timeout=5)
+
+
+async def _collect(iterator):
+    return [item async for item in iterator]
+
+
+@pytest.mark.asyncio
+async def test_iter_all_recipes_early_stop(mock_webdav):
+    """Aufrufer können Rezepte verwenden, bevor alle geladen sind"""
+    async for recipe in nextcloud_webdav.iter_all_recipes(concurrency=2):
+        assert recipe.name.startswith("Rezept")
+        break
+
+    await asyncio.sleep(0.05)
+    assert len(mock_webdav["attempts"]) < 20
+
+
+@pytest.mark.asyncio
+async def test_sync_recipes_incremental(mock_webdav, tmp_path):
+    """Nach dem ersten Abgleich werden nur geänderte Dateien geladen, gelöschte als Tombstone markiert"""
+    mirror = RecipeMirror(tmp_path / "mirror.sqlite")
+    result = await nextcloud_webdav.sync_recipes(mirror)
+    assert len(result.changed) == 20 and result.failed == 0
+
+    mock_webdav["attempts"].clear()
+    result = await nextcloud_webdav.sync_recipes(mirror)
+    assert result.changed == [] and result.unchanged == 20
+    assert mock_webdav["attempts"] == {}
+
+    base = "/remote.php/dav/files/tester/Recipes"
+    mock_webdav["etags"][f"{base}/Rezept 5/recipe.json"] = '"v2"'
+    del mock_webdav["etags"][f"{base}/Rezept 7/recipe.json"]
+    result = await nextcloud_webdav.sync_recipes(mirror)
+
+    assert [r.name for r in result.changed] == ["Rezept 5"]
+    assert result.deleted == [f"{base}/Rezept 7/recipe.json"]
+    assert mock_webdav["attempts"] == {"Rezept 5": 1}
+    assert len(mirror) == 19
+    assert "Rezept 7" not in [r.name for r in mirror.recipes()]
+    assert mirror.deleted_since(0) == [f"{base}/Rezept 7/recipe.json"]
+
+
+@pytest.mark.asyncio
+async def test_sync_recipes_keeps_recipes_of_unreadable_folders(mock_webdav, tmp_path):
+    """Schlägt das Durchsuchen eines Ordners fehl, werden seine Rezepte nicht als gelöscht markiert"""
+    base = "/remote.php/dav/files/tester/Recipes"
+    mirror = RecipeMirror(tmp_path / "mirror.sqlite")
+    await nextcloud_webdav.sync_recipes(mirror)
+
+    mock_webdav["deny_infinity"] = True
+    mock_webdav["failing_folders"].add(f"{base}/Rezept 7")
+    del mock_webdav["etags"][f"{base}/Rezept 3/recipe.json"]
+    result = await nextcloud_webdav.sync_recipes(mirror)
+
+    assert result.incomplete_folders == [f"{base}/Rezept 7"]
+    assert result.deleted == [f"{base}/Rezept 3/recipe.json"]
+    assert len(mirror) == 19
+    assert "Rezept 7" in [r.name for r in mirror.recipes()]
+
+
+@pytest.mark.asyncio
+async def test_find_recipe_files_depth_one(mock_webdav):
+    """Lehnt der Server Depth: infinity ab, werden die Rezeptordner einzeln durchsucht"""
+    mock_webdav["deny_infinity"] = True
+    client = nextcloud_webdav._client()
+
+    files = await nextcloud_webdav.find_recipe_files(client)
+
+    assert sorted(f.href for f in files) == sorted(h for h in mock_webdav["etags"] if h.endswith("recipe.json"))
+    assert all(f.etag == '"v1"' and f.size == 100 for f in files)
+    assert [d for d, _ in mock_webdav["propfinds"]] == ["infinity"] + ["1"] * 21
+
+    mock_webdav["propfinds"].clear()
+    files = [f async for f in nextcloud_webdav.iter_recipe_files(client, depth="1")]
+    assert len(files) == 20
+    assert "infinity" not in [d for d, _ in mock_webdav["propfinds"]]
+
+
+@pytest.mark.asyncio
+async def test_create_put_recipe_single_io_worker(mock_webdav, tmp_path, monkeypatch):
+    """Mit einem einzigen I/O-Thread und ohne Prozesse darf das Speichern nicht blockieren"""
+    monkeypatch.setenv("NEXTCLOUD_RECIPE_FOLDER", tmp_path.as_posix())
+    buffer = io.BytesIO()
+    Image.new("RGB", (600, 400), "orange").save(buffer, format="JPEG")
+    source = ("https://example.com/gulasch.jpg", buffer.getvalue())
+
+    with patch.object(nextcloud_webdav, "EXECUTORS", Executors(cpu_workers=0, io_workers=1)) as executors, \
+            patch.object(NextcloudRecipe, "download_preview_image", lambda self: source):
+        recipe = await asyncio.wait_for(
+            create_put_recipe(Recipe(name="Gulasch", url="https://example.com/gulasch")), timeout=10)
+        executors.shutdown()
+
+    assert recipe.image == "https://example.com/gulasch.jpg"
+    assert all(tmp_path.joinpath("Gulasch", f"{name}.jpg").exists() for name in ("full", "thumb", "thumb16"))
+
+
+@pytest.mark.asyncio
+async def test_nextcloud_clients_close_replaced_clients():
+    clients = NextcloudClients(transport=httpx.MockTransport(lambda request: httpx.Response(200)))
+
+    async def _get():
+        return clients.get("https://cloud.example.com", "tester", "alt")
+
+    # -- Client eines anderen, inzwischen beendeten Event-Loops
+    other_loop_client = await asyncio.to_thread(asyncio.run, _get())
+    old_client = clients.get("https://cloud.example.com", "tester", "alt")
+    assert old_client is not other_loop_client
+
+    # -- Neues App-Passwort
+    client = clients.get("https://cloud.example.com", "tester", "neu")
+    assert client is not old_client
+    assert client.auth._auth_header == httpx.BasicAuth("tester", "neu")._auth_header
+    assert clients.get("https://cloud.example.com", "tester", "neu") is client
+
+    await asyncio.sleep(0)
+    assert other_loop_client.is_closed and old_client.is_closed
+    await clients.close()
+    assert client.is_closed